@@ -17,6 +17,7 @@ import psycopg2
 from augur import ROOT_AUGUR_DIRECTORY
 from augur.metrics import Metrics
 from augur.config import AugurConfig
+from augur.database import create_database_engine, pool_options
 from augur.logging import AugurLogging
 
 logger = logging.getLogger(__name__)
@@ -72,18 +73,19 @@ class Application():
         database_connection_string = 'postgresql://{}:{}@{}:{}/{}'.format(
             user, self.config.get_value('Database', 'password'), host, port, dbname
         )
-
-        csearch_path_options = 'augur_data'
-
-        engine = s.create_engine(database_connection_string, poolclass=s.pool.NullPool,
-            connect_args={'options': f'-csearch_path={csearch_path_options}'}, pool_pre_ping=True)
-
-        csearch_path_options += ',spdx'
-        spdx_engine = s.create_engine(database_connection_string, poolclass=s.pool.NullPool,
-            connect_args={'options': f'-csearch_path={csearch_path_options}'}, pool_pre_ping=True)
-
-        helper_engine = s.create_engine(database_connection_string, poolclass=s.pool.NullPool,
-            connect_args={'options': f'-csearch_path=augur_operations'}, pool_pre_ping=True)
+        # Processes that are not forked from this one connect with it
+        self.database_connection_string = database_connection_string
+
+        # Pooled engines are shared by the server, the housekeeper and everything else that
+        # runs in this process
+        pooling = pool_options(self.config.get_section('Database'))
+        logger.debug(f"Database pool mode: {pooling['pool_mode']}")
+
+        engine = create_database_engine(database_connection_string, 'augur_data', pooling)
+        spdx_engine = create_database_engine(database_connection_string, 'augur_data,spdx', pooling)
+        helper_engine = create_database_engine(
+            database_connection_string, 'augur_operations', pooling
+        )
 
         try:
             engine.connect().close()
@@ -13,6 +13,7 @@ from gunicorn.arbiter import Arbiter
 
 from augur.cli import initialize_logging, pass_config, pass_application
 from augur.housekeeper import Housekeeper
+from augur.scheduler import SchedulerManager
 from augur.server import Server
 from augur.application import Application
 from augur.gunicorn import AugurGunicornApp
@@ -159,8 +160,10 @@ def initialize_components(augur_app, disable_housekeeper):
 
     if not disable_housekeeper:
 
-        manager = mp.Manager()
-        broker = manager.dict()
+        # The broker's state is owned by the scheduler process, see augur.scheduler
+        manager = SchedulerManager()
+        manager.start()
+        broker = manager.Scheduler()
         housekeeper = Housekeeper(broker=broker, augur_app=augur_app)
 
         controller = augur_app.config.get_section('Workers')
@@ -0,0 +1,142 @@
+#SPDX-License-Identifier: MIT
+"""
+Per repo collection status in augur_operations.repo_collection_status, which workers update
+as they finish tasks and the housekeeper orders its repos by
+"""
+import sqlalchemy as s
+
+# Models whose status is kept under another model's name
+STATUS_MODELS = {'issues_graphql': 'issues'}
+
+# Counts the rows of a model that are stored for a repo
+COLLECTED_COUNTS = {
+    'pull_requests': """
+        SELECT COUNT(*) FROM augur_data.pull_requests WHERE repo_id = :repo_id
+    """,
+    'issues': """
+        SELECT COUNT(*) FROM augur_data.issues WHERE repo_id = :repo_id AND pull_request IS NULL
+    """,
+    'commits': """
+        SELECT COUNT(*) FROM augur_data.commits WHERE repo_id = :repo_id
+    """
+}
+
+# The repo_info columns with the number of rows of a model the platform reports
+EXPECTED_COUNTS = {'pull_requests': 'pull_request_count', 'issues': 'issues_count'}
+
+def status_model(model):
+    return STATUS_MODELS.get(model, model)
+
+def priority_order(job):
+    """ Returns the model whose status orders the job's repos, and the ORDER BY clause that
+        sends the most urgent repos first
+
+    :param job: Dict, a housekeeper job
+    """
+    if job['model'] == 'pull_requests':
+        # Repos with the most pull requests left to collect
+        return 'pull_requests', \
+            'status.expected_count - status.collected_count DESC NULLS LAST, repo.repo_id'
+    if job['model'] == 'issues' and 'repo_group_id' in job:
+        # Repos with the least of their issues collected, never collected ones first
+        return 'issues', 'CAST(status.collected_count AS DOUBLE PRECISION) / ' + \
+            '(status.expected_count + 1) NULLS FIRST, repo.repo_id'
+    if 'order' in job:
+        direction = 'DESC' if str(job['order']).upper() == 'DESC' else 'ASC'
+        return 'commits', 'COALESCE(status.collected_count, 0) {}, repo.repo_id'.format(direction)
+    return job['model'], 'repo.repo_id'
+
+def prioritized_repos(db, job):
+    """ Returns the repos of the job's repo group or repo ids, most urgent first
+
+    :param db: SQLAlchemy engine
+    :return: List of dicts with the repo_id and repo_git
+    """
+    model, order = priority_order(job)
+    where_condition = ''
+    params = {'model': model}
+    if job.get('repo_group_id'):
+        where_condition = 'WHERE repo.repo_group_id = :repo_group_id'
+        params['repo_group_id'] = job['repo_group_id']
+    elif 'repo_ids' in job:
+        where_condition = 'WHERE repo.repo_id = ANY(:repo_ids)'
+        params['repo_ids'] = [int(repo_id) for repo_id in job['repo_ids']]
+    rows = db.execute(s.sql.text("""
+        SELECT repo.repo_id, repo.repo_git
+        FROM augur_data.repo LEFT OUTER JOIN augur_operations.repo_collection_status status
+            ON status.repo_id = repo.repo_id AND status.job_model = :model
+        {}
+        ORDER BY {}
+    """.format(where_condition, order)), params).fetchall()
+    return [{'repo_id': row['repo_id'], 'repo_git': row['repo_git']} for row in rows]
+
+class CollectionStatus():
+    """ Workers record each task they finish, along with the count of the model's rows the
+        repo has afterwards. That count is taken for the one repo, so it stays cheap however
+        large the collected tables grow. Finished repo_info tasks record the counts the
+        platform reports, so the housekeeper can tell how much of a repo is left to collect.
+
+    :param db: SQLAlchemy engine
+    """
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def table_exists(db):
+        return 'repo_collection_status' in s.inspect(db).get_table_names(schema='augur_operations')
+
+    def record(self, repo_id, model, status):
+        """ Records that a task of the model finished for the repo
+
+        :param status: String, 'Success' or 'Error'
+        """
+        if repo_id is None:
+            return
+        model = status_model(model)
+        collected_count = '({})'.format(COLLECTED_COUNTS[model]) if model in COLLECTED_COUNTS \
+            else 'NULL'
+        self.db.execute(s.sql.text("""
+            INSERT INTO augur_operations.repo_collection_status
+                (repo_id, job_model, collected_count, last_status, last_collected_at)
+            VALUES (:repo_id, :model, {}, :status, CURRENT_TIMESTAMP)
+            ON CONFLICT (repo_id, job_model) DO UPDATE SET
+                collected_count = COALESCE(EXCLUDED.collected_count,
+                    repo_collection_status.collected_count),
+                last_status = EXCLUDED.last_status,
+                last_collected_at = EXCLUDED.last_collected_at,
+                updated_at = CURRENT_TIMESTAMP
+        """.format(collected_count)), {'repo_id': repo_id, 'model': model, 'status': status})
+
+        if model == 'repo_info' and status == 'Success':
+            self.record_expected_counts(repo_id)
+
+    def record_expected_counts(self, repo_id):
+        """ Stores the counts of the repo's latest repo_info as its expected counts """
+        for model, column in EXPECTED_COUNTS.items():
+            self.db.execute(s.sql.text("""
+                INSERT INTO augur_operations.repo_collection_status
+                    (repo_id, job_model, expected_count)
+                SELECT repo_id, :model, {column}
+                FROM augur_data.repo_info
+                WHERE repo_id = :repo_id
+                ORDER BY data_collection_date DESC
+                LIMIT 1
+                ON CONFLICT (repo_id, job_model) DO UPDATE SET
+                    expected_count = EXCLUDED.expected_count, updated_at = CURRENT_TIMESTAMP
+            """.format(column=column)), {'repo_id': repo_id, 'model': model})
+
+    def recount(self, model):
+        """ Counts the model's rows for every repo in one query, for workers like facade
+            that collect all repos in one task """
+        model = status_model(model)
+        self.db.execute(s.sql.text("""
+            INSERT INTO augur_operations.repo_collection_status
+                (repo_id, job_model, collected_count, last_status, last_collected_at)
+            SELECT repo.repo_id, :model, ({}), 'Success', CURRENT_TIMESTAMP
+            FROM augur_data.repo
+            ON CONFLICT (repo_id, job_model) DO UPDATE SET
+                collected_count = EXCLUDED.collected_count,
+                last_status = EXCLUDED.last_status,
+                last_collected_at = EXCLUDED.last_collected_at,
+                updated_at = CURRENT_TIMESTAMP
+        """.format(COLLECTED_COUNTS[model].replace(':repo_id', 'repo.repo_id'))), {'model': model})
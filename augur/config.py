@@ -50,9 +50,17 @@ default_config = {
             "password": "augur",
             "port": 5432,
             "user": "augur",
-            "gitlab_api_key":"gitlab_api_key"
+            "gitlab_api_key":"gitlab_api_key",
+            "pool_mode": "queue",
+            "pool_size": 5,
+            "pool_max_overflow": 10,
+            "pool_timeout": 30,
+            "pool_recycle": 1800,
+            "pool_pre_ping": 1
         },
         "Housekeeper": {
+            "task_queue": 0,
+            "api_budget": 0,
             "update_redirects": {
                 "switch": 0,
                 "repo_group_id": 0
@@ -0,0 +1,104 @@
+#SPDX-License-Identifier: MIT
+"""
+Creates the SQLAlchemy engines used by the server, housekeeper and workers
+"""
+import os
+import logging
+
+import psycopg2.extensions
+import sqlalchemy as s
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Pooling options read from the Database section of augur.config.json
+#   pool_mode: "queue" keeps up to pool_size (+ pool_max_overflow) connections open per engine,
+#       "pgbouncer" leaves pooling to a PgBouncer in transaction mode, "null" opens a new
+#       connection for every checkout
+POOL_DEFAULTS = {
+    'pool_mode': 'queue',
+    'pool_size': 5,
+    'pool_max_overflow': 10,
+    'pool_timeout': 30,
+    'pool_recycle': 1800,
+    'pool_pre_ping': 1
+}
+
+POOL_MODES = ('queue', 'pgbouncer', 'null')
+
+def pool_options(database_config):
+    """
+    Returns the pooling options of a Database config section, with defaults for missing keys
+
+    :param database_config: Dict, the Database section of the config
+    """
+    options = {key: database_config.get(key, default) for key, default in POOL_DEFAULTS.items()}
+    if options['pool_mode'] not in POOL_MODES:
+        logger.warning(f"Unknown pool_mode {options['pool_mode']}, using queue")
+        options['pool_mode'] = 'queue'
+    return options
+
+def _discard_connections_of_parent(engine):
+    """
+    Connections are not safe to use across fork(). A connection checked out in another process
+    than the one that opened it is dropped from the pool without closing it, so the parent can
+    keep using it, and a new one is opened.
+    """
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info['pid'] != pid:
+            connection_record.connection = connection_proxy.connection = None
+            raise s.exc.DisconnectionError(
+                f"Connection record belongs to pid {connection_record.info['pid']}, "
+                f"attempting to check out in pid {pid}"
+            )
+
+def _set_search_path_per_transaction(engine, search_path):
+    """
+    PgBouncer in transaction mode hands every transaction a different server connection and
+    rejects the options startup parameter, so the search_path is set at the start of each
+    transaction instead of once per connection.
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def set_search_path(conn, cursor, statement, parameters, context, executemany):
+        dbapi_connection = conn.connection.connection
+        if dbapi_connection.get_transaction_status() == \
+                psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            cursor.execute(f'SET LOCAL search_path TO {search_path}')
+
+def create_database_engine(connection_string, search_path, options={}):
+    """
+    Creates an engine for the database with the configured pooling
+
+    :param connection_string: String, the postgresql:// url of the database
+    :param search_path: String, comma separated schemas the engine's queries use
+    :param options: Dict, pooling options as returned by pool_options
+    """
+    options = {**POOL_DEFAULTS, **options}
+
+    if options['pool_mode'] == 'pgbouncer':
+        # Statements run in autocommit still get their own transaction from psycopg2
+        engine = s.create_engine(connection_string, poolclass=s.pool.NullPool)
+        _set_search_path_per_transaction(engine, search_path)
+        return engine
+
+    connect_args = {'options': f'-csearch_path={search_path}'}
+    if options['pool_mode'] == 'null':
+        return s.create_engine(
+            connection_string, poolclass=s.pool.NullPool, connect_args=connect_args,
+            pool_pre_ping=bool(int(options['pool_pre_ping']))
+        )
+
+    engine = s.create_engine(
+        connection_string, poolclass=s.pool.QueuePool, connect_args=connect_args,
+        pool_size=int(options['pool_size']), max_overflow=int(options['pool_max_overflow']),
+        pool_timeout=int(options['pool_timeout']), pool_recycle=int(options['pool_recycle']),
+        pool_pre_ping=bool(int(options['pool_pre_ping']))
+    )
+    _discard_connections_of_parent(engine)
+    return engine
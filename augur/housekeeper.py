@@ -12,7 +12,10 @@ import sqlalchemy as s
 import pandas as pd
 from sqlalchemy import MetaData
 
+from augur.collection_status import CollectionStatus, prioritized_repos
+from augur.database import create_database_engine
 from augur.logging import AugurLogging
+from augur.refresh_schedule import RefreshSchedule, load_history
 from urllib.parse import urlparse
 
 import warnings
@@ -32,9 +35,17 @@ class Housekeeper:
         self.broker_host = augur_app.config.get_value("Server", "host")
         self.broker_port = augur_app.config.get_value("Server", "port")
         self.broker = broker
+        # Send tasks to the durable task queue workers claim them from instead of the broker
+        self.task_queue = bool(augur_app.config.get_section("Housekeeper").get("task_queue", 0))
+        # Requests per hour the jobs with adaptive scheduling share, 0 for no limit
+        self.api_budget = augur_app.config.get_section("Housekeeper").get("api_budget", 0)
+        self.database_connection_string = augur_app.database_connection_string
 
         self.db = augur_app.database
         self.helper_db = augur_app.operations_database
+        # Repos are ordered by the status the workers keep, rather than by counting the
+        #   collected tables, once the database has it
+        self.collection_status_table = CollectionStatus.table_exists(self.helper_db)
 
         helper_metadata = MetaData()
         helper_metadata.reflect(self.helper_db, only=['worker_job'])
@@ -62,17 +73,26 @@ class Housekeeper:
         self.prep_jobs()
         self.augur_logging.initialize_housekeeper_logging_listener()
         logger.info("Scheduling update processes")
+        adaptive_jobs = [job for job in self.jobs if job.get('adaptive')]
         for job in self.jobs:
-            process = Process(target=self.updater_process, name=job["model"], args=(self.broker_host, self.broker_port, self.broker, job, (self.augur_logging.housekeeper_job_config, self.augur_logging.get_config())))
+            refresh = None
+            if job in adaptive_jobs or job.get('prioritized'):
+                api_budget = self.api_budget / len(adaptive_jobs) if job in adaptive_jobs else 0
+                refresh = (self.database_connection_string, api_budget)
+            process = Process(target=self.updater_process, name=job["model"], args=(self.broker_host, self.broker_port, self.broker, job, (self.augur_logging.housekeeper_job_config, self.augur_logging.get_config()), self.task_queue, refresh))
             self._processes.append(process)
             process.start()
 
 
     @staticmethod
-    def updater_process(broker_host, broker_port, broker, job, logging_config):
+    def updater_process(broker_host, broker_port, broker, job, logging_config, task_queue=False,
+            refresh=None):
         """
         Controls a given plugin's update process
 
+        :param refresh: Tuple of the database connection string and the job's api budget for
+            jobs with adaptive scheduling, which only send the repos that are due, and for jobs
+            whose repos are ordered again by their collection status before every pass
         """
         logging.config.dictConfig(logging_config[0])
         logger = logging.getLogger(f"augur.jobs.{job['model']}")
@@ -88,25 +108,63 @@ class Housekeeper:
             repo_group_id = None
             logger.info('Housekeeper spawned {} model updater process for repo ids {}'.format(job['model'], job['repo_ids']))
 
+        schedule = None
+        if refresh is not None:
+            database_connection_string, api_budget = refresh
+            db = create_database_engine(database_connection_string, 'augur_data', {'pool_mode': 'null'})
+        if job.get('adaptive'):
+            # Repos that change every pass are collected every pass
+            schedule = RefreshSchedule(
+                job.get('min_interval', job['delay']),
+                max_interval=job.get('max_interval', 30 * 24 * 60 * 60),
+                dormant_after=job.get('dormant_after', 365 * 24 * 60 * 60),
+                api_budget=api_budget
+            )
+            last_pass = time.time() - job['delay']
+
         try:
             compatible_worker_found = False
             # Waiting for compatible worker
             while True:
                 if not compatible_worker_found:
-                    for worker in list(broker._getvalue().keys()):
-                        if job['model'] in broker[worker]['models'] and job['given'] in broker[worker]['given']:
-                            compatible_worker_found = True
+                    # Workers that claim tasks from the task queue do not have to be known to the broker
+                    compatible_worker_found = task_queue or broker.has_compatible_worker(job['given'], job['model'])
                     time.sleep(3)
                     continue
 
                 logger.info("Housekeeper recognized that the broker has a worker that " + 
                     "can handle the {} model... beginning to distribute maintained tasks".format(job['model']))
+                first_pass = True
                 while True:
                     logger.info('Housekeeper updating {} model with given {}...'.format(
                         job['model'], job['given'][0]))
-                    
+
+                    # The order prep_jobs found is used for the first pass, as it resumes
+                    #   where the last run of the model stopped
+                    if job.get('prioritized') and not first_pass:
+                        try:
+                            job['repos'] = prioritized_repos(db, job)
+                            if 'all_focused' in job:
+                                for repo in job['repos']:
+                                    repo['focused_task'] = job['all_focused']
+                        except Exception as e:
+                            logger.error("Could not order the repos again, keeping their order: {}".format(e))
+                    first_pass = False
+
+                    repos = job['repos']
                     if job['given'][0] == 'git_url' or job['given'][0] == 'github_url':
-                        for repo in job['repos']:
+                        if schedule is not None:
+                            try:
+                                histories = load_history(db, job['model'], [repo['repo_id'] for repo in repos])
+                                repos = schedule.due(repos, histories, time.time() - last_pass)
+                            except Exception as e:
+                                logger.error("Could not read the collection history, sending every repo: {}".format(e))
+                            last_pass = time.time()
+                            logger.info("{} of {} repos are due for the {} model".format(
+                                len(repos), len(job['repos']), job['model']))
+
+                        queued_tasks = []
+                        for repo in repos:
                             if job['given'][0] == 'github_url' and 'github.com' not in repo['repo_git']:
                                 continue
                             given_key = 'git_url' if job['given'][0] == 'git_url' else 'github_url'
@@ -119,6 +177,9 @@ class Housekeeper:
                             task['given'][given_key] = repo['repo_git']
                             if "focused_task" in repo:
                                 task["focused_task"] = repo['focused_task']
+                            if task_queue:
+                                queued_tasks.append(task)
+                                continue
                             try:
                                 requests.post('http://{}:{}/api/unstable/task'.format(
                                     broker_host,broker_port), json=task, timeout=10)
@@ -127,7 +188,18 @@ class Housekeeper:
 
                             logger.debug(task)
 
-                            time.sleep(15)
+                            # The repos of an adaptive pass are few and already paced by its budget
+                            if schedule is None:
+                                time.sleep(15)
+
+                        if task_queue:
+                            # All of the job's tasks are queued at once, the workers claim them
+                            #   from the database as they have room for them
+                            try:
+                                requests.post('http://{}:{}/api/unstable/task_queue'.format(
+                                    broker_host,broker_port), json=queued_tasks, timeout=120)
+                            except Exception as e:
+                                logger.error("Error encountered: {}".format(e))
 
                     elif job['given'][0] == 'repo_group':
                         task = {
@@ -139,12 +211,16 @@ class Housekeeper:
                                 }
                             }
                         try:
-                            requests.post('http://{}:{}/api/unstable/task'.format(
-                                broker_host,broker_port), json=task, timeout=10)
+                            if task_queue:
+                                requests.post('http://{}:{}/api/unstable/task_queue'.format(
+                                    broker_host,broker_port), json=[task], timeout=10)
+                            else:
+                                requests.post('http://{}:{}/api/unstable/task'.format(
+                                    broker_host,broker_port), json=task, timeout=10)
                         except Exception as e:
                             logger.error("Error encountered: {}".format(e))
 
-                    logger.info("Housekeeper finished sending {} tasks to the broker for it to distribute to your worker(s)".format(len(job['repos'])))
+                    logger.info("Housekeeper finished sending {} tasks to the broker for it to distribute to your worker(s)".format(len(repos)))
                     time.sleep(job['delay'])
 
         except KeyboardInterrupt as e:
@@ -175,75 +251,81 @@ class Housekeeper:
                 where_condition = '{} repo_group_id = {}'.format(where_and, job['repo_group_id']
                     ) if 'repo_group_id' in job and job['repo_group_id'] != 0 else '{} repo.repo_id IN ({})'.format(
                     where_and, ",".join(str(id) for id in job['repo_ids'])) if 'repo_ids' in job else ''
-                repo_url_sql = s.sql.text("""
-                        SELECT repo.repo_id, repo.repo_git, pull_request_count, collected_pr_count, 
-                        (repo_info.pull_request_count - pr_count.collected_pr_count) AS pull_requests_missing
-                        FROM augur_data.repo LEFT OUTER JOIN (
-                            SELECT count(*) AS collected_pr_count, repo_id 
-                            FROM pull_requests GROUP BY repo_id ) pr_count 
-                        ON pr_count.repo_id = repo.repo_id LEFT OUTER JOIN ( 
-                            SELECT repo_id, MAX ( data_collection_date ) AS last_collected 
-                            FROM augur_data.repo_info 
-                            GROUP BY repo_id) recent_info 
-                        ON recent_info.repo_id = pr_count.repo_id LEFT OUTER JOIN repo_info 
-                        ON recent_info.repo_id = repo_info.repo_id
-                            AND repo_info.data_collection_date = recent_info.last_collected
-                        {}
-                        GROUP BY repo.repo_id, repo_info.pull_request_count, pr_count.collected_pr_count
-                        ORDER BY pull_requests_missing DESC NULLS LAST
-                    """.format(where_condition)) if job['model'] == 'pull_requests' else s.sql.text("""
-                        SELECT
-                            * 
-                        FROM
-                            (
-                                ( SELECT repo_git, repo.repo_id, issues_enabled, COUNT ( * ) AS meta_count 
-                                FROM repo left outer join repo_info on repo.repo_id = repo_info.repo_id
-                                --WHERE issues_enabled = 'true' 
-                                GROUP BY repo.repo_id, issues_enabled 
-                                ORDER BY repo.repo_id ) zz
-                                LEFT OUTER JOIN (
-                                SELECT repo.repo_id,
-                                    repo.repo_name,
-                                    b.issues_count,
-                                    d.repo_id AS issue_repo_id,
-                                    e.last_collected,
-                                    COUNT ( * ) AS issues_collected_count,
-                                    (
-                                    b.issues_count - COUNT ( * )) AS issues_missing,
-                                    ABS (
-                                    CAST (( COUNT ( * )) AS DOUBLE PRECISION ) / CAST ( b.issues_count + 1 AS DOUBLE PRECISION )) AS ratio_abs,
-                                    (
-                                    CAST (( COUNT ( * )) AS DOUBLE PRECISION ) / CAST ( b.issues_count + 1 AS DOUBLE PRECISION )) AS ratio_issues 
-                                FROM
-                                    augur_data.repo left outer join  
-                                    augur_data.pull_requests d on d.repo_id = repo.repo_id left outer join 
-                                    augur_data.repo_info b on d.repo_id = b.repo_id left outer join
-                                    ( SELECT repo_id, MAX ( data_collection_date ) AS last_collected FROM augur_data.repo_info GROUP BY repo_id ORDER BY repo_id ) e 
-                                                                        on e.repo_id = d.repo_id and b.data_collection_date = e.last_collected
-                                WHERE d.pull_request_id IS NULL
-                                {}
-                                GROUP BY
-                                    repo.repo_id,
-                                    d.repo_id,
-                                    b.issues_count,
-                                    e.last_collected 
-                                ORDER BY ratio_abs 
-                                ) yy ON zz.repo_id = yy.repo_id 
-                            ) D
-                        ORDER BY ratio_abs NULLS FIRST
-                    """.format(where_condition)) if job['model'] == 'issues' and 'repo_group_id' in job else s.sql.text(""" 
-                        SELECT repo_git, repo_id FROM repo {} ORDER BY repo_id ASC
-                    """.format(where_condition)) if 'order' not in job else s.sql.text(""" 
-                        SELECT repo_git, repo.repo_id, count(*) as commit_count 
-                        FROM augur_data.repo left outer join augur_data.commits 
-                            on repo.repo_id = commits.repo_id 
-                        {}
-                        group by repo.repo_id ORDER BY commit_count {}
-                    """.format(where_condition, job['order']))
+                if self.collection_status_table:
+                    reorganized_repos = pd.DataFrame(
+                        prioritized_repos(self.db, job), columns=['repo_id', 'repo_git'])
+                    # Ordered again before every pass, see updater_process
+                    job['prioritized'] = True
+                else:
+                    repo_url_sql = s.sql.text("""
+                            SELECT repo.repo_id, repo.repo_git, pull_request_count, collected_pr_count, 
+                            (repo_info.pull_request_count - pr_count.collected_pr_count) AS pull_requests_missing
+                            FROM augur_data.repo LEFT OUTER JOIN (
+                                SELECT count(*) AS collected_pr_count, repo_id 
+                                FROM pull_requests GROUP BY repo_id ) pr_count 
+                            ON pr_count.repo_id = repo.repo_id LEFT OUTER JOIN ( 
+                                SELECT repo_id, MAX ( data_collection_date ) AS last_collected 
+                                FROM augur_data.repo_info 
+                                GROUP BY repo_id) recent_info 
+                            ON recent_info.repo_id = pr_count.repo_id LEFT OUTER JOIN repo_info 
+                            ON recent_info.repo_id = repo_info.repo_id
+                                AND repo_info.data_collection_date = recent_info.last_collected
+                            {}
+                            GROUP BY repo.repo_id, repo_info.pull_request_count, pr_count.collected_pr_count
+                            ORDER BY pull_requests_missing DESC NULLS LAST
+                        """.format(where_condition)) if job['model'] == 'pull_requests' else s.sql.text("""
+                            SELECT
+                                * 
+                            FROM
+                                (
+                                    ( SELECT repo_git, repo.repo_id, issues_enabled, COUNT ( * ) AS meta_count 
+                                    FROM repo left outer join repo_info on repo.repo_id = repo_info.repo_id
+                                    --WHERE issues_enabled = 'true' 
+                                    GROUP BY repo.repo_id, issues_enabled 
+                                    ORDER BY repo.repo_id ) zz
+                                    LEFT OUTER JOIN (
+                                    SELECT repo.repo_id,
+                                        repo.repo_name,
+                                        b.issues_count,
+                                        d.repo_id AS issue_repo_id,
+                                        e.last_collected,
+                                        COUNT ( * ) AS issues_collected_count,
+                                        (
+                                        b.issues_count - COUNT ( * )) AS issues_missing,
+                                        ABS (
+                                        CAST (( COUNT ( * )) AS DOUBLE PRECISION ) / CAST ( b.issues_count + 1 AS DOUBLE PRECISION )) AS ratio_abs,
+                                        (
+                                        CAST (( COUNT ( * )) AS DOUBLE PRECISION ) / CAST ( b.issues_count + 1 AS DOUBLE PRECISION )) AS ratio_issues 
+                                    FROM
+                                        augur_data.repo left outer join  
+                                        augur_data.pull_requests d on d.repo_id = repo.repo_id left outer join 
+                                        augur_data.repo_info b on d.repo_id = b.repo_id left outer join
+                                        ( SELECT repo_id, MAX ( data_collection_date ) AS last_collected FROM augur_data.repo_info GROUP BY repo_id ORDER BY repo_id ) e 
+                                                                            on e.repo_id = d.repo_id and b.data_collection_date = e.last_collected
+                                    WHERE d.pull_request_id IS NULL
+                                    {}
+                                    GROUP BY
+                                        repo.repo_id,
+                                        d.repo_id,
+                                        b.issues_count,
+                                        e.last_collected 
+                                    ORDER BY ratio_abs 
+                                    ) yy ON zz.repo_id = yy.repo_id 
+                                ) D
+                            ORDER BY ratio_abs NULLS FIRST
+                        """.format(where_condition)) if job['model'] == 'issues' and 'repo_group_id' in job else s.sql.text(""" 
+                            SELECT repo_git, repo_id FROM repo {} ORDER BY repo_id ASC
+                        """.format(where_condition)) if 'order' not in job else s.sql.text(""" 
+                            SELECT repo_git, repo.repo_id, count(*) as commit_count 
+                            FROM augur_data.repo left outer join augur_data.commits 
+                                on repo.repo_id = commits.repo_id 
+                            {}
+                            group by repo.repo_id ORDER BY commit_count {}
+                        """.format(where_condition, job['order']))
                 
-                reorganized_repos = pd.read_sql(repo_url_sql, self.db, params={})
+                    reorganized_repos = pd.read_sql(repo_url_sql, self.db, params={})
                 if len(reorganized_repos) == 0:
-                    logger.warning("Trying to send tasks for repo group, but the repo group does not contain any repos: {}".format(repo_url_sql))
+                    logger.warning("Trying to send tasks for repo group, but the repo group does not contain any repos: {}".format(job))
                     job['repos'] = []
                     continue
 
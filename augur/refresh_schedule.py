@@ -0,0 +1,165 @@
+#SPDX-License-Identifier: MIT
+"""
+Decides which repos of a housekeeper job are due for collection, from how often their past
+collections found new data
+"""
+import datetime
+import math
+
+import sqlalchemy as s
+
+DAY = 24 * 60 * 60
+
+# Only this many of a repo's latest collections are used to estimate how often it changes
+RECENT_RUNS = 10
+
+class RefreshSchedule():
+    """ Each repo is collected again after the time in which it is expected to change once.
+        That time is estimated from its recent collections: if a share p of collections
+        made every g seconds found new rows, changes arrive at a rate of -ln(1 - p) / g.
+        Repos that were pushed to since their last collection are due right away, repos that
+        were not pushed to for dormant_after seconds are collected every max_interval.
+
+        The repos that are due are sent most overdue first, until the requests they are
+        expected to make use up the api_budget of the pass.
+
+    :param min_interval: Integer, seconds a repo waits at least between collections
+    :param max_interval: Integer, seconds a repo waits at most between collections
+    :param dormant_after: Integer, seconds without a push after which a repo is dormant
+    :param api_budget: Integer, requests per hour the job may spend, 0 for no limit
+    """
+    def __init__(self, min_interval, max_interval=30 * DAY, dormant_after=365 * DAY,
+            api_budget=0):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.dormant_after = dormant_after
+        self.api_budget = api_budget
+
+    def interval(self, history, now):
+        """ Returns the seconds the repo should wait between collections
+
+        :param history: Dict, the repo's row of load_history
+        """
+        last_pushed = history.get('last_pushed')
+        if last_pushed is not None and (now - last_pushed).total_seconds() > self.dormant_after:
+            return self.max_interval
+
+        runs = history.get('runs') or 0
+        if runs < 2:
+            return self.min_interval
+        gap = (history['last_collected'] - history['first_collected']).total_seconds() / (runs - 1)
+        if gap <= 0:
+            return self.min_interval
+
+        # Smoothed, so a few empty or productive runs do not pin the estimate to 0 or 1
+        changed = (history['productive_runs'] + 0.5) / (runs + 1)
+        rate = -math.log(1 - changed) / gap
+        return int(min(max(1 / rate, self.min_interval), self.max_interval))
+
+    def overdue(self, history, now):
+        """ Returns how many of its intervals the repo is past its last collection, the repo
+            is due when it is at least 1. Repos that were never collected or were pushed to
+            since are infinitely overdue. """
+        last_collected = history.get('last_collected')
+        if last_collected is None:
+            return math.inf
+        last_pushed = history.get('last_pushed')
+        if last_pushed is not None and last_pushed > last_collected:
+            return math.inf
+        return (now - last_collected).total_seconds() / self.interval(history, now)
+
+    def due(self, repos, histories, elapsed, now=None):
+        """ Returns the repos to collect in this pass, most overdue first
+
+        :param repos: List of dicts with a repo_id, e.g. a job's repos
+        :param histories: Dict, repo_id -> history as returned by load_history
+        :param elapsed: Integer, seconds since the previous pass, the budget grows with it
+        """
+        now = now or datetime.datetime.now()
+        ranked = []
+        for position, repo in enumerate(repos):
+            history = histories.get(repo['repo_id'], {})
+            overdue = self.overdue(history, now)
+            if overdue >= 1:
+                ranked.append((-overdue, position, repo))
+        ranked.sort(key=lambda entry: entry[:2])
+
+        if not self.api_budget:
+            return [repo for _, _, repo in ranked]
+
+        known_costs = [
+            history['requests'] for history in histories.values() if history.get('requests')
+        ]
+        default_cost = sum(known_costs) / len(known_costs) if known_costs else 1
+        budget = self.api_budget * elapsed / 3600
+
+        due_repos = []
+        for _, _, repo in ranked:
+            cost = histories.get(repo['repo_id'], {}).get('requests') or default_cost
+            # The first repo is always sent, so repos that cost more than a pass can afford
+            #   are still collected eventually
+            if due_repos and cost > budget:
+                break
+            budget -= cost
+            due_repos.append(repo)
+        return due_repos
+
+def load_history(db, model, repo_ids):
+    """ Returns the recent collections of the model for the repos, and when they were last
+        pushed to
+
+    :param db: SQLAlchemy engine
+    :return: Dict, repo_id -> {'runs', 'productive_runs', 'first_collected',
+        'last_collected', 'requests', 'last_pushed'}
+    """
+    if not repo_ids:
+        return {}
+    operations_tables = s.inspect(db).get_table_names(schema='augur_operations')
+    # Collections made before task metrics were recorded count their results instead
+    if 'worker_task_metrics' in operations_tables:
+        runs_sql = """
+            SELECT repo_id, started_at AS collected_at, rows_inserted AS new_rows,
+                request_count
+            FROM augur_operations.worker_task_metrics
+            WHERE job_model = :model AND status = 'Success' AND repo_id = ANY(:repo_ids)
+        """
+    else:
+        runs_sql = """
+            SELECT repo_id, timestamp AS collected_at, total_results AS new_rows,
+                NULL::int8 AS request_count
+            FROM augur_operations.worker_history
+            WHERE job_model = :model AND status = 'Success' AND repo_id = ANY(:repo_ids)
+        """
+    params = {'model': model, 'repo_ids': [int(repo_id) for repo_id in repo_ids]}
+    rows = db.execute(s.sql.text("""
+        WITH runs AS ({}),
+        recent_runs AS (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY repo_id ORDER BY collected_at DESC)
+                AS recency
+            FROM runs
+        )
+        SELECT repo_id, COUNT(*) AS runs,
+            COUNT(*) FILTER (WHERE new_rows > 0) AS productive_runs,
+            MIN(collected_at) AS first_collected, MAX(collected_at) AS last_collected,
+            AVG(request_count) AS requests
+        FROM recent_runs
+        WHERE recency <= :recent_runs
+        GROUP BY repo_id
+    """.format(runs_sql)), {**params, 'recent_runs': RECENT_RUNS}).fetchall()
+    histories = {
+        row['repo_id']: {
+            'runs': row['runs'], 'productive_runs': row['productive_runs'],
+            'first_collected': row['first_collected'], 'last_collected': row['last_collected'],
+            'requests': float(row['requests']) if row['requests'] is not None else None
+        } for row in rows
+    }
+
+    pushes = db.execute(s.sql.text("""
+        SELECT DISTINCT ON (repo_id) repo_id, last_updated
+        FROM augur_data.repo_info
+        WHERE repo_id = ANY(:repo_ids) AND last_updated IS NOT NULL
+        ORDER BY repo_id, data_collection_date DESC
+    """), params).fetchall()
+    for row in pushes:
+        histories.setdefault(row['repo_id'], {})['last_pushed'] = row['last_updated']
+    return histories
@@ -5,65 +5,117 @@ Creates routes for the broker
 
 import logging
 import time
+import threading
 import subprocess
 import requests
 import json
+from concurrent import futures
 from flask import request, Response
 
+from augur.scheduler import worker_type
+from augur.task_queue import TaskQueue
+
 logger = logging.getLogger(__name__)
 
 # TODO: not this...
 def worker_start(worker_name=None):
     process = subprocess.Popen("cd workers/{} && {}_start".format(worker_name,worker_name), shell=True)
 
-def send_task(worker_proxy):
-
-    # Defining local variables for convenience/readability
-    user_queue = worker_proxy['user_queue']
-    maintain_queue = worker_proxy['maintain_queue']
-    worker_id = worker_proxy['id']
-    task_endpoint = worker_proxy['location'] + '/AUGWOP/task'
-
-    # Check if worker is alive
-    r = requests.get('{}/AUGWOP/heartbeat'.format(
-        worker_proxy['location']))
-    j = r.json()
-
-    if 'status' not in j:
-        logger.error("Worker: {}'s heartbeat did not return a response, setting worker status as 'Disconnected'\n".format(worker_id))
-        worker_proxy['status'] = 'Disconnected'
-        return
+class Dispatcher():
+    """ Sends workers their tasks on background threads, so the routes that queue tasks or
+        free slots return without waiting on the workers.
+
+        Workers that were heard from (a completed or failed task, a heartbeat or a delivered
+        task) in the last LIVENESS_SECONDS are not asked for a heartbeat again, and
+        all the tasks a worker has free slots for are delivered in one request.
+
+    :param scheduler: Proxy of the broker's Scheduler
+    """
+    LIVENESS_SECONDS = 60
+    HEARTBEAT_TIMEOUT = 5
+    DELIVERY_TIMEOUT = 10
+    THREADS = 4
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self._executor = futures.ThreadPoolExecutor(max_workers=self.THREADS)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._last_seen = {}
+
+    def mark_alive(self, worker_id):
+        self._last_seen[worker_id] = time.monotonic()
+
+    def dispatch(self, worker_id, location):
+        """ Schedules sending the worker tasks for its free slots, unless that is already
+            scheduled and has not started yet """
+        with self._lock:
+            if worker_id in self._pending:
+                return
+            self._pending.add(worker_id)
+        self._executor.submit(self._send_tasks, worker_id, location)
+
+    def _alive(self, worker_id, location):
+        if worker_id in self._last_seen and \
+                time.monotonic() - self._last_seen[worker_id] < self.LIVENESS_SECONDS:
+            return True
 
-    if j['status'] != 'alive':
-        logger.info("Worker: {} is busy, setting its status as so.\n".format(worker_id))
-        return
+        try:
+            j = requests.get('{}/AUGWOP/heartbeat'.format(location),
+                timeout=self.HEARTBEAT_TIMEOUT).json()
+        except Exception:
+            j = {}
 
-    # Want to check user-created job requests first
-    if len(user_queue) > 0:
-        new_task = user_queue.pop(0)
+        if 'status' not in j:
+            logger.error("Worker: {}'s heartbeat did not return a response, setting worker status as 'Disconnected'\n".format(worker_id))
+            self.scheduler.set_status(worker_id, 'Disconnected')
+            return False
 
-    # If no user-created job requests, move on to regulated/maintained ones
-    elif len(maintain_queue) > 0:
-        new_task = maintain_queue.pop(0)
+        if j['status'] != 'alive':
+            logger.info("Worker: {} is busy, setting its status as so.\n".format(worker_id))
+            return False
 
-    else:
-        logger.debug("Both queues are empty for worker {}\n".format(worker_id))
-        worker_proxy['status'] = 'Idle'
-        return
+        self.mark_alive(worker_id)
+        return True
 
-    logger.info("Worker {} is idle, preparing to send the {} task to {}\n".format(worker_id, new_task['display_name'], task_endpoint))
-    try:
-        requests.post(task_endpoint, json=new_task)
-        worker_proxy['status'] = 'Working'
-    except:
-        logger.error("Sending Worker: {} a task did not return a response, setting worker status as 'Disconnected'\n".format(worker_id))
-        worker_proxy['status'] = 'Disconnected'
-        # If the worker died, then restart it
-        worker_start(worker_id.split('.')[len(worker_id.split('.')) - 2])
+    def _send_tasks(self, worker_id, location):
+        # Tasks queued from here on are sent by the next dispatch
+        with self._lock:
+            self._pending.discard(worker_id)
 
+        try:
+            if not self._alive(worker_id, location):
+                return
+
+            # Workers with a task_concurrency above 1 work on that many tasks at once
+            new_tasks = self.scheduler.next_tasks(worker_id)
+            if not new_tasks:
+                logger.debug("No task to send or no free slot for worker {}\n".format(worker_id))
+                return
+
+            task_endpoint = location + '/AUGWOP/task'
+            logger.info("Worker {} is idle, preparing to send the {} tasks to {}\n".format(
+                worker_id, [new_task['display_name'] for new_task in new_tasks], task_endpoint))
+            try:
+                requests.post(task_endpoint, json=new_tasks, timeout=self.DELIVERY_TIMEOUT)
+                self.mark_alive(worker_id)
+            except Exception:
+                logger.error("Sending Worker: {} a task did not return a response, setting worker status as 'Disconnected'\n".format(worker_id))
+                for new_task in reversed(new_tasks):
+                    self.scheduler.requeue(worker_id, new_task)
+                self.scheduler.set_status(worker_id, 'Disconnected')
+                self._last_seen.pop(worker_id, None)
+                # If the worker died, then restart it
+                worker_start(worker_type(worker_id))
+        except Exception as e:
+            logger.error("Ran into error while dispatching to {}: {}\n".format(worker_id, repr(e)))
 
 def create_routes(server):
 
+    # Worker state lives in the scheduler process, see augur.scheduler
+    scheduler = server.broker
+    dispatcher = Dispatcher(scheduler)
+
     @server.app.route('/{}/task'.format(server.api_version), methods=['POST'])
     def task():
         """ AUGWOP route that is hit when data needs to be added to the database
@@ -71,57 +123,39 @@ def create_routes(server):
         """
         task = request.json
 
-        given = []
-        for given_component in list(task['given'].keys()):
-            given.append(given_component)
+        given = list(task['given'].keys())
         model = task['models'][0]
         logger.info("Broker recieved a new user task ... checking for compatible workers for given: " + str(given) + " and model(s): " + str(model) + "\n")
 
-        logger.debug("Broker's list of all workers: {}\n".format(server.broker._getvalue().keys()))
-
-        worker_found = False
-        compatible_workers = {}
-
-        # For every worker the broker is aware of that can fill the task's given and model
-        for worker_id in [id for id in list(server.broker._getvalue().keys()) if model in server.broker[id]['models'] and given in server.broker[id]['given']]:
-            if type(server.broker[worker_id]._getvalue()) != dict:
-                continue
-
-            logger.debug("Considering compatible worker: {}\n".format(worker_id))
-
-            # Group workers by type (all gh workers grouped together etc)
-            worker_type = worker_id.split('.')[len(worker_id.split('.'))-2]
-            compatible_workers[worker_type] = compatible_workers[worker_type] if worker_type in compatible_workers else {'task_load': len(server.broker[worker_id]['user_queue']) + len(server.broker[worker_id]['maintain_queue']), 'worker_id': worker_id}
-
-            # Make worker that is prioritized the one with the smallest sum of task queues
-            if (len(server.broker[worker_id]['user_queue']) + len(server.broker[worker_id]['maintain_queue'])) < min([compatible_workers[w]['task_load'] for w in compatible_workers.keys() if worker_type == w]):
-                logger.debug("Worker id: {} has the smallest task load encountered so far: {}\n".format(worker_id, len(server.broker[worker_id]['user_queue']) + len(server.broker[worker_id]['maintain_queue'])))
-                compatible_workers[worker_type]['task_load'] = len(server.broker[worker_id]['user_queue']) + len(server.broker[worker_id]['maintain_queue'])
-                compatible_workers[worker_type]['worker_id'] = worker_id
+        # Queued for every type of worker that can collect it, the least loaded worker of
+        #   each type with a free slot is sent tasks right away
+        ready_workers = scheduler.enqueue(task)
 
-        for worker_type in compatible_workers.keys():
-            worker_id = compatible_workers[worker_type]['worker_id']
-            worker = server.broker[worker_id]
-            logger.info("Final compatible worker chosen: {} with smallest task load: {} found to work on task: {}\n".format(worker_id, len(server.broker[worker_id]['user_queue']) + len(server.broker[worker_id]['maintain_queue']), task))
-
-            if task['job_type'] == "UPDATE":
-                worker['user_queue'].append(task)
-                logger.info("Added task for model: {}. New length of worker {}'s user queue: {}\n".format(model, worker_id, str(len(server.broker[worker_id]['user_queue']))))
-            elif task['job_type'] == "MAINTAIN":
-                worker['maintain_queue'].append(task)
-                logger.info("Added task for model: {}. New length of worker {}'s maintain queue: {}\n".format(model, worker_id, str(len(server.broker[worker_id]['maintain_queue']))))
-
-            if worker['status'] == 'Idle':
-                send_task(worker)
-            worker_found = True
         # Otherwise, let the frontend know that the request can't be served
-        if not worker_found:
+        if ready_workers is None:
             logger.warning("Augur does not have knowledge of any workers that are capable of handing the request: {}\n".format(task))
 
+        for worker_id, location in ready_workers or []:
+            logger.info("Worker chosen: {} to work on task: {}\n".format(worker_id, task))
+            dispatcher.dispatch(worker_id, location)
+
         return Response(response=task,
                         status=200,
                         mimetype="application/json")
 
+    @server.app.route('/{}/task_queue'.format(server.api_version), methods=['POST'])
+    def task_queue():
+        """ Route the housekeeper sends all the tasks of a job to at once when its task_queue
+            setting is on. They are stored in augur_operations.worker_task_queue, where workers
+            with their own task_queue setting on claim them, see augur.task_queue
+        """
+        tasks = request.json
+        queued = TaskQueue(server.augur_app.operations_database).enqueue(tasks)
+        logger.info("Queued {} of {} tasks in the task queue\n".format(queued, len(tasks)))
+        return Response(response=json.dumps({'queued': queued}),
+                        status=200,
+                        mimetype="application/json")
+
     @server.app.route('/{}/workers'.format(server.api_version), methods=['POST'])
     def worker():
         """ AUGWOP route responsible for interpreting HELLO messages
@@ -130,29 +164,17 @@ def create_routes(server):
         worker = request.json
         logger.info("Recieved HELLO message from worker {} listening on: https://localhost:{}\
                     ".format(worker['id'], worker['id'].split('.')[2]))
-        if worker['id'] not in server.broker:
-            server.broker[worker['id']] = server.manager.dict()
-            server.broker[worker['id']]['id'] = worker['id']
-            server.broker[worker['id']]['user_queue'] = server.manager.list()
-            server.broker[worker['id']]['maintain_queue'] = server.manager.list()
-            server.broker[worker['id']]['given'] = server.manager.list()
-            server.broker[worker['id']]['models'] = server.manager.list()
-            for given in worker['qualifications'][0]['given']:
-                server.broker[worker['id']]['given'].append(given)
-            for model in worker['qualifications'][0]['models']:
-                server.broker[worker['id']]['models'].append(model)
-            server.broker[worker['id']]['status'] = 'Idle'
-            server.broker[worker['id']]['location'] = worker['location']
-        else:
+        new_worker = scheduler.register_worker(
+            worker['id'], worker['qualifications'][0]['given'],
+            worker['qualifications'][0]['models'], worker['location'],
+            int(worker['config'].get('task_concurrency', 1))
+        )
+        if not new_worker:
             logger.info("Worker: {} has been reconnected.\n".format(worker['id']))
-            models = server.broker[worker['id']]['models']
-            givens = server.broker[worker['id']]['given']
-            user_queue = server.broker[worker['id']]['user_queue']
-            maintain_queue = server.broker[worker['id']]['maintain_queue']
-
-            time.sleep(10)
-            server.broker[worker['id']]['status'] = 'Idle'
-            send_task(server.broker[worker['id']])
+            # Workers say HELLO before their server is up
+            threading.Timer(
+                10, dispatcher.dispatch, args=(worker['id'], worker['location'])
+            ).start()
 
         return Response(response=worker['id'],
                         status=200,
@@ -163,17 +185,13 @@ def create_routes(server):
         task = request.json
         worker = task['worker_id']
         logger.info("Message recieved that worker {} completed task: {}\n".format(worker,task))
-        try:
-            models = server.broker[worker]['models']
-            givens = server.broker[worker]['given']
-            user_queue = server.broker[worker]['user_queue']
-            maintain_queue = server.broker[worker]['maintain_queue']
-
-            if server.broker[worker]['status'] != 'Disconnected':
-                send_task(server.broker[worker])
-        except Exception as e:
-            logger.error("Ran into error: {}\n".format(repr(e)))
+        if not scheduler.has_worker(worker):
             logger.error("A past instance of the {} worker finished a previous leftover task.\n".format(worker))
+        else:
+            dispatcher.mark_alive(worker)
+            location = scheduler.task_finished(worker)
+            if location is not None:
+                dispatcher.dispatch(worker, location)
 
         return Response(response=task,
                         status=200,
@@ -182,18 +200,9 @@ def create_routes(server):
     @server.app.route('/{}/workers/status'.format(server.api_version), methods=['GET'])
     def get_status():
         all_workers_status = []
-        for worker in server.broker.items():
-            status = {}
-            worker_id = ".".join(worker[0].split('.')[1:])
-            status[worker_id] = {}
-            status[worker_id]['id'] = worker[1]['id']
-            status[worker_id]['user_queue'] = [repo for repo in worker[1]['user_queue']]
-            status[worker_id]['maintain_queue'] = [repo for repo in worker[1]['maintain_queue']]
-            status[worker_id]['given'] = [given for given in worker[1]['given']]
-            status[worker_id]['models'] = [model for model in worker[1]['models']]
-            status[worker_id]['status'] = worker[1]['status']
-            status[worker_id]['location'] = worker[1]['location']
-            all_workers_status.append(status)
+        for worker in scheduler.status():
+            worker_id = ".".join(worker['id'].split('.')[1:])
+            all_workers_status.append({worker_id: worker})
 
         return Response(response=json.dumps(all_workers_status),
                         status=200,
@@ -203,7 +212,7 @@ def create_routes(server):
     def remove_worker():
         worker = request.json
         logger.info("Recieved a message to disconnect worker: {}\n".format(worker))
-        server.broker[worker['id']]['status'] = 'Disconnected'
+        scheduler.set_status(worker['id'], 'Disconnected')
         return Response(response=worker,
                         status=200,
                         mimetype="application/json")
@@ -213,10 +222,12 @@ def create_routes(server):
         task = request.json
         worker_id = task['worker_id']
         # logger.error("Recieved a message that {} ran into an error on task: {}\n".format(worker_id, task))
-        if worker_id in server.broker:
-            if server.broker[worker_id]['status'] != 'Disconnected':
+        if scheduler.has_worker(worker_id):
+            dispatcher.mark_alive(worker_id)
+            location = scheduler.task_finished(worker_id)
+            if location is not None:
                 logger.error("{} ran into error while completing task: {}\n".format(worker_id, task))
-                send_task(server.broker[worker_id])
+                dispatcher.dispatch(worker_id, location)
         else:
             logger.error("A previous instance of {} ran into error while completing task: {}\n".format(worker_id, task))
         return Response(response=request.json,
@@ -343,19 +343,7 @@ class Git_string():
 
 def authenticate_request(augur_app, request):
 
-    # do I like doing it like this? not at all
-    # do I have the time to implement a better solution right now? not at all
-    user = augur_app.config.get_value('Database', 'user')
-    password = augur_app.config.get_value('Database', 'password')
-    host = augur_app.config.get_value('Database', 'host')
-    port = augur_app.config.get_value('Database', 'port')
-    dbname = augur_app.config.get_value('Database', 'name')
-
-    DB_STR = 'postgresql://{}:{}@{}:{}/{}'.format(
-            user, password, host, port, dbname
-    )
-
-    operations_db = s.create_engine(DB_STR, poolclass=s.pool.NullPool)
+    operations_db = augur_app.operations_database
 
     update_api_key_sql = s.sql.text("""
         SELECT value FROM augur_operations.augur_settings WHERE setting='augur_api_key';
@@ -0,0 +1,206 @@
+#SPDX-License-Identifier: MIT
+"""
+Worker and task state of the broker, owned by a single scheduler process
+"""
+import heapq
+import itertools
+import threading
+from multiprocessing.managers import BaseManager
+
+# User requested tasks are sent before maintained ones, each kind in the order it came in
+JOB_PRIORITIES = {'UPDATE': 0, 'MAINTAIN': 1}
+
+def worker_type(worker_id):
+    """ Workers of the same type (all github workers etc.) share their queues, e.g.
+        com.augurlabs.core.github_worker.50200 -> github_worker """
+    return worker_id.split('.')[-2]
+
+class Scheduler():
+    """ Queues the broker's tasks per (worker type, given, model) capability, ordered by
+        priority in a heap, and tracks the workers that take tasks from them.
+
+        An instance lives in the process of a SchedulerManager, the gunicorn workers call
+        its methods through a proxy, so every call is a single round trip. The manager
+        serves each connection on its own thread, which is why the methods take a lock.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        # Tasks put back go before the ones that were never sent
+        self._requeued = itertools.count(-1, -1)
+        self._workers = {}
+        # (worker type, given, model) -> heap of (priority, sequence, task)
+        self._queues = {}
+        # (given, model) -> worker types that can collect it
+        self._capable = {}
+
+    def _capabilities(self, worker):
+        return [
+            (worker_type(worker['id']), given, model)
+            for given in worker['given'] for model in worker['models']
+        ]
+
+    def register_worker(self, worker_id, given, models, location, capacity=1):
+        """ Adds a worker that said HELLO, or resets the slots of one that reconnected
+
+        :param given: List of lists, e.g. [['github_url']]
+        :param models: List of strings
+        :return: True if the worker is new
+        """
+        with self._lock:
+            new_worker = worker_id not in self._workers
+            if new_worker:
+                self._workers[worker_id] = {
+                    'id': worker_id,
+                    'given': [tuple(worker_given) for worker_given in given],
+                    'models': list(models),
+                    'location': location
+                }
+                for capability in self._capabilities(self._workers[worker_id]):
+                    self._queues.setdefault(capability, [])
+                    self._capable.setdefault(capability[1:], set()).add(capability[0])
+            self._workers[worker_id].update({
+                'status': 'Idle', 'capacity': capacity, 'in_flight': 0
+            })
+            return new_worker
+
+    def enqueue(self, task):
+        """ Queues the task once for every type of worker that can collect it
+
+        :param task: Dict, the task message
+        :return: List of (worker id, location) tuples, one per type, of the workers with a
+            free slot that should be sent tasks now. None if no worker can collect the task.
+        """
+        given = tuple(task['given'].keys())
+        model = task['models'][0]
+        priority = JOB_PRIORITIES.get(task['job_type'], JOB_PRIORITIES['MAINTAIN'])
+        with self._lock:
+            worker_types = self._capable.get((given, model))
+            if not worker_types:
+                return None
+            entry = (priority, next(self._sequence), task)
+            ready = []
+            for type_of_worker in worker_types:
+                heapq.heappush(self._queues[(type_of_worker, given, model)], entry)
+                worker = self._least_loaded(type_of_worker)
+                if worker is not None:
+                    ready.append((worker['id'], worker['location']))
+            return ready
+
+    def _least_loaded(self, type_of_worker):
+        free = [
+            worker for worker in self._workers.values()
+            if worker_type(worker['id']) == type_of_worker and worker['status'] != 'Disconnected'
+            and worker['in_flight'] < worker['capacity']
+        ]
+        return min(free, key=lambda worker: worker['in_flight']) if free else None
+
+    def next_task(self, worker_id):
+        """ Takes the most urgent task the worker can collect if it has a free slot, and
+            counts it as in flight
+
+        :return: Dict, the task, or None
+        """
+        with self._lock:
+            return self._next_task(worker_id)
+
+    def next_tasks(self, worker_id):
+        """ Takes a task for every free slot of the worker, see next_task
+
+        :return: List of tasks, most urgent first
+        """
+        with self._lock:
+            tasks = []
+            while True:
+                task = self._next_task(worker_id)
+                if task is None:
+                    return tasks
+                tasks.append(task)
+
+    def _next_task(self, worker_id):
+        worker = self._workers.get(worker_id)
+        if worker is None or worker['status'] == 'Disconnected' or \
+                worker['in_flight'] >= worker['capacity']:
+            return None
+        queues = [
+            self._queues[capability] for capability in self._capabilities(worker)
+            if self._queues[capability]
+        ]
+        if not queues:
+            if worker['in_flight'] == 0:
+                worker['status'] = 'Idle'
+            return None
+        _, _, task = heapq.heappop(min(queues, key=lambda queue: queue[0][:2]))
+        worker['in_flight'] += 1
+        worker['status'] = 'Working'
+        return task
+
+    def requeue(self, worker_id, task):
+        """ Puts back a task that could not be sent to the worker, at the front of its
+            priority """
+        given = tuple(task['given'].keys())
+        priority = JOB_PRIORITIES.get(task['job_type'], JOB_PRIORITIES['MAINTAIN'])
+        with self._lock:
+            heapq.heappush(
+                self._queues[(worker_type(worker_id), given, task['models'][0])],
+                (priority, next(self._requeued), task)
+            )
+            if worker_id in self._workers:
+                self._release(self._workers[worker_id])
+
+    def _release(self, worker):
+        worker['in_flight'] = max(worker['in_flight'] - 1, 0)
+
+    def task_finished(self, worker_id):
+        """ Frees the slot of a task the worker completed or failed
+
+        :return: String, the location of the worker to send its next tasks to, None if the
+            worker is unknown or disconnected
+        """
+        with self._lock:
+            worker = self._workers.get(worker_id)
+            if worker is None:
+                return None
+            self._release(worker)
+            return worker['location'] if worker['status'] != 'Disconnected' else None
+
+    def set_status(self, worker_id, status):
+        with self._lock:
+            if worker_id in self._workers:
+                self._workers[worker_id]['status'] = status
+
+    def has_worker(self, worker_id):
+        with self._lock:
+            return worker_id in self._workers
+
+    def has_compatible_worker(self, given, model):
+        """ Whether any worker can collect the model for the given, e.g. ['github_url'] """
+        with self._lock:
+            return bool(self._capable.get((tuple(given), model)))
+
+    def status(self):
+        """ Returns every worker with the tasks queued for its type, like /workers/status
+            reports them """
+        with self._lock:
+            workers = []
+            for worker in self._workers.values():
+                queued = sorted((
+                    entry for capability in self._capabilities(worker)
+                    for entry in self._queues[capability]
+                ), key=lambda entry: entry[:2])
+                workers.append({
+                    'id': worker['id'],
+                    'user_queue': [task for priority, _, task in queued if priority == 0],
+                    'maintain_queue': [task for priority, _, task in queued if priority != 0],
+                    'given': [list(given) for given in worker['given']],
+                    'models': list(worker['models']),
+                    'status': worker['status'],
+                    'location': worker['location']
+                })
+            return workers
+
+class SchedulerManager(BaseManager):
+    """ Runs the Scheduler in its own process, start() it and create the Scheduler
+        through it """
+
+SchedulerManager.register('Scheduler', Scheduler)
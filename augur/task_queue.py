@@ -0,0 +1,140 @@
+#SPDX-License-Identifier: MIT
+"""
+Durable task queue in augur_operations.worker_task_queue that workers claim tasks from
+"""
+import json
+
+import sqlalchemy as s
+
+from augur.scheduler import JOB_PRIORITIES
+
+def given_key(given):
+    """ The key a task's given is queued under, e.g. {'github_url': ...} -> 'github_url', and
+        the same for a worker's given, e.g. ['github_url'] """
+    return ','.join(sorted(given))
+
+def task_row(task, max_attempts=3):
+    """ Returns the worker_task_queue row of a task message """
+    given_value = list(task['given'].values())[0]
+    return {
+        'job_model': task['models'][0],
+        'given_key': given_key(task['given']),
+        'given_value': given_value if isinstance(given_value, str) else json.dumps(given_value),
+        'job_type': task['job_type'],
+        'priority': JOB_PRIORITIES.get(task['job_type'], JOB_PRIORITIES['MAINTAIN']),
+        'task': json.dumps(task),
+        'max_attempts': max_attempts
+    }
+
+class TaskQueue():
+    """ Tasks are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers on
+        any number of hosts can pull from the queue without waiting on each other. A claimed
+        task is leased to its worker, which renews the lease while the task runs. Once a
+        lease expires, e.g. because the worker died, the task can be claimed again. Failed
+        tasks are queued again with an exponential backoff until they used max_attempts.
+
+    :param db: SQLAlchemy engine
+    """
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def table_exists(db):
+        return 'worker_task_queue' in s.inspect(db).get_table_names(schema='augur_operations')
+
+    def enqueue(self, tasks, max_attempts=3):
+        """ Queues the tasks in one statement, tasks that are already queued or claimed for the
+            same model and given are left out
+
+        :param tasks: List of task messages
+        :return: Integer, the number of tasks queued
+        """
+        self.reap()
+        if not tasks:
+            return 0
+        result = self.db.execute(s.sql.text("""
+            INSERT INTO augur_operations.worker_task_queue
+                (job_model, given_key, given_value, job_type, priority, task, max_attempts)
+            VALUES
+                (:job_model, :given_key, :given_value, :job_type, :priority,
+                CAST(:task AS jsonb), :max_attempts)
+            ON CONFLICT (job_model, given_key, given_value)
+                WHERE status IN ('queued', 'claimed') DO NOTHING
+        """), [task_row(task, max_attempts) for task in tasks])
+        return result.rowcount
+
+    def reap(self):
+        """ Fails the tasks whose lease expired on their last attempt """
+        self.db.execute(s.sql.text("""
+            UPDATE augur_operations.worker_task_queue
+            SET status = 'failed', last_error = 'Lease expired on the last attempt',
+                updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'claimed' AND lease_expires_at < CURRENT_TIMESTAMP
+                AND attempts >= max_attempts
+        """))
+
+    def claim(self, worker_id, models, givens, lease_seconds=600):
+        """ Claims the most urgent available task the worker can collect
+
+        :param models: List of the worker's models
+        :param givens: List of the worker's givens, e.g. [['github_url']]
+        :return: Dict, the task message with its task_queue_id, or None if there is none
+        """
+        row = self.db.execute(s.sql.text("""
+            UPDATE augur_operations.worker_task_queue
+            SET status = 'claimed', claimed_by = :worker_id, attempts = attempts + 1,
+                lease_expires_at = CURRENT_TIMESTAMP + :lease_seconds * INTERVAL '1 second',
+                updated_at = CURRENT_TIMESTAMP
+            WHERE task_id = (
+                SELECT task_id FROM augur_operations.worker_task_queue
+                WHERE job_model = ANY(:models) AND given_key = ANY(:givens)
+                    AND status IN ('queued', 'claimed') AND attempts < max_attempts
+                    AND (
+                        (status = 'queued' AND available_at <= CURRENT_TIMESTAMP)
+                        OR (status = 'claimed' AND lease_expires_at < CURRENT_TIMESTAMP)
+                    )
+                ORDER BY priority, available_at, task_id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING task_id, task
+        """), {
+            'worker_id': worker_id, 'lease_seconds': lease_seconds, 'models': list(models),
+            'givens': [given_key(given) for given in givens]
+        }).fetchone()
+        if row is None:
+            return None
+        return {**row['task'], 'task_queue_id': row['task_id']}
+
+    def renew(self, worker_id, task_ids, lease_seconds=600):
+        """ Extends the leases the worker holds on the tasks """
+        if not task_ids:
+            return
+        self.db.execute(s.sql.text("""
+            UPDATE augur_operations.worker_task_queue
+            SET lease_expires_at = CURRENT_TIMESTAMP + :lease_seconds * INTERVAL '1 second'
+            WHERE task_id = ANY(:task_ids) AND claimed_by = :worker_id AND status = 'claimed'
+        """), {'worker_id': worker_id, 'task_ids': list(task_ids), 'lease_seconds': lease_seconds})
+
+    def complete(self, worker_id, task_id):
+        self.db.execute(s.sql.text("""
+            UPDATE augur_operations.worker_task_queue
+            SET status = 'done', lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE task_id = :task_id AND claimed_by = :worker_id AND status = 'claimed'
+        """), {'worker_id': worker_id, 'task_id': task_id})
+
+    def fail(self, worker_id, task_id, error, retry_delay=60):
+        """ Queues the task again after retry_delay seconds, doubled for every attempt it
+            already used, or fails it for good after its last attempt """
+        self.db.execute(s.sql.text("""
+            UPDATE augur_operations.worker_task_queue
+            SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                available_at = CURRENT_TIMESTAMP
+                    + :retry_delay * POWER(2, attempts - 1) * INTERVAL '1 second',
+                claimed_by = NULL, lease_expires_at = NULL, last_error = :error,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE task_id = :task_id AND claimed_by = :worker_id AND status = 'claimed'
+        """), {
+            'worker_id': worker_id, 'task_id': task_id, 'error': str(error),
+            'retry_delay': retry_delay
+        })
@@ -0,0 +1,44 @@
+BEGIN;
+
+-- ----------------------------
+-- Table structure for worker_oauth_budget
+-- Shared view of the remaining API quota of every key, reported by the workers
+-- from response headers so no worker has to probe the API to pick a key
+-- ----------------------------
+CREATE TABLE IF NOT EXISTS "augur_operations"."worker_oauth_budget" (
+  "platform" varchar(32) COLLATE "pg_catalog"."default" NOT NULL,
+  "token_hash" varchar(64) COLLATE "pg_catalog"."default" NOT NULL,
+  "oauth_id" int8,
+  "rate_limit" int4,
+  "reset_at" timestamptz(0),
+  "bad_credentials" bool NOT NULL DEFAULT false,
+  "last_update" timestamp(0) DEFAULT CURRENT_TIMESTAMP,
+  CONSTRAINT "worker_oauth_budget_pkey" PRIMARY KEY ("platform", "token_hash")
+)
+;
+ALTER TABLE "augur_operations"."worker_oauth_budget" OWNER TO "augur";
+COMMENT ON COLUMN "augur_operations"."worker_oauth_budget"."token_hash" IS 'sha256 of the access token, the token itself stays in the config or worker_oauth. ';
+COMMENT ON COLUMN "augur_operations"."worker_oauth_budget"."rate_limit" IS 'Requests remaining as of the last response header seen by any worker. NULL if the key has not been used yet. ';
+
+-- ----------------------------
+-- Table structure for worker_oauth_lease
+-- One row per worker, the key it currently uses. Leases expire so a crashed
+-- worker does not hold on to a key.
+-- ----------------------------
+CREATE TABLE IF NOT EXISTS "augur_operations"."worker_oauth_lease" (
+  "platform" varchar(32) COLLATE "pg_catalog"."default" NOT NULL,
+  "worker" varchar(255) COLLATE "pg_catalog"."default" NOT NULL,
+  "token_hash" varchar(64) COLLATE "pg_catalog"."default" NOT NULL,
+  "expires_at" timestamptz(0) NOT NULL,
+  CONSTRAINT "worker_oauth_lease_pkey" PRIMARY KEY ("platform", "worker")
+)
+;
+ALTER TABLE "augur_operations"."worker_oauth_lease" OWNER TO "augur";
+CREATE INDEX "worker_oauth_lease_token" ON "augur_operations"."worker_oauth_lease" USING btree (
+  "platform", "token_hash"
+);
+
+update "augur_operations"."augur_settings" set value = 54
+  where setting = 'augur_data_version';
+
+COMMIT;
@@ -0,0 +1,26 @@
+BEGIN;
+
+-- ----------------------------
+-- Table structure for worker_etag_cache
+-- Validators of the last successfully collected response of each api url, sent
+-- back as If-None-Match / If-Modified-Since so unchanged pages come back as 304.
+-- They are kept per job model, as models of different workers request some of
+-- the same urls, e.g. the issue events of the issues and pull_requests models.
+-- ----------------------------
+CREATE TABLE IF NOT EXISTS "augur_operations"."worker_etag_cache" (
+  "url" text COLLATE "pg_catalog"."default" NOT NULL,
+  "job_model" varchar(255) COLLATE "pg_catalog"."default" NOT NULL DEFAULT '',
+  "etag" varchar(255) COLLATE "pg_catalog"."default",
+  "last_modified" varchar(64) COLLATE "pg_catalog"."default",
+  "last_page" int4,
+  "last_update" timestamp(0) DEFAULT CURRENT_TIMESTAMP,
+  CONSTRAINT "worker_etag_cache_pkey" PRIMARY KEY ("url", "job_model")
+)
+;
+ALTER TABLE "augur_operations"."worker_etag_cache" OWNER TO "augur";
+COMMENT ON COLUMN "augur_operations"."worker_etag_cache"."last_page" IS 'Last page of the paginated endpoint when the url was collected, 304 responses do not always carry the Link header. ';
+
+update "augur_operations"."augur_settings" set value = 55
+  where setting = 'augur_data_version';
+
+COMMIT;
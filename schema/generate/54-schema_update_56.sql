@@ -0,0 +1,21 @@
+BEGIN;
+
+-- ----------------------------
+-- Table structure for worker_collection_mark
+-- High-water mark (latest updated_at collected) per repo and model, so later
+-- collections only request what changed since then
+-- ----------------------------
+CREATE TABLE IF NOT EXISTS "augur_operations"."worker_collection_mark" (
+  "repo_id" int8 NOT NULL,
+  "job_model" varchar(255) COLLATE "pg_catalog"."default" NOT NULL,
+  "high_water_mark" timestamptz(0) NOT NULL,
+  "last_update" timestamp(0) DEFAULT CURRENT_TIMESTAMP,
+  CONSTRAINT "worker_collection_mark_pkey" PRIMARY KEY ("repo_id", "job_model")
+)
+;
+ALTER TABLE "augur_operations"."worker_collection_mark" OWNER TO "augur";
+
+update "augur_operations"."augur_settings" set value = 56
+  where setting = 'augur_data_version';
+
+COMMIT;
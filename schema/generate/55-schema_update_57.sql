@@ -0,0 +1,48 @@
+BEGIN;
+
+-- ----------------------------
+-- Table structure for worker_task_metrics
+-- Time spent in each phase of a worker task, with its request, byte and row
+-- counts, so slow collections can be told apart as network or database bound
+-- ----------------------------
+CREATE SEQUENCE IF NOT EXISTS "augur_operations"."worker_task_metrics_metrics_id_seq"
+INCREMENT 1
+MINVALUE  1
+MAXVALUE 9223372036854775807
+START 1
+CACHE 1;
+ALTER SEQUENCE "augur_operations"."worker_task_metrics_metrics_id_seq" OWNER TO "augur";
+
+CREATE TABLE IF NOT EXISTS "augur_operations"."worker_task_metrics" (
+  "metrics_id" int8 NOT NULL DEFAULT nextval('"augur_operations".worker_task_metrics_metrics_id_seq'::regclass),
+  "history_id" int8,
+  "repo_id" int8,
+  "worker" varchar(255) COLLATE "pg_catalog"."default" NOT NULL,
+  "job_model" varchar(255) COLLATE "pg_catalog"."default" NOT NULL,
+  "status" varchar(255) COLLATE "pg_catalog"."default" NOT NULL,
+  "started_at" timestamp(0),
+  "total_seconds" float8,
+  "fetch_seconds" float8,
+  "decode_seconds" float8,
+  "organize_seconds" float8,
+  "enrich_seconds" float8,
+  "insert_seconds" float8,
+  "request_count" int8,
+  "bytes_downloaded" int8,
+  "rows_inserted" int8,
+  "rows_updated" int8,
+  "peak_rss_kb" int8,
+  "data_collection_date" timestamp(0) DEFAULT CURRENT_TIMESTAMP,
+  CONSTRAINT "worker_task_metrics_pkey" PRIMARY KEY ("metrics_id")
+)
+;
+ALTER TABLE "augur_operations"."worker_task_metrics" OWNER TO "augur";
+CREATE INDEX IF NOT EXISTS "worker_task_metrics_repo_model" ON "augur_operations"."worker_task_metrics" USING btree (
+  "repo_id", "job_model"
+);
+COMMENT ON COLUMN "augur_operations"."worker_task_metrics"."peak_rss_kb" IS 'Peak resident set size of the collection process when the task finished, in kilobytes. ';
+
+update "augur_operations"."augur_settings" set value = 57
+  where setting = 'augur_data_version';
+
+COMMIT;
@@ -0,0 +1,51 @@
+BEGIN;
+
+-- ----------------------------
+-- Table structure for worker_task_queue
+-- Durable queue of collection tasks, claimed by workers with
+-- SELECT ... FOR UPDATE SKIP LOCKED and held under a lease that they renew
+-- while the task runs. Tasks whose lease expires are claimed again, failed
+-- tasks are retried until max_attempts.
+-- ----------------------------
+CREATE SEQUENCE IF NOT EXISTS "augur_operations"."worker_task_queue_task_id_seq"
+INCREMENT 1
+MINVALUE  1
+MAXVALUE 9223372036854775807
+START 1
+CACHE 1;
+ALTER SEQUENCE "augur_operations"."worker_task_queue_task_id_seq" OWNER TO "augur";
+
+CREATE TABLE IF NOT EXISTS "augur_operations"."worker_task_queue" (
+  "task_id" int8 NOT NULL DEFAULT nextval('"augur_operations".worker_task_queue_task_id_seq'::regclass),
+  "job_model" varchar(255) COLLATE "pg_catalog"."default" NOT NULL,
+  "given_key" varchar(255) COLLATE "pg_catalog"."default" NOT NULL,
+  "given_value" text COLLATE "pg_catalog"."default" NOT NULL,
+  "job_type" varchar(255) COLLATE "pg_catalog"."default" NOT NULL,
+  "priority" int4 NOT NULL DEFAULT 1,
+  "task" jsonb NOT NULL,
+  "status" varchar(255) COLLATE "pg_catalog"."default" NOT NULL DEFAULT 'queued',
+  "attempts" int4 NOT NULL DEFAULT 0,
+  "max_attempts" int4 NOT NULL DEFAULT 3,
+  "available_at" timestamp(0) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  "claimed_by" varchar(255) COLLATE "pg_catalog"."default",
+  "lease_expires_at" timestamp(0),
+  "last_error" text COLLATE "pg_catalog"."default",
+  "updated_at" timestamp(0) DEFAULT CURRENT_TIMESTAMP,
+  "data_collection_date" timestamp(0) DEFAULT CURRENT_TIMESTAMP,
+  CONSTRAINT "worker_task_queue_pkey" PRIMARY KEY ("task_id")
+)
+;
+ALTER TABLE "augur_operations"."worker_task_queue" OWNER TO "augur";
+CREATE INDEX IF NOT EXISTS "worker_task_queue_claimable" ON "augur_operations"."worker_task_queue" USING btree (
+  "job_model", "given_key", "priority", "available_at", "task_id"
+) WHERE "status" IN ('queued', 'claimed');
+CREATE UNIQUE INDEX IF NOT EXISTS "worker_task_queue_pending" ON "augur_operations"."worker_task_queue" USING btree (
+  "job_model", "given_key", "given_value"
+) WHERE "status" IN ('queued', 'claimed');
+COMMENT ON COLUMN "augur_operations"."worker_task_queue"."status" IS 'queued, claimed, done or failed. ';
+COMMENT ON COLUMN "augur_operations"."worker_task_queue"."priority" IS 'Lower is claimed first, user requested (UPDATE) tasks are 0 and maintained ones 1. ';
+
+update "augur_operations"."augur_settings" set value = 58
+  where setting = 'augur_data_version';
+
+COMMIT;
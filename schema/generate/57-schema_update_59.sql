@@ -0,0 +1,49 @@
+BEGIN;
+
+-- ----------------------------
+-- Table structure for repo_collection_status
+-- How much of each model was collected for each repo and when, kept up to
+-- date by the workers as they finish tasks, so the housekeeper can order
+-- its repos without counting the collected tables itself.
+-- ----------------------------
+CREATE TABLE IF NOT EXISTS "augur_operations"."repo_collection_status" (
+  "repo_id" int8 NOT NULL,
+  "job_model" varchar(255) COLLATE "pg_catalog"."default" NOT NULL,
+  "collected_count" int8,
+  "expected_count" int8,
+  "last_status" varchar(255) COLLATE "pg_catalog"."default",
+  "last_collected_at" timestamp(0),
+  "updated_at" timestamp(0) DEFAULT CURRENT_TIMESTAMP,
+  CONSTRAINT "repo_collection_status_pkey" PRIMARY KEY ("repo_id", "job_model")
+)
+;
+ALTER TABLE "augur_operations"."repo_collection_status" OWNER TO "augur";
+COMMENT ON COLUMN "augur_operations"."repo_collection_status"."collected_count" IS 'Rows of the model stored for the repo, e.g. its pull requests. ';
+COMMENT ON COLUMN "augur_operations"."repo_collection_status"."expected_count" IS 'Rows of the model the platform reported for the repo in its latest repo_info. ';
+
+-- Counts of the data that was collected before this table existed
+INSERT INTO "augur_operations"."repo_collection_status" (repo_id, job_model, collected_count)
+  SELECT repo_id, 'pull_requests', COUNT(*) FROM "augur_data"."pull_requests" GROUP BY repo_id
+  UNION ALL
+  SELECT repo_id, 'issues', COUNT(*) FROM "augur_data"."issues"
+    WHERE pull_request IS NULL GROUP BY repo_id
+  UNION ALL
+  SELECT repo_id, 'commits', COUNT(*) FROM "augur_data"."commits" GROUP BY repo_id
+ON CONFLICT DO NOTHING;
+
+INSERT INTO "augur_operations"."repo_collection_status" (repo_id, job_model, expected_count)
+  SELECT repo_id, 'pull_requests', pull_request_count FROM (
+    SELECT DISTINCT ON (repo_id) repo_id, pull_request_count, issues_count
+    FROM "augur_data"."repo_info" ORDER BY repo_id, data_collection_date DESC
+  ) latest_info
+  UNION ALL
+  SELECT repo_id, 'issues', issues_count FROM (
+    SELECT DISTINCT ON (repo_id) repo_id, pull_request_count, issues_count
+    FROM "augur_data"."repo_info" ORDER BY repo_id, data_collection_date DESC
+  ) latest_info
+ON CONFLICT (repo_id, job_model) DO UPDATE SET expected_count = EXCLUDED.expected_count;
+
+update "augur_operations"."augur_settings" set value = 59
+  where setting = 'augur_data_version';
+
+COMMIT;
@@ -46,6 +46,7 @@ setup(
         "pandas==1.1.3",
         "numpy==1.19.5",
         "requests==2.22.0",
+        "aiohttp>=3.7.4",
         "psycopg2-binary==2.8.6",
         "click<8.0,>=5.1",
         "psutil==5.8.0",
@@ -0,0 +1,26 @@
+#SPDX-License-Identifier: MIT
+from augur.collection_status import COLLECTED_COUNTS, priority_order, status_model
+
+def test_pull_requests_with_the_most_left_to_collect_go_first():
+    model, order = priority_order({'model': 'pull_requests', 'repo_group_id': 0})
+    assert model == 'pull_requests'
+    assert order.startswith('status.expected_count - status.collected_count DESC NULLS LAST')
+
+def test_issues_of_repo_groups_go_by_the_share_collected():
+    model, order = priority_order({'model': 'issues', 'repo_group_id': 1})
+    assert model == 'issues'
+    assert 'NULLS FIRST' in order
+    # Issues of single repos keep the order of their ids
+    assert priority_order({'model': 'issues', 'repo_ids': [1]}) == ('issues', 'repo.repo_id')
+
+def test_ordered_jobs_go_by_commit_count():
+    assert priority_order({'model': 'repo_info', 'order': 'desc'}) == \
+        ('commits', 'COALESCE(status.collected_count, 0) DESC, repo.repo_id')
+    # Anything but a direction is not put in the query
+    assert priority_order({'model': 'repo_info', 'order': 'DESC; DROP TABLE repo'})[1] == \
+        'COALESCE(status.collected_count, 0) ASC, repo.repo_id'
+
+def test_models_that_collect_the_same_rows_share_a_status():
+    assert status_model('issues_graphql') == 'issues'
+    assert status_model('commits') in COLLECTED_COUNTS
+    assert status_model('repo_info') == 'repo_info'
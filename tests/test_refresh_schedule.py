@@ -0,0 +1,50 @@
+#SPDX-License-Identifier: MIT
+import datetime
+
+from augur.refresh_schedule import DAY, RefreshSchedule
+
+NOW = datetime.datetime(2020, 11, 1)
+
+def history(runs, productive_runs, days_between, last_collected_days_ago, **extra):
+    last_collected = NOW - datetime.timedelta(days=last_collected_days_ago)
+    return {
+        'runs': runs, 'productive_runs': productive_runs,
+        'first_collected': last_collected - datetime.timedelta(days=days_between * (runs - 1)),
+        'last_collected': last_collected, **extra
+    }
+
+def test_repos_that_rarely_change_wait_longer():
+    schedule = RefreshSchedule(DAY)
+    busy = schedule.interval(history(10, 10, 1, 1), NOW)
+    quiet = schedule.interval(history(10, 1, 1, 1), NOW)
+    assert busy == DAY
+    assert 5 * DAY < quiet < 30 * DAY
+
+def test_dormant_repos_wait_the_longest():
+    schedule = RefreshSchedule(DAY, max_interval=30 * DAY)
+    dormant = history(10, 10, 1, 1, last_pushed=NOW - datetime.timedelta(days=400))
+    assert schedule.interval(dormant, NOW) == 30 * DAY
+    assert schedule.interval({}, NOW) == DAY
+
+def test_new_and_pushed_repos_are_due_first():
+    schedule = RefreshSchedule(DAY)
+    histories = {
+        1: history(10, 1, 1, 2),
+        2: history(10, 10, 1, 3),
+        3: history(10, 1, 1, 0.5, last_pushed=NOW - datetime.timedelta(hours=1)),
+    }
+    repos = [{'repo_id': repo_id} for repo_id in (1, 2, 3, 4)]
+    due = schedule.due(repos, histories, DAY, now=NOW)
+    assert [repo['repo_id'] for repo in due] == [3, 4, 2]
+
+def test_due_repos_stay_within_the_api_budget():
+    schedule = RefreshSchedule(DAY, api_budget=100)
+    histories = {
+        1: history(10, 10, 1, 4, requests=60),
+        2: history(10, 10, 1, 3, requests=60),
+        3: history(10, 10, 1, 2, requests=30),
+    }
+    repos = [{'repo_id': repo_id} for repo_id in (1, 2, 3)]
+    # An hour affords 100 requests, the second repo would go over them
+    assert [repo['repo_id'] for repo in schedule.due(repos, histories, 3600, now=NOW)] == [1]
+    assert len(schedule.due(repos, histories, 2 * 3600, now=NOW)) == 3
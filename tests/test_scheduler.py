@@ -0,0 +1,81 @@
+#SPDX-License-Identifier: MIT
+from augur.scheduler import Scheduler, SchedulerManager
+
+GITHUB_WORKER = 'com.augurlabs.core.github_worker.50100'
+
+def task(url, job_type='MAINTAIN', model='issues'):
+    return {
+        'job_type': job_type, 'models': [model], 'display_name': url,
+        'given': {'github_url': url}
+    }
+
+def scheduler_with_worker(capacity=1):
+    scheduler = Scheduler()
+    scheduler.register_worker(
+        GITHUB_WORKER, [['github_url']], ['issues', 'repo_info'], 'http://localhost:50100',
+        capacity
+    )
+    return scheduler
+
+def test_tasks_without_a_capable_worker_are_not_queued():
+    scheduler = scheduler_with_worker()
+    assert scheduler.enqueue(task('a', model='commits')) is None
+    assert scheduler.has_compatible_worker(['github_url'], 'issues')
+    assert not scheduler.has_compatible_worker(['git_url'], 'issues')
+
+def test_user_tasks_go_first_then_in_arrival_order():
+    scheduler = scheduler_with_worker(capacity=3)
+    assert scheduler.enqueue(task('a')) == [(GITHUB_WORKER, 'http://localhost:50100')]
+    scheduler.enqueue(task('b', model='repo_info'))
+    scheduler.enqueue(task('c', job_type='UPDATE'))
+
+    sent = [scheduler.next_task(GITHUB_WORKER)['display_name'] for _ in range(3)]
+    assert sent == ['c', 'a', 'b']
+
+def test_workers_only_get_tasks_for_free_slots():
+    scheduler = scheduler_with_worker()
+    scheduler.enqueue(task('a'))
+    scheduler.enqueue(task('b'))
+    assert scheduler.next_task(GITHUB_WORKER)['display_name'] == 'a'
+    assert scheduler.next_task(GITHUB_WORKER) is None
+    assert scheduler.enqueue(task('c')) == []
+
+    assert scheduler.task_finished(GITHUB_WORKER) == 'http://localhost:50100'
+    assert scheduler.next_task(GITHUB_WORKER)['display_name'] == 'b'
+
+def test_tasks_that_could_not_be_sent_are_sent_again_first():
+    scheduler = scheduler_with_worker()
+    scheduler.enqueue(task('a'))
+    scheduler.enqueue(task('b'))
+    failed = scheduler.next_task(GITHUB_WORKER)
+    scheduler.requeue(GITHUB_WORKER, failed)
+    scheduler.set_status(GITHUB_WORKER, 'Disconnected')
+    assert scheduler.next_task(GITHUB_WORKER) is None
+    assert scheduler.task_finished(GITHUB_WORKER) is None
+
+    scheduler.register_worker(
+        GITHUB_WORKER, [['github_url']], ['issues'], 'http://localhost:50100'
+    )
+    assert scheduler.next_task(GITHUB_WORKER)['display_name'] == 'a'
+
+def test_scheduler_runs_in_its_own_process():
+    manager = SchedulerManager()
+    manager.start()
+    try:
+        scheduler = manager.Scheduler()
+        scheduler.register_worker(
+            GITHUB_WORKER, [['github_url']], ['issues'], 'http://localhost:50100'
+        )
+        scheduler.enqueue(task('a'))
+        status, = scheduler.status()
+        assert status['maintain_queue'][0]['display_name'] == 'a'
+        assert scheduler.next_task(GITHUB_WORKER)['display_name'] == 'a'
+    finally:
+        manager.shutdown()
+
+def test_next_tasks_fills_every_free_slot():
+    scheduler = scheduler_with_worker(capacity=2)
+    for url in ('a', 'b', 'c'):
+        scheduler.enqueue(task(url))
+    assert [sent['display_name'] for sent in scheduler.next_tasks(GITHUB_WORKER)] == ['a', 'b']
+    assert scheduler.next_tasks(GITHUB_WORKER) == []
@@ -0,0 +1,26 @@
+#SPDX-License-Identifier: MIT
+import json
+
+from augur.task_queue import given_key, task_row
+
+def test_tasks_and_workers_use_the_same_given_key():
+    assert given_key({'github_url': 'https://github.com/chaoss/augur'}) == given_key(['github_url'])
+
+def test_task_row_keeps_the_whole_message():
+    task = {
+        'job_type': 'UPDATE', 'models': ['issues'], 'display_name': 'issues model',
+        'given': {'github_url': 'https://github.com/chaoss/augur'}
+    }
+    row = task_row(task)
+    assert row['job_model'] == 'issues'
+    assert row['given_value'] == 'https://github.com/chaoss/augur'
+    assert row['priority'] == 0
+    assert json.loads(row['task']) == task
+
+def test_repo_group_tasks_are_keyed_on_their_repos():
+    row = task_row({
+        'job_type': 'MAINTAIN', 'models': ['insights'], 'given': {'repo_group': [{'repo_id': 1}]}
+    })
+    assert row['given_key'] == 'repo_group'
+    assert row['given_value'] == '[{"repo_id": 1}]'
+    assert row['priority'] == 1
@@ -0,0 +1,53 @@
+#SPDX-License-Identifier: MIT
+import os
+
+import pytest
+
+from workers.cassette import Cassette, CassetteMiss, request_key
+
+URL = 'https://api.github.com/repos/chaoss/augur/issues?per_page=100&page=1'
+
+def test_recorded_response_is_replayed(tmp_path):
+    Cassette(str(tmp_path), mode='record').save(
+        'GET', URL, 200, {'Link': f'<{URL[:-1]}2>; rel="last"'}, b'[{"id": 1}]'
+    )
+
+    response = Cassette(str(tmp_path)).response('GET', URL)
+    assert response.status_code == 200
+    assert response.json() == [{'id': 1}]
+    assert response.links['last']['url'] == URL[:-1] + '2'
+    assert response.headers['link'] == f'<{URL[:-1]}2>; rel="last"'
+
+def test_bodies_are_stored_once(tmp_path):
+    cassette = Cassette(str(tmp_path), mode='record')
+    cassette.save('GET', URL, 200, {}, b'[]')
+    cassette.save('GET', URL[:-1] + '2', 200, {}, b'[]')
+
+    assert len(os.listdir(tmp_path / 'requests')) == 2
+    assert len(os.listdir(tmp_path / 'bodies')) == 1
+
+def test_failed_responses_are_not_recorded(tmp_path):
+    cassette = Cassette(str(tmp_path), mode='record')
+    cassette.save('GET', URL, 403, {'Retry-After': '60'}, b'{}')
+
+    assert cassette.recorded == 0
+    with pytest.raises(CassetteMiss):
+        cassette.load('GET', URL)
+
+def test_graphql_queries_are_told_apart_by_body(tmp_path):
+    cassette = Cassette(str(tmp_path), mode='record')
+    url = 'https://api.github.com/graphql'
+    cassette.save('POST', url, 200, {}, b'{"data": 1}', body={'query': '{ a }'})
+    cassette.save('POST', url, 200, {}, b'{"data": 2}', body={'query': '{ b }'})
+
+    assert cassette.response('POST', url, body={'query': '{ b }'}).json() == {'data': 2}
+    with pytest.raises(CassetteMiss):
+        cassette.load('POST', url)
+
+def test_request_key_ignores_case_of_method():
+    assert request_key('get', URL) == request_key('GET', URL)
+    assert request_key('GET', URL) != request_key('POST', URL)
+
+def test_unknown_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path), mode='rewind')
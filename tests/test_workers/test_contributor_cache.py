@@ -0,0 +1,56 @@
+#SPDX-License-Identifier: MIT
+import sqlalchemy as s
+
+from workers.contributor_cache import ContributorCache
+
+contributors = s.Table(
+    'contributors', s.MetaData(),
+    s.Column('cntrb_id', s.BigInteger, primary_key=True),
+    s.Column('cntrb_login', s.String),
+    s.Column('gh_node_id', s.String),
+    s.Column('cntrb_email', s.String),
+    s.Column('data_source', s.String)
+)
+
+def test_get_by_any_identity_column():
+    cache = ContributorCache(None, contributors)
+    cache.add(1, cntrb_login='octocat', gh_node_id='MDQ6', cntrb_email='Octo@GitHub.com')
+
+    assert cache.get(cntrb_login='octocat') == 1
+    assert cache.get(gh_node_id='MDQ6') == 1
+    assert cache.get(cntrb_email='octo@github.com') == 1
+    assert cache.get(cntrb_login='hubot') is None
+
+def test_node_id_is_trusted_before_login():
+    cache = ContributorCache(None, contributors)
+    cache.add(1, cntrb_login='octocat', gh_node_id='old')
+    cache.add(2, gh_node_id='new')
+
+    assert cache.get(cntrb_login='octocat', gh_node_id='new') == 2
+    assert cache.get(cntrb_login='octocat', gh_node_id='unknown') == 1
+
+def test_missing_values_are_not_keys():
+    cache = ContributorCache(None, contributors)
+    cache.add(1, cntrb_login='octocat', gh_node_id=None, cntrb_email=float('nan'))
+
+    assert len(cache) == 1
+    assert cache.get(cntrb_login=None, gh_node_id=float('nan')) is None
+
+def test_oldest_contributor_wins_without_overwrite():
+    cache = ContributorCache(None, contributors)
+    cache.add(1, overwrite=False, cntrb_login='octocat')
+    cache.add(5, overwrite=False, cntrb_login='octocat')
+
+    assert cache.get(cntrb_login='octocat') == 1
+
+def test_least_recently_used_keys_are_evicted():
+    cache = ContributorCache(None, contributors, max_size=2)
+    cache.add(1, cntrb_login='a')
+    cache.add(2, cntrb_login='b')
+    cache.get(cntrb_login='a')
+    cache.add(3, cntrb_login='c')
+
+    assert len(cache) == 2
+    assert cache.get(cntrb_login='a') == 1
+    assert cache.get(cntrb_login='b') is None
+    assert cache.get(cntrb_login='c') == 3
@@ -0,0 +1,60 @@
+#SPDX-License-Identifier: MIT
+import datetime
+
+import numpy
+
+from workers.diff_engine import DiffEngine, normalize
+
+def test_normalize_matches_api_and_database_values():
+    assert normalize(numpy.int64(5)) == 5
+    assert normalize(5.0) == 5
+    assert normalize(float('nan')) is None
+    assert normalize(
+        '2021-05-01T12:00:00Z', datetime.datetime
+    ) == datetime.datetime(2021, 5, 1, 12, 0, 0)
+    assert normalize(
+        datetime.datetime(2021, 5, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
+    ) == datetime.datetime(2021, 5, 1, 12, 0, 0)
+    assert normalize(12, str) == '12'
+    assert normalize('12', int) == 12
+
+def test_classify_inserts_updates_and_noops():
+    engine = DiffEngine(['gh_issue_id'], ['issue_state', 'comment_count'])
+    engine.index([
+        {'gh_issue_id': 1, 'issue_state': 'open', 'comment_count': 2},
+        {'gh_issue_id': 2, 'issue_state': 'closed', 'comment_count': 0}
+    ])
+
+    insertions, updates = engine.classify([
+        {'id': 1, 'state': 'closed', 'comments': 2},
+        {'id': 2, 'state': 'closed', 'comments': 0},
+        {'id': 3, 'state': 'open', 'comments': 1},
+        {'id': 3, 'state': 'open', 'comments': 1},
+        {'id': None, 'state': 'open', 'comments': 1}
+    ], ['id'], ['state', 'comments'])
+
+    assert insertions == [{'id': 3, 'state': 'open', 'comments': 1}]
+    assert updates == [{'issue_state': 'closed', 'comment_count': 2, 'b_gh_issue_id': 1}]
+
+def test_classify_compound_keys_and_timestamps():
+    engine = DiffEngine(['msg_timestamp', 'msg_text'])
+    engine.index([{'msg_timestamp': datetime.datetime(2021, 5, 1, 12, 0, 0), 'msg_text': 'hi'}])
+
+    insertions, updates = engine.classify([
+        {'created_at': '2021-05-01T12:00:00Z', 'body': 'hi'},
+        {'created_at': '2021-05-01T12:00:01Z', 'body': 'hi'}
+    ], ['created_at', 'body'])
+
+    assert insertions == [{'created_at': '2021-05-01T12:00:01Z', 'body': 'hi'}]
+    assert updates == []
+
+def test_classify_nested_sources_and_missing_update_columns():
+    engine = DiffEngine(['cntrb_login'], ['cntrb_email'])
+    engine.index([{'cntrb_login': 'octocat', 'cntrb_email': 'a@b.c'}])
+
+    insertions, updates = engine.classify([
+        {'user': {'login': 'octocat'}}, {'user': {'login': 'hubot'}}
+    ], ['user.login'], ['email'])
+
+    assert insertions == [{'user': {'login': 'hubot'}}]
+    assert updates == []
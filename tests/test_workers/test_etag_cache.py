@@ -0,0 +1,54 @@
+#SPDX-License-Identifier: MIT
+import sqlalchemy as s
+
+from workers.etag_cache import ValidatorCache
+
+class Response():
+    def __init__(self, headers):
+        self.headers = headers
+
+def test_stage_keeps_validators_until_discarded():
+    cache = ValidatorCache(None)
+    cache.stage('https://api.github.com/repos/a/b/issues?page=1', Response({'ETag': 'W/"1"'}), 4)
+    cache.stage('https://api.github.com/repos/a/b/issues?page=2', Response({}), 4)
+
+    assert list(cache._staged.keys()) == ['https://api.github.com/repos/a/b/issues?page=1']
+    assert cache._staged['https://api.github.com/repos/a/b/issues?page=1']['last_page'] == 4
+
+    cache.discard()
+    assert cache._staged == {}
+
+def test_conditional_headers():
+    cache = ValidatorCache(None)
+    cache.get = lambda url: {'etag': 'W/"1"', 'last_modified': None, 'last_page': None}
+    assert cache.conditional_headers('url') == {'If-None-Match': 'W/"1"'}
+
+    cache.get = lambda url: None
+    assert cache.conditional_headers('url') == {}
+
+def validator_database():
+    db = s.create_engine('sqlite://')
+    db.execute("ATTACH DATABASE ':memory:' AS augur_operations")
+    db.execute("""
+        CREATE TABLE augur_operations.worker_etag_cache (
+            url text NOT NULL, job_model varchar(255) NOT NULL DEFAULT '', etag varchar(255),
+            last_modified varchar(64), last_page int4,
+            last_update timestamp DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (url, job_model)
+        )
+    """)
+    return db
+
+def test_models_that_request_the_same_url_keep_their_own_validators():
+    db = validator_database()
+    url = 'https://api.github.com/repos/a/b/issues/events?per_page=100&page=1'
+    issues = ValidatorCache(db, 'issues')
+    issues.stage(url, Response({'ETag': 'W/"1"'}), 2)
+    issues.flush()
+
+    # The pull_requests model did not collect the page yet, so it must not get a 304
+    assert ValidatorCache(db, 'pull_requests').conditional_headers(url) == {}
+    assert ValidatorCache(db, 'issues').conditional_headers(url) == {'If-None-Match': 'W/"1"'}
+
+    issues.stage(url, Response({'ETag': 'W/"2"'}), 2)
+    issues.flush()
+    assert ValidatorCache(db, 'issues').get(url)['etag'] == 'W/"2"'
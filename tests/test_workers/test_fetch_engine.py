@@ -0,0 +1,97 @@
+#SPDX-License-Identifier: MIT
+import asyncio
+import threading
+import time
+
+import pytest
+from aiohttp import web
+
+from workers.fetch_engine import AsyncFetchEngine
+
+@pytest.fixture(scope="module")
+def api_server():
+    """ Small local API that serves 3 pages for /items and a 404 for anything else """
+
+    async def items(request):
+        page = int(request.query.get('page', 1))
+        base = f"http://{request.host}/items?per_page=1"
+        headers = {
+            'Link': f'<{base}&page=3>; rel="last"',
+            'X-RateLimit-Remaining': '4000',
+            'X-RateLimit-Reset': '0'
+        }
+        return web.json_response([{'page': page}], headers=headers)
+
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.router.add_get('/items', items)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{port}"
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+def test_page_urls():
+    urls = AsyncFetchEngine._page_urls(
+        "https://api.github.com/repos/o/r/pulls/1/reviews?per_page=100",
+        "https://api.github.com/repositories/1/pulls/1/reviews?per_page=100&page=4"
+    )
+    assert urls == [
+        "https://api.github.com/repos/o/r/pulls/1/reviews?per_page=100&page=2",
+        "https://api.github.com/repos/o/r/pulls/1/reviews?per_page=100&page=3",
+        "https://api.github.com/repos/o/r/pulls/1/reviews?per_page=100&page=4"
+    ]
+
+def test_stream_follows_pagination(api_server):
+    engine = AsyncFetchEngine([{'access_token': 'abc'}], max_connections=4)
+    results = list(engine.stream([
+        (f"{api_server}/items?per_page=1", {'pull_request_id': 7}),
+        (f"{api_server}/missing?per_page=1", {'pull_request_id': 8})
+    ]))
+
+    pages = sorted(result.data[0]['page'] for result in results if result.status == 200)
+    assert pages == [1, 2, 3]
+    assert all(
+        result.extra_data == {'pull_request_id': 7} for result in results if result.status == 200
+    )
+    assert [result.status for result in results if result.status != 200] == [404]
+    assert engine.token_budgets() == {'abc': 4000}
+
+class Cassette():
+    """ Replays the same status for every url """
+    replaying = True
+
+    def __init__(self, status):
+        self.status = status
+
+    def load(self, method, url):
+        return self.status, {}, b''
+
+def test_replayed_rate_limit_and_auth_statuses_are_retried_then_given_up():
+    for status in (401, 403, 429):
+        engine = AsyncFetchEngine(
+            [{'access_token': 'abc'}], max_attempts=2, cassette=Cassette(status)
+        )
+        results = list(engine.stream([('https://api.github.com/repos/a/b/issues', {})]))
+        assert [(result.status, result.data) for result in results] == [(None, None)]
+
+def test_stream_keeps_up_with_a_slow_consumer(api_server):
+    engine = AsyncFetchEngine([{'access_token': 'abc'}], max_connections=1)
+    results = []
+    for result in engine.stream([(f"{api_server}/items?per_page=1", {'repo_id': 1})]):
+        time.sleep(0.1)
+        results.append(result)
+    assert sorted(result.data[0]['page'] for result in results) == [1, 2, 3]
+
+def test_stream_stops_when_the_consumer_does(api_server):
+    engine = AsyncFetchEngine([{'access_token': 'abc'}], max_connections=1)
+    stream = engine.stream([(f"{api_server}/items?per_page=1", {})] * 10)
+    next(stream)
+    stream.close()
+    assert engine._stopped.is_set()
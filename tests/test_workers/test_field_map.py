@@ -0,0 +1,44 @@
+#SPDX-License-Identifier: MIT
+from workers.field_map import FieldMap, field_getter, flatten, integer
+from workers.github_users import REST_USER_FIELDS
+
+def test_field_getter_follows_nested_and_flattened_paths():
+    get = field_getter('head.repo.id')
+    assert get({'head': {'repo': {'id': 7}}}) == 7
+    assert get({'head': {'repo': None}}) is None
+    assert get({'head.repo.id': 8}) == 8
+    assert get({}) is None
+
+def test_flatten_adds_every_attribute_of_the_roots():
+    data = [
+        {'id': 1, 'user': {'login': 'octocat', 'id': 5}},
+        {'id': 2, 'user': None}
+    ]
+    flattened = flatten(data, ['id', 'user.login'])
+    assert flattened[0] == {
+        'id': 1, 'user': {'login': 'octocat', 'id': 5}, 'user.login': 'octocat', 'user.id': 5
+    }
+    # Data points without the object get the same keys
+    assert flattened[1] == {'id': 2, 'user': None, 'user.login': None, 'user.id': None}
+    # The data points themselves are left alone
+    assert 'user.login' not in data[0]
+
+def test_flatten_keeps_keys_the_data_points_have():
+    flattened = flatten([{'actor': {'login': 'a'}, 'actor.login': 'b'}], ['actor.login'])
+    assert flattened[0]['actor.login'] == 'b'
+
+def test_field_map_extracts_typed_columns():
+    field_map = FieldMap({'cntrb_login': 'user.login', 'gh_user_id': ('user.id', integer)})
+    data = [{'user': {'login': 'octocat', 'id': 5.0}}, {'user': None}]
+    assert field_map.columns(data) == {'cntrb_login': ['octocat', None], 'gh_user_id': [5, None]}
+    assert field_map.records(data) == [
+        {'cntrb_login': 'octocat', 'gh_user_id': 5}, {'cntrb_login': None, 'gh_user_id': None}
+    ]
+
+def test_rest_user_fields_read_prefixed_users():
+    user = {'login': 'octocat', 'id': '5', 'node_id': 'U_5', 'type': 'User'}
+    contributor, = REST_USER_FIELDS.prefixed('actor.').records([{'actor': user}])
+    assert contributor['cntrb_login'] == contributor['gh_login'] == 'octocat'
+    assert contributor['gh_user_id'] == 5
+    assert contributor['gh_node_id'] == 'U_5'
+    assert contributor['cntrb_email'] is None
@@ -0,0 +1,95 @@
+#SPDX-License-Identifier: MIT
+from workers.github_issues_graphql import (
+    follow_up_pages, follow_up_query, issues_query, overflowing_connections, rest_comments,
+    rest_events, rest_issue, rest_user
+)
+
+def actor(login, typename='User'):
+    return {
+        '__typename': typename, 'login': login, 'id': f'node-{login}', 'databaseId': 7,
+        'avatarUrl': 'https://avatars.githubusercontent.com/u/7', 'url': f'https://github.com/{login}'
+    }
+
+def connection(nodes, end_cursor=None, **fields):
+    return {
+        'pageInfo': {'hasNextPage': end_cursor is not None, 'endCursor': end_cursor or 'last'},
+        'nodes': nodes, **fields
+    }
+
+def issue(**connections):
+    node = {
+        'id': 'I_1', 'databaseId': 11, 'number': 3, 'title': 'Crash', 'body': 'It crashes',
+        'state': 'CLOSED', 'createdAt': '2020-01-01T00:00:00Z',
+        'updatedAt': '2020-01-03T00:00:00Z', 'closedAt': '2020-01-02T00:00:00Z',
+        'url': 'https://github.com/chaoss/augur/issues/3', 'author': None,
+        'comments': connection([], totalCount=0), 'timelineItems': connection([]),
+        'labels': connection([]), 'assignees': connection([])
+    }
+    node.update(connections)
+    return node
+
+def test_issues_query_filters_on_updated_since():
+    query = issues_query('chaoss', 'augur', cursor='abc', since='2020-01-01T00:00:00Z')
+    assert 'orderBy: {field: UPDATED_AT, direction: ASC}, after: "abc"' in query
+    assert 'filterBy: {since: "2020-01-01T00:00:00Z"}' in query
+    assert 'itemTypes: [CLOSED_EVENT, REOPENED_EVENT,' in query
+    assert 'RENAMED_TITLE_EVENT' in query
+    assert 'fragment actorFields on Actor' in query
+
+def test_only_overflowing_connections_are_followed_up():
+    node = issue(comments=connection([], end_cursor='c1', totalCount=80))
+    pages = overflowing_connections(node)
+    assert pages == [('I_1', 'comments', 'c1')]
+
+    query = follow_up_query(pages)
+    assert 'n0: node(id: "I_1")' in query
+    assert 'comments(first: 100, after: "c1")' in query
+
+    data = {'n0': {'comments': connection([{'id': 'C_2'}], totalCount=80)}}
+    assert follow_up_pages(pages, data) == {('I_1', 'comments'): ([{'id': 'C_2'}], None)}
+
+def test_rest_issue_matches_rest_layout():
+    node = issue(
+        assignees=connection([actor('octocat')]),
+        labels=connection([{'id': 'L_1', 'name': 'bug', 'description': None, 'color': 'f00'}])
+    )
+    rest = rest_issue(node, 'chaoss', 'augur')
+
+    assert rest['id'] == 11
+    assert rest['state'] == 'closed'
+    assert rest['url'] == 'https://api.github.com/repos/chaoss/augur/issues/3'
+    assert rest['repository_url'] == 'https://api.github.com/repos/chaoss/augur'
+    # Deleted accounts are the ghost user, like in the REST api
+    assert rest['user']['login'] == 'ghost'
+    assert rest['assignee']['login'] == 'octocat'
+    assert rest['labels'][0]['node_id'] == 'L_1'
+    assert 'pull_request' not in rest
+
+def test_rest_comments_point_at_their_issue():
+    comment = {
+        'id': 'C_1', 'databaseId': 21, 'body': 'Same here', 'createdAt': '2020-01-02T00:00:00Z',
+        'updatedAt': '2020-01-02T00:00:00Z', 'url': 'https://github.com/chaoss/augur/issues/3#c',
+        'author': actor('hubot')
+    }
+    comments = rest_comments(issue(comments=connection([comment], totalCount=1)), 'chaoss', 'augur')
+    assert comments[0]['id'] == 21
+    assert comments[0]['issue_url'] == 'https://api.github.com/repos/chaoss/augur/issues/3'
+    assert comments[0]['user']['login'] == 'hubot'
+
+def test_rest_events_are_named_like_rest_events():
+    events = rest_events(issue(timelineItems=connection([
+        {
+            '__typename': 'ClosedEvent', 'id': 'CE_1', 'createdAt': '2020-01-02T00:00:00Z',
+            'actor': actor('octocat'), 'closer': {'__typename': 'Commit', 'oid': 'abc123'}
+        },
+        {'__typename': 'LabeledEvent', 'id': 'LE_1', 'createdAt': '2020-01-02T00:00:00Z',
+            'actor': None}
+    ])))
+    assert [event['event'] for event in events] == ['closed', 'labeled']
+    assert events[0]['commit_id'] == 'abc123'
+    assert events[0]['issue'] == {'id': 11, 'number': 3}
+    assert events[1]['actor'] is None
+
+def test_bots_get_the_rest_login_suffix():
+    assert rest_user(actor('dependabot', typename='Bot'))['login'] == 'dependabot[bot]'
+    assert rest_user(None) is None
@@ -0,0 +1,28 @@
+#SPDX-License-Identifier: MIT
+from workers.github_pr_files import pr_files_from_response, pr_files_query
+
+def files(paths, end_cursor=None):
+    return {'files': {
+        'pageInfo': {'hasNextPage': end_cursor is not None, 'endCursor': end_cursor or 'last'},
+        'nodes': [{'additions': 1, 'deletions': 0, 'path': path} for path in paths]
+    }}
+
+def test_pr_files_query_aliases_every_pull_request():
+    query = pr_files_query('chaoss', 'augur', [(12, None), (13, 'Y3Vyc29yOjEwMA==')])
+    assert 'repository(owner: "chaoss", name: "augur")' in query
+    assert 'p0: pullRequest(number: 12) {\n  files(first: 100) {' in query
+    assert 'p1: pullRequest(number: 13) {\n  files(first: 100, after: "Y3Vyc29yOjEwMA==")' in query
+
+def test_pr_files_from_response_returns_cursor_of_next_page():
+    pages = [(12, None), (13, None), (14, None)]
+    data = {'repository': {
+        'p0': files(['README.md']), 'p1': files(['setup.py'], end_cursor='next'), 'p2': None
+    }}
+
+    assert pr_files_from_response(pages, data) == {
+        12: ([{'additions': 1, 'deletions': 0, 'path': 'README.md'}], None),
+        13: ([{'additions': 1, 'deletions': 0, 'path': 'setup.py'}], 'next')
+    }
+
+def test_pr_files_from_response_without_repository():
+    assert pr_files_from_response([(12, None)], {'repository': None}) == {}
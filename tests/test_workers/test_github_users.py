@@ -0,0 +1,47 @@
+#SPDX-License-Identifier: MIT
+from workers.github_users import (
+    REST_USER_FIELDS, contributor_from_user, users_from_response, users_query
+)
+
+def user(login, email=''):
+    return {
+        'login': login, 'id': f'node-{login}', 'databaseId': 7, 'url': f'https://github.com/{login}',
+        'avatarUrl': 'https://avatars.githubusercontent.com/u/7', 'email': email,
+        'company': None, 'location': 'Earth', 'createdAt': '2011-01-25T18:44:36Z',
+        'isSiteAdmin': False
+    }
+
+def test_users_query_aliases_every_login():
+    query = users_query(['octocat', 'hub"ot'])
+    assert 'u0: user(login: "octocat")' in query
+    assert 'u1: user(login: "hub\\"ot")' in query
+    assert query.count('databaseId') == 2
+
+def test_users_from_response_skips_unresolved_logins():
+    data = {'u0': user('octocat'), 'u1': None}
+    assert users_from_response(['octocat', 'some-org'], data) == {'octocat': data['u0']}
+
+def test_contributor_from_user_matches_rest_layout():
+    contributor = contributor_from_user(user('octocat'))
+    assert contributor['cntrb_login'] == contributor['gh_login'] == 'octocat'
+    assert contributor['gh_user_id'] == 7
+    assert contributor['gh_node_id'] == 'node-octocat'
+    assert contributor['gh_url'] == 'https://api.github.com/users/octocat'
+    assert contributor['gh_html_url'] == 'https://github.com/octocat'
+    assert contributor['gh_following_url'] == \
+        'https://api.github.com/users/octocat/following{/other_user}'
+    # Private emails come back as empty strings
+    assert contributor['cntrb_email'] is None
+    assert contributor_from_user(user('octocat', 'octo@github.com'))['cntrb_email'] == \
+        'octo@github.com'
+
+def test_rest_and_graphql_users_fill_the_canonical_email_alike():
+    rest_user = {'login': 'octocat', 'id': 7, 'email': 'octo@github.com'}
+    rest_contributor, = REST_USER_FIELDS.records([rest_user])
+    graphql_contributor = contributor_from_user(user('octocat', 'octo@github.com'))
+    assert rest_contributor['cntrb_canonical'] == graphql_contributor['cntrb_canonical'] == \
+        'octo@github.com'
+
+    rest_contributor, = REST_USER_FIELDS.records([{**rest_user, 'email': None}])
+    assert rest_contributor['cntrb_canonical'] is None
+    assert contributor_from_user(user('octocat'))['cntrb_canonical'] is None
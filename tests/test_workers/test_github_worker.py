@@ -0,0 +1,28 @@
+#SPDX-License-Identifier: MIT
+import logging
+
+import pytest
+import sqlalchemy as s
+
+# The worker needs the database driver, which is not installed everywhere the helpers are tested
+pytest.importorskip('psycopg2')
+
+from workers.github_worker.github_worker import GitHubWorker
+
+def worker_without_new_issues():
+    worker = GitHubWorker.__new__(GitHubWorker)
+    worker.logger = logging.getLogger(__name__)
+    worker.repo_id, worker.owner, worker.repo = 1, 'chaoss', 'augur'
+    worker.issues_table = s.Table('issues', s.MetaData(), s.Column('repo_id', s.Integer))
+    worker.get_high_water_mark = lambda model: '2020-11-01T00:00:00Z'
+    worker.stage_high_water_mark = lambda model, data: None
+    worker.new_paginate_endpoint = lambda *args, **kwargs: {'insert': [], 'update': [], 'all': []}
+    worker.completions = []
+    worker.register_task_completion = \
+        lambda task, repo_id, model: worker.completions.append((repo_id, model))
+    return worker
+
+def test_an_empty_since_window_completes_the_task_once():
+    worker = worker_without_new_issues()
+    worker.issues_model({'given': {'github_url': 'https://github.com/chaoss/augur'}}, 1)
+    assert worker.completions == [(1, 'issues')]
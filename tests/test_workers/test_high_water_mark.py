@@ -0,0 +1,26 @@
+#SPDX-License-Identifier: MIT
+import datetime
+
+from workers.high_water_mark import next_mark, older_than
+
+def test_next_mark_is_latest_timestamp():
+    started_at = datetime.datetime(2021, 6, 1, 12, 0, 0)
+    assert next_mark(
+        ['2021-05-01T00:00:00Z', '2021-05-03T00:00:00Z', None, '2021-05-02T00:00:00Z'],
+        started_at
+    ) == '2021-05-03T00:00:00Z'
+
+def test_next_mark_never_passes_collection_start():
+    started_at = datetime.datetime(2021, 6, 1, 12, 0, 0)
+    assert next_mark(['2021-06-01T11:59:00Z'], started_at) == '2021-06-01T11:55:00Z'
+
+def test_next_mark_without_data():
+    assert next_mark([], datetime.datetime(2021, 6, 1)) is None
+
+def test_older_than():
+    mark = '2021-05-02T00:00:00Z'
+    assert older_than([{'updated_at': '2021-05-01T00:00:00Z'}], mark)
+    assert not older_than(
+        [{'updated_at': '2021-05-01T00:00:00Z'}, {'updated_at': '2021-05-03T00:00:00Z'}], mark
+    )
+    assert not older_than([], mark)
@@ -0,0 +1,42 @@
+#SPDX-License-Identifier: MIT
+from workers.oauth_budget import best_oauth, token_hash
+
+def candidate(name, rate_limit, reset_at, leases=0, bad_credentials=False):
+    return {
+        'token_hash': name, 'rate_limit': rate_limit, 'reset_at': reset_at,
+        'leases': leases, 'bad_credentials': bad_credentials
+    }
+
+def test_token_hash_hides_key():
+    assert token_hash('secret') != 'secret'
+    assert token_hash('secret') == token_hash('secret')
+
+def test_best_oauth_prefers_largest_budget():
+    chosen = best_oauth([
+        candidate('a', 100, 2000), candidate('b', 3000, 2000), candidate('c', 50, 2000)
+    ], 1000, 5000)
+    assert chosen['token_hash'] == 'b'
+
+def test_best_oauth_treats_reset_and_unknown_keys_as_fresh():
+    chosen = best_oauth([candidate('a', 4000, 2000), candidate('b', 0, 500)], 1000, 5000)
+    assert chosen['token_hash'] == 'b'
+
+    chosen = best_oauth([candidate('a', 4000, 2000), candidate('b', None, None)], 1000, 5000)
+    assert chosen['token_hash'] == 'b'
+
+def test_best_oauth_splits_budget_between_leases():
+    chosen = best_oauth([
+        candidate('a', 4000, 2000, leases=3), candidate('b', 2000, 2000, leases=0)
+    ], 1000, 5000)
+    assert chosen['token_hash'] == 'b'
+
+def test_best_oauth_waits_for_earliest_reset_when_exhausted():
+    chosen = best_oauth([candidate('a', 0, 3000), candidate('b', 0, 1500)], 1000, 5000)
+    assert chosen['token_hash'] == 'b'
+
+def test_best_oauth_skips_bad_credentials():
+    chosen = best_oauth([
+        candidate('a', 5000, 2000, bad_credentials=True), candidate('b', 10, 2000)
+    ], 1000, 5000)
+    assert chosen['token_hash'] == 'b'
+    assert best_oauth([candidate('a', 5000, 2000, bad_credentials=True)], 1000, 5000) is None
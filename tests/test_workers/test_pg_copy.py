@@ -0,0 +1,64 @@
+#SPDX-License-Identifier: MIT
+import datetime
+import struct
+
+import pytest
+import sqlalchemy as s
+from sqlalchemy.dialects import postgresql
+
+from workers.pg_copy import BinaryCopyStream, UnsupportedType, HEADER, encoder_for
+
+def read_fields(data, field_count):
+    """ Decodes a binary COPY stream into rows of raw field bytes (None for NULL) """
+    assert data.startswith(HEADER)
+    position = len(HEADER)
+    rows = []
+    while True:
+        count = struct.unpack('!h', data[position:position + 2])[0]
+        position += 2
+        if count == -1:
+            break
+        assert count == field_count
+        row = []
+        for _ in range(count):
+            length = struct.unpack('!i', data[position:position + 4])[0]
+            position += 4
+            if length == -1:
+                row.append(None)
+                continue
+            row.append(data[position:position + length])
+            position += length
+        rows.append(row)
+    assert position == len(data)
+    return rows
+
+def test_binary_rows():
+    columns = ['id', 'body', 'created_at', 'closed']
+    column_types = [
+        s.types.BigInteger(), s.types.String(), postgresql.TIMESTAMP(), s.types.Boolean()
+    ]
+    stream = BinaryCopyStream(columns, column_types, [
+        {'id': 1, 'body': 'hi', 'created_at': '2000-01-01T00:00:01Z', 'closed': True},
+        {'id': 2.0, 'body': None, 'created_at': float('nan')}
+    ])
+
+    data = b''
+    chunk = stream.read(7)
+    while chunk:
+        data += chunk
+        chunk = stream.read(7)
+
+    rows = read_fields(data, 4)
+    assert rows[0] == [
+        struct.pack('!q', 1), b'hi', struct.pack('!q', 1000000), b'\x01'
+    ]
+    assert rows[1] == [struct.pack('!q', 2), None, None, None]
+
+def test_timestamptz_is_converted_to_utc():
+    encode = encoder_for(postgresql.TIMESTAMP(timezone=True))
+    assert encode('2000-01-01T02:00:00+02:00') == struct.pack('!q', 0)
+    assert encode(datetime.datetime(2000, 1, 1, 0, 0, 0)) == struct.pack('!q', 0)
+
+def test_unsupported_types_fall_back():
+    with pytest.raises(UnsupportedType):
+        BinaryCopyStream(['amount'], [s.types.Numeric()], [])
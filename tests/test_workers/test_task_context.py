@@ -0,0 +1,59 @@
+#SPDX-License-Identifier: MIT
+import threading
+from concurrent import futures
+
+from workers.task_context import (
+    TaskContext, bind_context, current_context, set_current_context, task_attribute
+)
+
+class Collector():
+    repo_id = task_attribute()
+    insert_counter = task_attribute()
+
+def test_each_thread_sees_its_own_task():
+    collector = Collector()
+    set_current_context(TaskContext(repo_id=1))
+    seen = {}
+
+    def collect(repo_id):
+        set_current_context(TaskContext(repo_id=repo_id))
+        collector.insert_counter += repo_id
+        seen[repo_id] = (collector.repo_id, collector.insert_counter)
+
+    threads = [threading.Thread(target=collect, args=(repo_id,)) for repo_id in (2, 3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert seen == {2: (2, 2), 3: (3, 3)}
+    assert collector.repo_id == 1
+    assert collector.insert_counter == 0
+
+def test_threads_without_a_task_get_an_empty_context():
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(current_context().repo_id))
+    thread.start()
+    thread.join()
+
+    assert seen == [None]
+
+def test_streamed_batches_are_organized_for_the_task_that_fetched_them():
+    collector = Collector()
+    set_current_context(TaskContext(repo_id=7))
+    seen = []
+
+    def organize_batch(batch):
+        collector.insert_counter += len(batch)
+        seen.append(collector.repo_id)
+
+    stream_executor = futures.ThreadPoolExecutor(max_workers=1)
+    try:
+        for batch in ([1, 2], [3]):
+            stream_executor.submit(bind_context(organize_batch), batch).result()
+    finally:
+        stream_executor.shutdown(wait=True)
+
+    assert seen == [7, 7]
+    assert collector.insert_counter == 3
+    set_current_context(TaskContext())
@@ -0,0 +1,58 @@
+#SPDX-License-Identifier: MIT
+import threading
+
+from workers.task_context import TaskContext, bind_context, set_current_context, task_attribute
+from workers.task_metrics import COUNTERS, PHASES, TaskMetrics, timed
+
+class Collector():
+    metrics = task_attribute()
+
+    @timed('insert')
+    def insert(self, rows):
+        self.metrics.count('rows_inserted', len(rows))
+        return len(rows)
+
+def test_phases_add_up_across_blocks():
+    metrics = TaskMetrics()
+    with metrics.phase('fetch'):
+        pass
+    metrics.add_seconds('fetch', 1.5)
+    metrics.add_seconds('decode', 0.25)
+    assert metrics.seconds['fetch'] >= 1.5
+    assert metrics.seconds['decode'] == 0.25
+    assert metrics.seconds['insert'] == 0.0
+
+def test_as_dict_has_a_column_per_phase_and_counter():
+    metrics = TaskMetrics()
+    metrics.count('request_count')
+    metrics.count('bytes_downloaded', 2048)
+    row = metrics.as_dict()
+
+    assert set(row) == {'started_at', 'total_seconds', 'peak_rss_kb'} | set(COUNTERS) | {
+        f'{phase}_seconds' for phase in PHASES
+    }
+    assert row['request_count'] == 1
+    assert row['bytes_downloaded'] == 2048
+    assert row['peak_rss_kb'] > 0
+
+def test_timed_methods_count_towards_the_current_task():
+    collector = Collector()
+    context = TaskContext(repo_id=1)
+    set_current_context(context)
+    assert collector.insert([1, 2, 3]) == 3
+    assert context.metrics.counts['rows_inserted'] == 3
+    assert context.metrics.seconds['insert'] > 0
+
+def test_bound_functions_run_with_the_callers_task():
+    collector = Collector()
+    context = TaskContext(repo_id=1)
+    set_current_context(context)
+    insert = bind_context(collector.insert)
+
+    threads = [threading.Thread(target=insert, args=([row],)) for row in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert context.metrics.counts['rows_inserted'] == 4
@@ -0,0 +1,122 @@
+#SPDX-License-Identifier: MIT
+""" Record and replay of api responses, so collection can be re-run without the network """
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CASSETTE_MODES = ('record', 'replay')
+
+# Responses worth replaying, rate limited and failed requests are retried when recording
+RECORDED_STATUSES = (200, 304, 404)
+
+class CassetteMiss(KeyError):
+    """ A request was made in replay mode that was never recorded """
+    pass
+
+def request_key(method, url, body=None):
+    """ Identifies a request by its method, url and (json) body, not by its headers, so a
+        recording can be replayed with other API keys """
+    request = json.dumps([method.upper(), url, body], sort_keys=True)
+    return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+class Cassette():
+    """ Compressed, content-addressed store of api responses on disk.
+
+        Every response body is stored once, gzipped, under the sha256 of its content in
+        bodies/. Each recorded request has a small gzipped entry in requests/ (named by
+        request_key) with the status, headers and the hash of its body. Recording a request
+        again replaces its entry.
+
+    :param directory: String, where the cassette is stored
+    :param mode: String, 'record' to store every response, 'replay' to answer every
+        request from the store without touching the network
+    """
+    def __init__(self, directory, mode='replay'):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Cassette mode must be one of {CASSETTE_MODES}, not {mode}")
+        self.directory = directory
+        self.mode = mode
+        self.recorded = 0
+        self.replayed = 0
+        os.makedirs(os.path.join(directory, 'bodies'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'requests'), exist_ok=True)
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    def _write(self, path, data):
+        # Written to a temporary file first so readers never see half a file
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(descriptor, 'wb') as temporary_file:
+            temporary_file.write(gzip.compress(data))
+        os.replace(temporary_path, path)
+
+    def _read(self, path):
+        with open(path, 'rb') as stored_file:
+            return gzip.decompress(stored_file.read())
+
+    def save(self, method, url, status, headers, content, body=None):
+        """ Stores a response
+
+        :param status: Integer, HTTP status code
+        :param headers: Dict of the response headers
+        :param content: Bytes, the response body
+        :param body: JSON body of the request (e.g. a GraphQL query)
+        """
+        if status not in RECORDED_STATUSES:
+            return
+        content_hash = hashlib.sha256(content).hexdigest()
+        content_path = os.path.join(self.directory, 'bodies', content_hash)
+        if not os.path.exists(content_path):
+            self._write(content_path, content)
+
+        entry = {
+            'method': method.upper(), 'url': url, 'status': status,
+            'headers': dict(headers), 'content': content_hash
+        }
+        self._write(
+            os.path.join(self.directory, 'requests', request_key(method, url, body)),
+            json.dumps(entry).encode('utf-8')
+        )
+        self.recorded += 1
+
+    def load(self, method, url, body=None):
+        """ Returns the recorded (status, headers, content) of a request
+
+        :raises CassetteMiss: if the request was not recorded
+        """
+        entry_path = os.path.join(self.directory, 'requests', request_key(method, url, body))
+        if not os.path.exists(entry_path):
+            raise CassetteMiss(f"No recorded response for {method.upper()} {url}")
+        entry = json.loads(self._read(entry_path).decode('utf-8'))
+        content = self._read(os.path.join(self.directory, 'bodies', entry['content']))
+        self.replayed += 1
+        return entry['status'], entry['headers'], content
+
+    def record(self, method, url, response, body=None):
+        """ Stores a requests response under the url that was requested, which is not the
+            response's url when it was redirected """
+        self.save(
+            method, url, response.status_code, response.headers, response.content, body=body
+        )
+
+    def response(self, method, url, body=None):
+        """ Returns the recorded response of a request as a requests response
+
+        :raises CassetteMiss: if the request was not recorded
+        """
+        status, headers, content = self.load(method, url, body)
+        response = requests.models.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = content
+        response.encoding = 'utf-8'
+        response.url = url
+        response.reason = 'Replayed'
+        return response
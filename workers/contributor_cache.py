@@ -0,0 +1,122 @@
+#SPDX-License-Identifier: MIT
+""" In-process cache of contributor ids by login, node id and email """
+import collections
+import math
+
+import sqlalchemy as s
+
+# Contributors table columns that identify a contributor, in the order they are trusted
+IDENTITY_COLUMNS = ('gh_node_id', 'cntrb_login', 'cntrb_email')
+
+def _key(column, value):
+    if value is None or (isinstance(value, float) and math.isnan(value)) or value == '':
+        return None
+    value = str(value)
+    return (column, value.lower() if column == 'cntrb_email' else value)
+
+class ContributorCache():
+    """ Bounded LRU of contributor ids keyed by each of the IDENTITY_COLUMNS of the contributors
+        table. It is filled once per task with the most recent contributors, keys that miss are
+        then looked up in the database in one query per batch of data points, and contributors
+        inserted by the worker are added as they are stored.
+
+    :param db: SQLAlchemy engine connected to the augur_data schema
+    :param table: The contributors table
+    :param max_size: Integer, the number of keys held before the least recently used go
+    :param data_source: String, only cache contributors with this data_source (case
+        insensitive), e.g. 'github api'
+    """
+    def __init__(self, db, table, max_size=100000, data_source=None):
+        self.db = db
+        self.table = table
+        self.max_size = max_size
+        self.data_source = data_source
+        self.primary_key = list(table.primary_key)[0]
+        self.loaded = False
+        self._ids = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _select(self, where_clause):
+        if self.data_source is not None:
+            where_clause = s.and_(
+                where_clause,
+                s.func.lower(self.table.c.data_source) == self.data_source.lower()
+            )
+        return s.sql.select(
+            [self.primary_key] + [self.table.c[column] for column in IDENTITY_COLUMNS]
+        ).where(where_clause)
+
+    def _add_rows(self, rows):
+        # Like the DISTINCT ON cntrb_login queries did, the oldest contributor of a key wins
+        for row in rows:
+            self.add(row[0], overwrite=False, **{
+                column: row[column] for column in IDENTITY_COLUMNS
+            })
+
+    def load(self):
+        """ Fills the cache with the most recently added contributors """
+        rows = self.db.execute(
+            self._select(s.sql.expression.true()).order_by(
+                self.primary_key.desc()
+            ).limit(self.max_size)
+        ).fetchall()
+        self._add_rows(reversed(rows))
+        self.loaded = True
+
+    def add(self, cntrb_id, overwrite=True, **identity):
+        """ Caches the contributor id under each identity column given
+
+        :param cntrb_id: Integer, the contributor's primary key
+        :param overwrite: Boolean, replace the id of keys that are already cached
+        :param identity: Values of IDENTITY_COLUMNS, e.g. cntrb_login='octocat'
+        """
+        for column in IDENTITY_COLUMNS:
+            key = _key(column, identity.get(column))
+            if key is None or (not overwrite and key in self._ids):
+                continue
+            self._ids[key] = cntrb_id
+            self._ids.move_to_end(key)
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    def get(self, **identity):
+        """ Returns the cached id of the contributor, or None
+
+        :param identity: Values of IDENTITY_COLUMNS, e.g. cntrb_login='octocat'
+        """
+        for column in IDENTITY_COLUMNS:
+            key = _key(column, identity.get(column))
+            if key is not None and key in self._ids:
+                self._ids.move_to_end(key)
+                return self._ids[key]
+        return None
+
+    def fetch(self, identities):
+        """ Looks up the contributors that are not cached in the database, one query for all
+
+        :param identities: List of dicts with values of IDENTITY_COLUMNS
+        """
+        if not self.loaded:
+            self.load()
+        missing = collections.defaultdict(set)
+        for identity in identities:
+            if self.get(**identity) is not None:
+                continue
+            for column in IDENTITY_COLUMNS:
+                key = _key(column, identity.get(column))
+                if key is not None:
+                    missing[column].add(key[1])
+        if not missing:
+            return
+
+        conditions = [
+            (
+                s.func.lower(self.table.c[column]) if column == 'cntrb_email'
+                else self.table.c[column]
+            ).in_(list(values)) for column, values in missing.items()
+        ]
+        self._add_rows(self.db.execute(
+            self._select(s.or_(*conditions)).order_by(self.primary_key)
+        ).fetchall())
@@ -0,0 +1,161 @@
+#SPDX-License-Identifier: MIT
+""" Hash index diff of api data against existing table rows """
+import datetime
+import math
+
+import numpy
+
+# Timestamps in api responses, e.g. 2021-05-01T12:00:00Z
+API_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+MISSING = object()
+
+def source_value(record, column):
+    """ Looks up a column of an api data point, dotted columns (e.g. 'user.login') are
+        followed into nested dicts if the data point is not flattened """
+    if column in record:
+        return record[column]
+    value = record
+    for part in column.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+def normalize(value, target_type=None):
+    """ Converts a value to a canonical hashable form so api values and database values
+        compare equal when they hold the same data
+
+    :param value: The value to normalize
+    :param target_type: Type of the normalized values already in the index for this column,
+        incoming values are coerced to it like sync_df_types does for DataFrames
+    """
+    if value is None or value is MISSING:
+        return None
+    if isinstance(value, numpy.generic):
+        value = value.item()
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if value.is_integer():
+            value = int(value)
+    if hasattr(value, 'to_pydatetime'):
+        value = value.to_pydatetime()
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value
+
+    if target_type is datetime.datetime and isinstance(value, str):
+        try:
+            return datetime.datetime.strptime(value, API_TIMESTAMP_FORMAT)
+        except ValueError:
+            return value
+    if target_type is str and isinstance(value, (int, float)) \
+            and not isinstance(value, bool):
+        return str(value)
+    if target_type is int and isinstance(value, str) and value.isdigit():
+        return int(value)
+    if isinstance(value, (dict, list)):
+        return repr(value)
+    return value
+
+class DiffEngine():
+    """ Classifies incoming data points as insertions, updates or no-ops in one pass over
+        a hash index of the existing rows. The index holds only the key columns and the
+        update columns of each row, so its size is predictable from the row count.
+
+    :param key_columns: List of strings, table columns that identify a row
+    :param update_columns: List of strings, table columns whose change requires an update
+    """
+    def __init__(self, key_columns, update_columns=[]):
+        self.key_columns = list(key_columns)
+        self.update_columns = list(update_columns)
+        self.key_types = [None] * len(self.key_columns)
+        self.update_types = [None] * len(self.update_columns)
+        self._index = {}
+
+    def __len__(self):
+        return len(self._index)
+
+    @staticmethod
+    def _type_of(value):
+        if isinstance(value, bool) or value is None:
+            return None
+        if isinstance(value, int):
+            return int
+        if isinstance(value, datetime.datetime):
+            return datetime.datetime
+        if isinstance(value, str):
+            return str
+        return None
+
+    def index(self, rows):
+        """ Adds existing table rows to the index
+
+        :param rows: Iterable of mappings (e.g. SQLAlchemy rows) containing the key and
+            update columns
+        """
+        for row in rows:
+            key = tuple(normalize(row[column]) for column in self.key_columns)
+            values = tuple(normalize(row[column]) for column in self.update_columns)
+            for position, value in enumerate(key):
+                if self.key_types[position] is None:
+                    self.key_types[position] = self._type_of(value)
+            for position, value in enumerate(values):
+                if self.update_types[position] is None:
+                    self.update_types[position] = self._type_of(value)
+            raw_key = tuple(row[column] for column in self.key_columns)
+            self._index[key] = (values, raw_key)
+
+    def classify(self, new_data, key_sources, update_sources=[]):
+        """ Splits api data into the data points that need inserting and the updates needed
+
+        :param new_data: List of dicts, api data points
+        :param key_sources: List of strings, source columns matching key_columns
+        :param update_sources: List of strings, source columns matching update_columns
+        :return: Tuple of (list of data points needing insertion, list of update dicts).
+            Update dicts hold the new value of each update column and the key of the row to
+            update as b_<key column>, the format bulk_insert expects.
+        """
+        insertions = []
+        updates = []
+        inserted_keys = set()
+        updated_keys = set()
+
+        for record in new_data:
+            key = tuple(
+                normalize(source_value(record, source), self.key_types[position])
+                for position, source in enumerate(key_sources)
+            )
+            if any(value is None for value in key):
+                continue
+
+            existing = self._index.get(key)
+            if existing is None:
+                # Only insert the first of duplicate data points
+                if key not in inserted_keys:
+                    inserted_keys.add(key)
+                    insertions.append(record)
+                continue
+
+            if not update_sources or key in updated_keys:
+                continue
+            raw_values = [source_value(record, source) for source in update_sources]
+            if any(value is MISSING for value in raw_values):
+                # The api did not return the column, nothing to compare with
+                continue
+            values = tuple(
+                normalize(value, self.update_types[position])
+                for position, value in enumerate(raw_values)
+            )
+            existing_values, raw_key = existing
+            if values != existing_values:
+                updated_keys.add(key)
+                update = dict(zip(self.update_columns, raw_values))
+                update.update({
+                    f'b_{column}': value for column, value in zip(self.key_columns, raw_key)
+                })
+                updates.append(update)
+
+        return insertions, updates
@@ -0,0 +1,76 @@
+#SPDX-License-Identifier: MIT
+""" Persistent cache of HTTP validators so unchanged api pages can be skipped """
+import sqlalchemy as s
+
+class ValidatorCache():
+    """ ETag / Last-Modified validators per url and job model, stored in
+        augur_operations.worker_etag_cache. Models of different workers can request the same
+        url, e.g. the issue events of the issues and pull_requests models, so a page one of
+        them collected is not unchanged for the others.
+
+        Validators of newly collected pages are only staged while a task runs. They are
+        written by flush() once the task's data has been inserted, so a page is never
+        skipped as unchanged when its data did not make it into the database.
+
+    :param db: SQLAlchemy engine connected to the augur_operations schema
+    :param job_model: String, the model of the task the pages are collected for
+    """
+    def __init__(self, db, job_model=''):
+        self.db = db
+        self.job_model = job_model
+        self._staged = {}
+
+    @staticmethod
+    def table_exists(db):
+        return 'worker_etag_cache' in s.inspect(db).get_table_names(schema='augur_operations')
+
+    def get(self, url):
+        """ Returns the stored validators of the url as a dict, or None if there are none """
+        validator_sql = s.sql.text("""
+            SELECT etag, last_modified, last_page FROM augur_operations.worker_etag_cache
+            WHERE url = :url AND job_model = :job_model
+        """)
+        row = self.db.execute(validator_sql, {'url': url, 'job_model': self.job_model}).fetchone()
+        return dict(row) if row is not None else None
+
+    def conditional_headers(self, url):
+        """ Headers that make the api answer 304 Not Modified if the url has not changed """
+        validators = self.get(url)
+        if validators is None:
+            return {}
+        headers = {}
+        if validators['etag']:
+            headers['If-None-Match'] = validators['etag']
+        if validators['last_modified']:
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def stage(self, url, response, last_page=None):
+        """ Remembers the validators of a 200 response until the task completes """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        self._staged[url] = {
+            'url': url, 'job_model': self.job_model, 'etag': etag, 'last_modified': last_modified,
+            'last_page': last_page if last_page is not None and last_page > 0 else None
+        }
+
+    def flush(self):
+        """ Stores every staged validator, called once the task's data is in the database """
+        if not self._staged:
+            return
+        store_sql = s.sql.text("""
+            INSERT INTO augur_operations.worker_etag_cache
+                (url, job_model, etag, last_modified, last_page)
+            VALUES (:url, :job_model, :etag, :last_modified, :last_page)
+            ON CONFLICT (url, job_model) DO UPDATE
+            SET etag = EXCLUDED.etag, last_modified = EXCLUDED.last_modified,
+                last_page = EXCLUDED.last_page, last_update = CURRENT_TIMESTAMP
+        """)
+        self.db.execute(store_sql, list(self._staged.values()))
+        self._staged = {}
+
+    def discard(self):
+        """ Forgets the staged validators, used when a task fails """
+        self._staged = {}
@@ -108,9 +108,8 @@ class FacadeWorker(Worker):
         self.logger.info("Starting data collection process\n")
         self.initialize_database_connections() 
         while True:
-            if not self._queue.empty():
-                message = self._queue.get() # Get the task off our MP queue
-            else:
+            message = self.next_message() # Wait for the next task on our MP queue
+            if message is None:
                 break
             self.logger.info("Popped off message: {}\n".format(str(message)))
 
@@ -276,6 +275,12 @@ class FacadeWorker(Worker):
 
         if not limited_run or (limited_run and run_analysis):
             analysis(self.cfg, multithreaded)
+            # Every repo is analyzed in one task, so their commits are counted at once
+            if self.collection_status is not None:
+                try:
+                    self.collection_status.recount('commits')
+                except Exception as e:
+                    self.logger.error(f"Could not record the collection status: {e}")
 
         if nuke_stored_affiliations:
             nuke_affiliations(self.cfg)
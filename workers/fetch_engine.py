@@ -0,0 +1,355 @@
+#SPDX-License-Identifier: MIT
+""" Asyncio engine for fetching large numbers of API urls concurrently """
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+import aiohttp
+from requests.structures import CaseInsensitiveDict
+from requests.utils import parse_header_links
+
+from workers.cassette import CassetteMiss
+
+RATE_LIMIT_HEADERS = {
+    'github': ('X-RateLimit-Remaining', 'X-RateLimit-Reset'),
+    'gitlab': ('RateLimit-Remaining', 'RateLimit-Reset')
+}
+
+class FetchResult():
+    """ A single response handed back to the caller of AsyncFetchEngine.stream
+
+    :param url: String, the url that was requested
+    :param extra_data: Dictionary, the extra data the url was submitted with
+    :param status: Integer, final HTTP status code of the request (None if it never succeeded)
+    :param data: Decoded JSON body (or raw text if the body was not JSON)
+    :param headers: Dictionary of the response headers
+    """
+    def __init__(self, url, extra_data, status, data, headers):
+        self.url = url
+        self.extra_data = extra_data
+        self.status = status
+        self.data = data
+        self.headers = headers
+
+class TokenState():
+    """ Bookkeeping for one API key used by the engine """
+    def __init__(self, access_token, rate_limit=None):
+        self.access_token = access_token
+        self.remaining = rate_limit
+        self.reset_at = 0
+        self.in_flight = 0
+        self.bad_credentials = False
+        self.semaphore = None
+
+    def budget(self, now):
+        if self.remaining is None or self.reset_at <= now:
+            # Unknown or already reset, assume the key is usable
+            return float('inf')
+        return self.remaining - self.in_flight
+
+class AsyncFetchEngine():
+    """ Fetches urls with a pool of keep-alive connections, bounded per host and per
+        API key, and hands back each response as soon as it arrives.
+
+    :param tokens: List of dicts, the worker's oauths (needs 'access_token', optionally
+        'rate_limit')
+    :param platform: String, 'github' or 'gitlab', decides the auth and rate limit headers
+    :param max_connections: Integer, total concurrent connections
+    :param max_per_host: Integer, concurrent connections per host
+    :param max_per_token: Integer, concurrent requests in flight per API key
+    :param max_attempts: Integer, attempts per url before giving up on it
+    :param timeout: Integer, seconds before a single request is abandoned
+    :param cassette: Cassette that responses are recorded to, or replayed from
+    """
+    def __init__(
+        self, tokens, platform='github', max_connections=50, max_per_host=50,
+        max_per_token=10, max_attempts=5, timeout=120, logger=None, cassette=None
+    ):
+        self.platform = platform
+        self.cassette = cassette
+        self.tokens = [
+            TokenState(token['access_token'], token.get('rate_limit'))
+            for token in tokens if 'access_token' in token
+        ]
+        if not self.tokens:
+            self.tokens = [TokenState(None)]
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.max_per_token = max_per_token
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self.request_count = 0
+        self.bytes_downloaded = 0
+        # Summed over the concurrent requests, so they add up to more than the wall time
+        self.fetch_seconds = 0.0
+        self.decode_seconds = 0.0
+        # Set once the consumer of stream() stopped reading
+        self._stopped = threading.Event()
+
+    def _headers(self, token):
+        if token.access_token is None:
+            return {}
+        if self.platform == 'gitlab':
+            return {'Authorization': 'Bearer %s' % token.access_token}
+        return {'Authorization': 'token %s' % token.access_token}
+
+    def _record_rate_limit(self, token, headers):
+        remaining_key, reset_key = RATE_LIMIT_HEADERS.get(
+            self.platform, RATE_LIMIT_HEADERS['github']
+        )
+        try:
+            token.remaining = int(headers[remaining_key])
+            token.reset_at = int(headers[reset_key])
+        except (KeyError, ValueError):
+            if token.remaining is not None:
+                token.remaining -= 1
+
+    async def _acquire_token(self):
+        """ Waits for the API key with the largest remaining budget that still has a free
+            concurrency slot """
+        while True:
+            now = time.time()
+            usable = [
+                token for token in self.tokens
+                if not token.bad_credentials and token.budget(now) > 0
+            ]
+            if usable:
+                token = max(usable, key=lambda token: token.budget(now))
+                await token.semaphore.acquire()
+                token.in_flight += 1
+                return token
+
+            candidates = [token for token in self.tokens if not token.bad_credentials]
+            if not candidates:
+                raise RuntimeError("All API keys given to the fetch engine have bad credentials")
+
+            wait = max(min(token.reset_at for token in candidates) - now, 1)
+            self.logger.info(
+                f"All API keys are out of requests, waiting {wait} seconds for the next reset."
+            )
+            await asyncio.sleep(wait)
+
+    def _release_token(self, token):
+        token.in_flight -= 1
+        token.semaphore.release()
+
+    @staticmethod
+    def _page_urls(url, last_url):
+        """ Builds the urls of pages 2 through the last page of a paginated endpoint """
+        try:
+            last_page = int(parse_qs(urlparse(last_url).query)['page'][0])
+        except (KeyError, ValueError, IndexError):
+            return []
+        return [url + f"&page={page}" for page in range(2, last_page + 1)]
+
+    def _replay(self, url):
+        """ Answers a request from the cassette, without an API key or the network """
+        try:
+            status, headers, body = self.cassette.load('GET', url)
+        except CassetteMiss as e:
+            self.logger.info(f"{e}, giving up on it")
+            return None
+        links = {
+            link['rel']: link['url'] for link in parse_header_links(
+                CaseInsensitiveDict(headers).get('Link', '')
+            ) if 'rel' in link
+        }
+        return status, headers, body, links
+
+    async def _fetch(self, session, work, results):
+        url, extra_data, attempt = work
+
+        if self.cassette is not None and self.cassette.replaying:
+            replayed = self._replay(url)
+            if replayed is None:
+                await self._emit(results, FetchResult(url, extra_data, None, None, {}))
+                return []
+            status, headers, body, links = replayed
+            token = None
+        else:
+            token = await self._acquire_token()
+            request_start = time.monotonic()
+            try:
+                async with session.get(url, headers=self._headers(token)) as response:
+                    body = await response.read()
+                    status = response.status
+                    headers = dict(response.headers)
+                    links = {
+                        str(rel): str(link['url']) for rel, link in response.links.items()
+                    }
+                self.request_count += 1
+                self.bytes_downloaded += len(body)
+                self._record_rate_limit(token, headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.logger.info(f"Request to {url} failed with {e!r}, attempt {attempt + 1}")
+                return [(url, extra_data, attempt + 1)]
+            finally:
+                self.fetch_seconds += time.monotonic() - request_start
+                self._release_token(token)
+            if self.cassette is not None:
+                self.cassette.save('GET', url, status, headers, body)
+
+        if (status == 401 or status == 403 or status == 429) and token is None:
+            # Replayed, there is no key to put aside and the cassette answers the same again
+            self.logger.info(f"Url: {url} ; Replayed status code: {status}")
+            return [(url, extra_data, attempt + 1)]
+
+        if status == 401:
+            self.logger.warning("Removing API key with bad credentials from the fetch engine.")
+            token.bad_credentials = True
+            return [(url, extra_data, attempt)]
+
+        if status == 403 or status == 429:
+            retry_after = headers.get('Retry-After')
+            if not retry_after and token.remaining:
+                # Forbidden for a reason other than the rate limit
+                self.logger.info(f"Url: {url} ; Status code: {status}")
+                return [(url, extra_data, attempt + 1)]
+            token.remaining = 0
+            if retry_after:
+                token.reset_at = time.time() + int(retry_after)
+            elif token.reset_at <= time.time():
+                token.reset_at = time.time() + 60
+            return [(url, extra_data, attempt)]
+
+        if status == 404:
+            self.logger.info(f"Not found url: {url}")
+            await self._emit(results, FetchResult(url, extra_data, status, None, headers))
+            return []
+
+        if status != 200:
+            self.logger.info(f"Url: {url} ; Unhandled status code: {status}")
+            return [(url, extra_data, attempt + 1)]
+
+        decode_start = time.monotonic()
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = body.decode('utf-8', errors='replace')
+        self.decode_seconds += time.monotonic() - decode_start
+
+        await self._emit(results, FetchResult(url, extra_data, status, data, headers))
+
+        if 'last' in links and "&page=" not in url:
+            return [
+                (page_url, extra_data, 0) for page_url in self._page_urls(url, links['last'])
+            ]
+        return []
+
+    async def _emit(self, results, result):
+        """ Hands a result to the consumer. While the consumer is behind and the results
+            queue is full, this fetch waits without holding up the event loop, so at most
+            the queue's maxsize results plus one per connection are held in memory. """
+        while not self._stopped.is_set():
+            try:
+                results.put_nowait(result)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.05)
+
+    async def _run(self, urls, results):
+        for token in self.tokens:
+            token.semaphore = asyncio.Semaphore(self.max_per_token)
+
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections, limit_per_host=self.max_per_host
+        )
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        pending = asyncio.Queue()
+        for url, extra_data in urls:
+            pending.put_nowait((url, extra_data, 0))
+
+        async def fetch_worker(session):
+            while True:
+                work = await pending.get()
+                try:
+                    if self._stopped.is_set():
+                        continue
+                    if work[2] >= self.max_attempts:
+                        self.logger.info(f"Giving up on url after {work[2]} attempts: {work[0]}")
+                        await self._emit(results, FetchResult(work[0], work[1], None, None, {}))
+                        continue
+                    for follow_up in await self._fetch(session, work, results):
+                        pending.put_nowait(follow_up)
+                except Exception as e:
+                    self.logger.info(f"{work[0]} generated an exception: {e!r}")
+                finally:
+                    pending.task_done()
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            fetch_workers = [
+                asyncio.ensure_future(fetch_worker(session))
+                for _ in range(self.max_connections)
+            ]
+            try:
+                await pending.join()
+            finally:
+                for fetch_worker_task in fetch_workers:
+                    fetch_worker_task.cancel()
+                await asyncio.gather(*fetch_workers, return_exceptions=True)
+
+    def stream(self, urls):
+        """ Fetches every url and yields a FetchResult for each page as it arrives.
+            Pages 2..n of paginated endpoints are discovered from the Link header and
+            fetched as well.
+
+        :param urls: List of tuples, (url, extra_data dict)
+        """
+        # Fetching slows down to the pace the results are consumed at
+        results = queue.Queue(maxsize=self.max_connections * 2)
+        self._stopped = threading.Event()
+        done = object()
+        errors = []
+
+        def run_loop():
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(self._run(urls, results))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                loop.close()
+                while not self._stopped.is_set():
+                    try:
+                        results.put(done, timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+
+        thread = threading.Thread(target=run_loop, daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                result = results.get()
+                if result is done:
+                    break
+                yield result
+        finally:
+            # A consumer that stops early lets the fetches that wait on it give up
+            self._stopped.set()
+
+        thread.join()
+        if errors:
+            raise errors[0]
+
+    def token_budgets(self):
+        """ Returns the last known remaining requests of each key, keyed by access token """
+        return {
+            token.access_token: token.remaining for token in self.tokens
+            if token.remaining is not None
+        }
+
+    def token_resets(self):
+        """ Returns the last known rate limit reset time (epoch seconds) of each key, keyed
+            by access token """
+        return {
+            token.access_token: token.reset_at for token in self.tokens
+            if token.reset_at
+        }
@@ -0,0 +1,114 @@
+#SPDX-License-Identifier: MIT
+""" Flattening of nested api payloads by dotted field paths ('user.login'), straight from the
+    decoded json without building DataFrames """
+import math
+
+def integer(value):
+    """ Column type of integer ids the api sometimes gives as floats or strings """
+    if value is None or value == '' or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return int(float(value))
+
+def field_getter(path):
+    """ Compiles a dotted path into a function returning the value a data point has at the
+        path, or None where the path is missing. A data point that was already flattened
+        and has the path itself as a key gives the value of that key.
+    """
+    keys = path.split('.')
+
+    def get(data_point):
+        if path in data_point:
+            return data_point[path]
+        value = data_point
+        for key in keys:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+    return get
+
+def flatten(data, paths):
+    """ Returns copies of the data points with the attributes of the objects at the roots of
+        the dotted paths added under 'root.attribute' keys, so ['user.login'] adds
+        'user.login', 'user.id' and the rest of the user's attributes. Every data point gets
+        the same keys, None where its object or the path is missing, and keys a data point
+        already has are kept.
+
+    :param data: List of dicts, api data points
+    :param paths: List of strings, paths without a '.' are left alone
+    """
+    roots = []
+    for path in paths:
+        root = path.split('.')[0]
+        if '.' in path and root not in roots:
+            roots.append(root)
+    if not roots:
+        return [dict(data_point) for data_point in data]
+
+    attributes = {root: {} for root in roots}
+    for data_point in data:
+        for root in roots:
+            nested = data_point.get(root)
+            if isinstance(nested, dict):
+                attributes[root].update(dict.fromkeys(nested))
+    getters = [(path, field_getter(path)) for path in paths if '.' in path]
+
+    flattened = []
+    for data_point in data:
+        flat = dict(data_point)
+        for root in roots:
+            nested = data_point.get(root)
+            if not isinstance(nested, dict):
+                nested = {}
+            for attribute in attributes[root]:
+                flat.setdefault(f'{root}.{attribute}', nested.get(attribute))
+        for path, get in getters:
+            flat.setdefault(path, get(data_point))
+        flattened.append(flat)
+    return flattened
+
+class FieldMap():
+    """ Declarative mapping of the columns of a table onto dotted source paths, e.g.
+
+        FieldMap({'cntrb_login': 'user.login', 'gh_user_id': ('user.id', integer)})
+
+        A column is given its path, or a (path, type) tuple whose type converts the values
+        that are not None.
+
+    :param fields: Dict of column to source path
+    """
+    def __init__(self, fields):
+        self.fields = {
+            column: path if isinstance(path, tuple) else (path, None)
+            for column, path in fields.items()
+        }
+        self._getters = [
+            (column, field_getter(path), column_type)
+            for column, (path, column_type) in self.fields.items()
+        ]
+
+    def prefixed(self, prefix):
+        """ Returns the map with the prefix, e.g. 'user.', put in front of every path """
+        return FieldMap({
+            column: (f'{prefix}{path}', column_type)
+            for column, (path, column_type) in self.fields.items()
+        })
+
+    def columns(self, data):
+        """ Extracts the data points into a list of values per column
+
+        :param data: List of dicts, api data points, nested or flattened
+        :return: Dict of column to list of values, in the order of the data points
+        """
+        columns = {}
+        for column, get, column_type in self._getters:
+            values = [get(data_point) for data_point in data]
+            if column_type is not None:
+                values = [value if value is None else column_type(value) for value in values]
+            columns[column] = values
+        return columns
+
+    def records(self, data):
+        """ Extracts the data points into rows of the table's columns """
+        columns = self.columns(data)
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
@@ -0,0 +1,263 @@
+#SPDX-License-Identifier: MIT
+""" Collection of issues with their comments, events, labels and assignees in one nested
+    GraphQL query, with the nodes reshaped like the REST api's so the issues are stored the
+    same way """
+import json
+
+ISSUES_PER_PAGE = 50
+
+# Nodes per page of the connections nested in each issue, issues with more are paged through
+#   afterwards with follow-up queries of CONNECTION_PAGE_SIZE nodes
+NESTED_PAGE_SIZES = {'comments': 50, 'timelineItems': 50, 'labels': 20, 'assignees': 10}
+CONNECTION_PAGE_SIZE = 100
+CONNECTIONS_PER_QUERY = 50
+
+# Appended to the queries, the actor of an issue, comment or event is selected with
+#   ...actorFields
+ACTOR_FRAGMENT = """
+fragment actorFields on Actor {
+    __typename
+    login
+    avatarUrl
+    url
+    ... on User { id databaseId }
+    ... on Bot { id databaseId }
+    ... on Mannequin { id databaseId }
+    ... on Organization { id databaseId }
+}
+"""
+
+# The REST api reports deleted accounts as the ghost user, GraphQL returns a null author
+GHOST = {
+    '__typename': 'User', 'login': 'ghost', 'id': 'MDQ6VXNlcjEwMTM3', 'databaseId': 10137,
+    'avatarUrl': 'https://avatars.githubusercontent.com/u/10137?v=4',
+    'url': 'https://github.com/ghost'
+}
+
+# Timeline item types collected, with the event name the REST issue events api gives them
+EVENT_TYPES = {
+    'ClosedEvent': 'closed', 'ReopenedEvent': 'reopened', 'LabeledEvent': 'labeled',
+    'UnlabeledEvent': 'unlabeled', 'AssignedEvent': 'assigned',
+    'UnassignedEvent': 'unassigned', 'ReferencedEvent': 'referenced',
+    'RenamedTitleEvent': 'renamed', 'MilestonedEvent': 'milestoned',
+    'DemilestonedEvent': 'demilestoned', 'LockedEvent': 'locked', 'UnlockedEvent': 'unlocked'
+}
+
+def _item_type(event_type):
+    # ClosedEvent -> CLOSED_EVENT
+    return ''.join(
+        f'_{character}' if character.isupper() and position else character
+        for position, character in enumerate(event_type)
+    ).upper()
+
+EVENT_FIELDS = '__typename\n... on Node { id }\n' + ''.join(
+    f'... on {event_type} {{ createdAt actor {{ ...actorFields }} }}\n'
+    for event_type in EVENT_TYPES
+) + """
+    ... on ClosedEvent { closer { __typename ... on Commit { oid } } }
+    ... on ReferencedEvent { commit { oid } }
+"""
+
+# Arguments and node fields of each connection nested in an issue
+CONNECTIONS = {
+    'comments': ('', f"""
+        id
+        databaseId
+        body
+        createdAt
+        updatedAt
+        url
+        author {{ ...actorFields }}
+    """),
+    'timelineItems': (
+        f", itemTypes: [{', '.join(_item_type(event_type) for event_type in EVENT_TYPES)}]",
+        EVENT_FIELDS
+    ),
+    'labels': ('', """
+        id
+        name
+        description
+        color
+    """),
+    'assignees': ('', '...actorFields')
+}
+
+def _connection(name, first, cursor=None):
+    arguments, fields = CONNECTIONS[name]
+    after = f', after: {json.dumps(cursor)}' if cursor else ''
+    # The comment count of an issue is compared with the stored one to find updated issues
+    total_count = '  totalCount\n' if name == 'comments' else ''
+    return (
+        f'{name}(first: {first}{after}{arguments}) {{\n'
+        f'{total_count}'
+        '  pageInfo { hasNextPage endCursor }\n'
+        f'  nodes {{ {fields} }}\n'
+        '}\n'
+    )
+
+def issues_query(owner, repo, cursor=None, since=None):
+    """ Builds a query for a page of the repo's issues, least recently updated first, each
+        with the first page of its comments, events, labels and assignees
+
+    :param cursor: String, endCursor of the previous page of issues
+    :param since: String, only issues updated at or after this timestamp
+    """
+    arguments = f'first: {ISSUES_PER_PAGE}, orderBy: {{field: UPDATED_AT, direction: ASC}}'
+    if cursor:
+        arguments += f', after: {json.dumps(cursor)}'
+    if since:
+        arguments += f', filterBy: {{since: {json.dumps(since)}}}'
+    nested = ''.join(_connection(name, first) for name, first in NESTED_PAGE_SIZES.items())
+    return (
+        f'{{\nrepository(owner: {json.dumps(owner)}, name: {json.dumps(repo)}) {{\n'
+        f'issues({arguments}) {{\n'
+        '  pageInfo { hasNextPage endCursor }\n'
+        '  nodes {\n'
+        '    id databaseId number title body state createdAt updatedAt closedAt url\n'
+        f'    author {{ ...actorFields }}\n'
+        f'{nested}'
+        '  }\n'
+        '}\n}\n}\n'
+        f'{ACTOR_FRAGMENT}'
+    )
+
+def overflowing_connections(issue):
+    """ Returns a (issue node id, connection, cursor) page for every connection of the issue
+        that has more nodes than the issues query returned """
+    return [
+        (issue['id'], name, issue[name]['pageInfo']['endCursor'])
+        for name in NESTED_PAGE_SIZES if issue[name]['pageInfo']['hasNextPage']
+    ]
+
+def follow_up_query(pages):
+    """ Builds a query for the next page of up to CONNECTIONS_PER_QUERY issue connections,
+        each under its own alias (n0, n1, ...)
+
+    :param pages: List of (issue node id, connection, cursor) tuples
+    """
+    fields = ''.join(
+        f'n{position}: node(id: {json.dumps(node_id)}) {{\n'
+        f'  ... on Issue {{ {_connection(name, CONNECTION_PAGE_SIZE, cursor)} }}\n'
+        '}\n'
+        for position, (node_id, name, cursor) in enumerate(pages)
+    )
+    return f'{{\n{fields}}}\n{ACTOR_FRAGMENT}'
+
+def follow_up_pages(pages, data):
+    """ Pairs the pages of a follow_up_query with the nodes returned
+
+    :param data: Dict, the 'data' of the GraphQL response
+    :return: Dict of (issue node id, connection) to a tuple of the list of nodes and the
+        cursor of the next page, which is None on the last page
+    """
+    connections = {}
+    for position, (node_id, name, _) in enumerate(pages):
+        node = data.get(f'n{position}')
+        if not node or not node.get(name):
+            continue
+        page_info = node[name]['pageInfo']
+        connections[(node_id, name)] = (
+            node[name]['nodes'], page_info['endCursor'] if page_info['hasNextPage'] else None
+        )
+    return connections
+
+def rest_user(actor):
+    """ Reshapes a GraphQL actor like a user of the REST api, with the fields enrich_cntrb_id
+        stores for new contributors """
+    if not actor:
+        return None
+    login = actor['login']
+    if actor['__typename'] == 'Bot':
+        # The REST api gives apps their login with a [bot] suffix
+        login = f'{login}[bot]'
+    api_url = f'https://api.github.com/users/{login}'
+    return {
+        'login': login,
+        'id': actor.get('databaseId'),
+        'node_id': actor.get('id'),
+        'avatar_url': actor['avatarUrl'],
+        'gravatar_id': '',
+        'url': api_url,
+        'html_url': actor['url'],
+        'followers_url': f'{api_url}/followers',
+        'following_url': f'{api_url}/following{{/other_user}}',
+        'gists_url': f'{api_url}/gists{{/gist_id}}',
+        'starred_url': f'{api_url}/starred{{/owner}}{{/repo}}',
+        'subscriptions_url': f'{api_url}/subscriptions',
+        'organizations_url': f'{api_url}/orgs',
+        'repos_url': f'{api_url}/repos',
+        'events_url': f'{api_url}/events{{/privacy}}',
+        'received_events_url': f'{api_url}/received_events',
+        'type': actor['__typename'],
+        'site_admin': False
+    }
+
+def rest_issue(node, owner, repo):
+    """ Reshapes a GraphQL issue like an issue of the REST api, with its labels and
+        assignees, see issues_query """
+    repository_url = f'https://api.github.com/repos/{owner}/{repo}'
+    issue_url = f"{repository_url}/issues/{node['number']}"
+    assignees = [rest_user(assignee) for assignee in node['assignees']['nodes']]
+    return {
+        'id': node['databaseId'],
+        'node_id': node['id'],
+        'number': node['number'],
+        'title': node['title'],
+        'body': node['body'],
+        'state': node['state'].lower(),
+        'comments': node['comments']['totalCount'],
+        'created_at': node['createdAt'],
+        'updated_at': node['updatedAt'],
+        'closed_at': node['closedAt'],
+        'repository_url': repository_url,
+        'url': issue_url,
+        'labels_url': f'{issue_url}/labels{{/name}}',
+        'comments_url': f'{issue_url}/comments',
+        'events_url': f'{issue_url}/events',
+        'html_url': node['url'],
+        'user': rest_user(node['author'] or GHOST),
+        'assignees': assignees,
+        'assignee': assignees[0] if assignees else None,
+        'labels': [
+            {
+                'id': None, 'node_id': label['id'], 'name': label['name'],
+                'description': label['description'], 'color': label['color']
+            } for label in node['labels']['nodes']
+        ]
+    }
+
+def rest_comments(node, owner, repo):
+    """ Reshapes the comments of a GraphQL issue like comments of the REST api """
+    issue_url = f"https://api.github.com/repos/{owner}/{repo}/issues/{node['number']}"
+    return [
+        {
+            'id': comment['databaseId'],
+            'node_id': comment['id'],
+            'body': comment['body'],
+            'created_at': comment['createdAt'],
+            'updated_at': comment['updatedAt'],
+            'html_url': comment['url'],
+            'issue_url': issue_url,
+            'user': rest_user(comment['author'] or GHOST)
+        } for comment in node['comments']['nodes']
+    ]
+
+def rest_events(node):
+    """ Reshapes the timeline items of a GraphQL issue like issue events of the REST api. The
+        GraphQL api has no numeric ids or api urls for them, only node ids """
+    events = []
+    for item in node['timelineItems']['nodes']:
+        if item.get('__typename') not in EVENT_TYPES:
+            continue
+        commit = item.get('commit') or item.get('closer') or {}
+        events.append({
+            'id': None,
+            'node_id': item['id'],
+            'url': None,
+            'actor': rest_user(item.get('actor')),
+            'created_at': item['createdAt'],
+            'event': EVENT_TYPES[item['__typename']],
+            'commit_id': commit.get('oid'),
+            'issue': {'id': node['databaseId'], 'number': node['number']}
+        })
+    return events
@@ -0,0 +1,56 @@
+#SPDX-License-Identifier: MIT
+""" Batched collection of pull request files through aliased GraphQL pullRequest(number:)
+    fields """
+import json
+
+# Pull requests per query, with 100 files each this stays far below GitHub's node limit
+PULL_REQUESTS_PER_QUERY = 50
+
+FILES_PER_PAGE = 100
+
+def pr_files_query(owner, repo, pages):
+    """ Builds a query for a page of files of every pull request under its own alias (p0,
+        p1, ...)
+
+    :param owner: String, the repo's owner
+    :param repo: String, the repo's name
+    :param pages: List of (pr_src_number, cursor) tuples, the cursor is the endCursor of the
+        pull request's previous page of files or None for its first page
+    """
+    fields = ''
+    for position, (number, cursor) in enumerate(pages):
+        after = f', after: {json.dumps(cursor)}' if cursor else ''
+        fields += (
+            f'p{position}: pullRequest(number: {int(number)}) {{\n'
+            f'  files(first: {FILES_PER_PAGE}{after}) {{\n'
+            '    pageInfo { hasNextPage endCursor }\n'
+            '    nodes { additions deletions path }\n'
+            '  }\n'
+            '}\n'
+        )
+    return (
+        f'{{\nrepository(owner: {json.dumps(owner)}, name: {json.dumps(repo)}) {{\n'
+        f'{fields}}}\n}}'
+    )
+
+def pr_files_from_response(pages, data):
+    """ Pairs the pull requests of a pr_files_query with their page of files, pull requests
+        that were not found are left out
+
+    :param pages: The pages argument of the query
+    :param data: Dict, the 'data' of the GraphQL response
+    :return: Dict of pr_src_number to a tuple of the list of file nodes and the cursor of the
+        next page, which is None on the last page
+    """
+    repository = data.get('repository') or {}
+    files = {}
+    for position, (number, _) in enumerate(pages):
+        pull_request = repository.get(f'p{position}')
+        if not pull_request or not pull_request.get('files'):
+            continue
+        page_info = pull_request['files']['pageInfo']
+        files[number] = (
+            pull_request['files']['nodes'],
+            page_info['endCursor'] if page_info['hasNextPage'] else None
+        )
+    return files
@@ -0,0 +1,106 @@
+#SPDX-License-Identifier: MIT
+""" Batched lookups of GitHub users through aliased GraphQL user(login:) fields """
+import json
+
+from workers.field_map import FieldMap, integer
+
+GRAPHQL_URL = 'https://api.github.com/graphql'
+
+# GitHub allows up to 100 nodes per query
+USERS_PER_QUERY = 100
+
+USER_FIELDS = """
+    login
+    id
+    databaseId
+    url
+    avatarUrl
+    email
+    company
+    location
+    createdAt
+    isSiteAdmin
+"""
+
+def users_query(logins):
+    """ Builds a query that looks up every login under its own alias (u0, u1, ...)
+
+    :param logins: List of strings, at most USERS_PER_QUERY logins
+    """
+    fields = ''.join(
+        f'u{position}: user(login: {json.dumps(login)}) {{{USER_FIELDS}}}\n'
+        for position, login in enumerate(logins)
+    )
+    return f'{{\n{fields}}}'
+
+def users_from_response(logins, data):
+    """ Pairs the logins of a users_query with the users returned, logins that are not users
+        (deleted accounts, organizations, bots) are left out
+
+    :param data: Dict, the 'data' of the GraphQL response
+    :return: Dict of login to user node
+    """
+    return {
+        login: data[f'u{position}'] for position, login in enumerate(logins)
+        if data.get(f'u{position}')
+    }
+
+# Columns of the contributors table filled from a user of the REST api
+REST_USER_FIELDS = FieldMap({
+    'cntrb_login': 'login',
+    'cntrb_created_at': 'created_at',
+    'cntrb_email': 'email',
+    'cntrb_company': 'company',
+    'cntrb_location': 'location',
+    'cntrb_canonical': 'email',
+    'gh_user_id': ('id', integer),
+    'gh_login': 'login',
+    'gh_url': 'url',
+    'gh_html_url': 'html_url',
+    'gh_node_id': 'node_id',
+    'gh_avatar_url': 'avatar_url',
+    'gh_gravatar_id': 'gravatar_id',
+    'gh_followers_url': 'followers_url',
+    'gh_following_url': 'following_url',
+    'gh_gists_url': 'gists_url',
+    'gh_starred_url': 'starred_url',
+    'gh_subscriptions_url': 'subscriptions_url',
+    'gh_organizations_url': 'organizations_url',
+    'gh_repos_url': 'repos_url',
+    'gh_events_url': 'events_url',
+    'gh_received_events_url': 'received_events_url',
+    'gh_type': 'type',
+    'gh_site_admin': 'site_admin'
+})
+
+def contributor_from_user(user):
+    """ Maps a GraphQL user node onto the columns of the contributors table, filled the way
+        the REST /users/<login> response fills them """
+    login = user['login']
+    api_url = f'https://api.github.com/users/{login}'
+    return {
+        'cntrb_login': login,
+        'cntrb_created_at': user['createdAt'],
+        'cntrb_email': user['email'] or None,
+        'cntrb_company': user['company'],
+        'cntrb_location': user['location'],
+        'cntrb_canonical': user['email'] or None,
+        'gh_user_id': user['databaseId'],
+        'gh_login': login,
+        'gh_url': api_url,
+        'gh_html_url': user['url'],
+        'gh_node_id': user['id'],
+        'gh_avatar_url': user['avatarUrl'],
+        'gh_gravatar_id': '',
+        'gh_followers_url': f'{api_url}/followers',
+        'gh_following_url': f'{api_url}/following{{/other_user}}',
+        'gh_gists_url': f'{api_url}/gists{{/gist_id}}',
+        'gh_starred_url': f'{api_url}/starred{{/owner}}{{/repo}}',
+        'gh_subscriptions_url': f'{api_url}/subscriptions',
+        'gh_organizations_url': f'{api_url}/orgs',
+        'gh_repos_url': f'{api_url}/repos',
+        'gh_events_url': f'{api_url}/events{{/privacy}}',
+        'gh_received_events_url': f'{api_url}/received_events',
+        'gh_type': 'User',
+        'gh_site_admin': user['isSiteAdmin']
+    }
@@ -9,8 +9,14 @@ import logging
 import json
 import os
 import math
+from concurrent import futures
 from datetime import datetime
 from workers.worker_base import Worker
+from workers.task_context import bind_context
+from workers.github_issues_graphql import (
+    CONNECTIONS_PER_QUERY, follow_up_pages, follow_up_query, issues_query,
+    overflowing_connections, rest_comments, rest_events, rest_issue
+)
 
 class GitHubWorker(Worker):
     """ Worker that collects data from the Github API and stores it in our database
@@ -24,7 +30,7 @@ class GitHubWorker(Worker):
         worker_type = 'github_worker'
 
         given = [['github_url']]
-        models = ['issues']
+        models = ['issues', 'issues_graphql']
 
         data_tables = [
             'contributors', 'issues', 'issue_labels', 'message',
@@ -51,9 +57,11 @@ class GitHubWorker(Worker):
 
     def _get_pk_source_issues(self):
 
+        # Only issues updated since the last collection are needed
+        since = self.get_high_water_mark('issues')
         issues_url = (
             f"https://api.github.com/repos/{self.owner}/{self.repo}"
-            "/issues?per_page=100&state=all&page={}"
+            "/issues?per_page=100&state=all" + (f"&since={since}" if since else "") + "&page={}"
         )
 
         action_map = {
@@ -72,11 +80,23 @@ class GitHubWorker(Worker):
             table=self.issues_table, where_clause=self.issues_table.c.repo_id == self.repo_id
         )
 
+        self.stage_high_water_mark('issues', source_issues['all'])
+
+        # The calling model registers the task as completed, also when there is nothing to do
         if len(source_issues['all']) == 0:
-            self.logger.info("There are no issues for this repository.\n")
-            self.register_task_completion(self.task_info, self.repo_id, 'issues')
+            self.logger.info("There are no new or updated issues for this repository.\n")
             return False
 
+        return self._store_issues(source_issues, action_map)
+
+    def _store_issues(self, source_issues, action_map):
+        """ Inserts and updates the issues the api returned
+
+        :param source_issues: Dict with the 'insert', 'update' and 'all' issues, in the REST
+            api's layout
+        :return: List of the issues with the issue_id they are stored with, None if there is
+            nothing to store or collect nested data for
+        """
         def is_valid_pr_block(issue):
             return (
                 'pull_request' in issue and issue['pull_request']
@@ -141,7 +161,6 @@ class GitHubWorker(Worker):
             self.logger.info(
                 "There are not issues to update, insert, or collect nested information for.\n"
             )
-            self.register_task_completion(entry_info, self.repo_id, 'issues')
             return
 
         if self.deep_collection:
@@ -178,11 +197,158 @@ class GitHubWorker(Worker):
         # Register this task as completed
         self.register_task_completion(entry_info, self.repo_id, 'issues')
 
+    def query_issues_graphql(self, since=None):
+        """ Pages through the repo's issues with issues_query, then pages through the comments,
+            events, labels and assignees of the issues that have more than the first page of
+            them, CONNECTIONS_PER_QUERY connections per follow-up query
+
+        :param since: String, only issues updated at or after this timestamp
+        :return: List of GraphQL issue nodes with all the nodes of their connections
+        """
+        issues = []
+        cursor = None
+        page_count = 0
+        while True:
+            page_count += 1
+            self.logger.info(f"Querying page {page_count} of issues\n")
+            data = self.query_graphql(issues_query(self.owner, self.repo, cursor, since))
+            if data is None or not data.get('repository'):
+                self.logger.warning(f"Could not query issues of {self.owner}/{self.repo}\n")
+                break
+            connection = data['repository']['issues']
+            issues += connection['nodes']
+            if not connection['pageInfo']['hasNextPage']:
+                break
+            cursor = connection['pageInfo']['endCursor']
+
+        issues_by_id = {issue['id']: issue for issue in issues}
+        pending = [page for issue in issues for page in overflowing_connections(issue)]
+        with futures.ThreadPoolExecutor(
+            max_workers=self.config.get('graphql_concurrency', 4)
+        ) as executor:
+            while pending:
+                batches = [
+                    pending[start:start + CONNECTIONS_PER_QUERY]
+                    for start in range(0, len(pending), CONNECTIONS_PER_QUERY)
+                ]
+                self.logger.info(
+                    f"Querying {len(pending)} more pages of issue connections in "
+                    f"{len(batches)} queries\n"
+                )
+                pending = []
+                # The queries count towards this task's metrics
+                responses = executor.map(bind_context(
+                    lambda batch: self.query_graphql(follow_up_query(batch))
+                ), batches)
+                for batch, data in zip(batches, responses):
+                    if data is None:
+                        self.logger.warning(f"Could not query issue connections: {batch}\n")
+                        continue
+                    for (node_id, name), (nodes, cursor) in follow_up_pages(batch, data).items():
+                        issues_by_id[node_id][name]['nodes'] += nodes
+                        if cursor is not None:
+                            pending.append((node_id, name, cursor))
+
+        self.logger.info(f"Collected {len(issues)} issues\n")
+        return issues
+
+    def issues_graphql_model(self, entry_info, repo_id):
+        """ Data collection function
+        Query the GitHub GraphQL API for issues with their comments, events, labels and
+        assignees at once, rather than in separate passes over the REST API like issues_model.
+        The GraphQL issues connection does not include pull requests.
+        """
+        issues = self.query_issues_graphql(since=self.get_high_water_mark('issues'))
+
+        source_issues = {'all': [rest_issue(issue, self.owner, self.repo) for issue in issues]}
+        self.stage_high_water_mark('issues', source_issues['all'])
+
+        if len(source_issues['all']) == 0:
+            self.logger.info("There are no new or updated issues for this repository.\n")
+            self.register_task_completion(entry_info, self.repo_id, 'issues_graphql')
+            return
+
+        issue_action_map = {
+            'insert': {
+                'source': ['id'],
+                'augur': ['gh_issue_id']
+            },
+            'update': {
+                'source': ['comments', 'state'],
+                'augur': ['comment_count', 'issue_state']
+            }
+        }
+        source_issues['insert'], source_issues['update'] = self.new_organize_needed_data(
+            source_issues['all'], augur_table=self.issues_table,
+            where_clause=self.issues_table.c.repo_id == self.repo_id,
+            action_map=issue_action_map
+        )
+        pk_source_issues = self._store_issues(source_issues, issue_action_map)
+        if not pk_source_issues:
+            self.register_task_completion(entry_info, self.repo_id, 'issues_graphql')
+            return
+
+        # Comments
+        comment_action_map = {
+            'insert': {
+                'source': ['created_at', 'body'],
+                'augur': ['msg_timestamp', 'msg_text']
+            }
+        }
+        source_comments = [
+            comment for issue in issues for comment in rest_comments(issue, self.owner, self.repo)
+        ]
+        comments_insert, _ = self.new_organize_needed_data(
+            source_comments, augur_table=self.message_table,
+            where_clause=self.repo_scope(
+                self.message_table, ('msg_id', self.issue_message_ref_table),
+                ('issue_id', self.issues_table)
+            ),
+            action_map=comment_action_map
+        )
+        self._store_issue_comments({'insert': comments_insert}, comment_action_map)
+
+        # Events, which only have node ids in the GraphQL api
+        event_action_map = {
+            'insert': {
+                'source': ['node_id'],
+                'augur': ['node_id']
+            }
+        }
+        source_events = [event for issue in issues for event in rest_events(issue)]
+        events_insert, _ = self.new_organize_needed_data(
+            source_events, augur_table=self.issue_events_table,
+            where_clause=self.repo_scope(
+                self.issue_events_table, ('issue_id', self.issues_table)
+            ),
+            action_map=event_action_map
+        )
+        self._store_issue_events(events_insert, event_action_map)
+
+        # Labels have no numeric ids in the GraphQL api either
+        self.issue_nested_data_model(
+            pk_source_issues, source_events, assignee_action_map={
+                'insert': {
+                    'source': ['issue_id', 'id'],
+                    'augur': ['issue_id', 'issue_assignee_src_id']
+                }
+            }, label_action_map={
+                'insert': {
+                    'source': ['issue_id', 'node_id'],
+                    'augur': ['issue_id', 'label_src_node_id']
+                }
+            }
+        )
+
+        # Register this task as completed
+        self.register_task_completion(entry_info, self.repo_id, 'issues_graphql')
+
     def issue_comments_model(self, pk_source_issues):
 
+        since = self.get_high_water_mark('issue_comments')
         comments_url = (
             f"https://api.github.com/repos/{self.owner}/{self.repo}"
-            "/issues/comments?per_page=100&page={}"
+            "/issues/comments?per_page=100" + (f"&since={since}" if since else "") + "&page={}"
         )
 
         # Get contributors that we already have stored
@@ -195,24 +361,26 @@ class GitHubWorker(Worker):
             }
         }
 
-        # list to hold contributors needing insertion or update
-        issue_comments = self.new_paginate_endpoint(
+        def insert_comment_batch(issue_comments):
+            self.stage_high_water_mark('issue_comments', issue_comments['all'])
+            self._store_issue_comments(issue_comments, comment_action_map)
+
+        # Comments are organized and inserted a batch at a time as the pages arrive
+        comment_count = self.new_paginate_endpoint(
             comments_url, action_map=comment_action_map, table=self.message_table,
-            where_clause=self.message_table.c.msg_id.in_(
-                [
-                    msg_row[0] for msg_row in self.db.execute(
-                        s.sql.select(
-                            [self.issue_message_ref_table.c.msg_id]
-                        ).where(
-                            self.issue_message_ref_table.c.issue_id.in_(
-                                set(pd.DataFrame(pk_source_issues)['issue_id'])
-                            )
-                        )
-                    ).fetchall()
-                ]
-            )
+            where_clause=self.repo_scope(
+                self.message_table, ('msg_id', self.issue_message_ref_table),
+                ('issue_id', self.issues_table)
+            ),
+            batch_callback=insert_comment_batch
         )
+        self.logger.info(f"Collected {comment_count} issue comments.\n")
 
+    def _store_issue_comments(self, issue_comments, comment_action_map):
+        """ Inserts the comments the api returned and links them to their issues
+
+        :param issue_comments: Dict with the 'insert' comments, in the REST api's layout
+        """
         issue_comments['insert'] = self.enrich_cntrb_id(
             issue_comments['insert'], 'user.login', action_map_additions={
                 'insert': {
@@ -293,8 +461,17 @@ class GitHubWorker(Worker):
             )
         )
 
+        self._store_issue_events(issue_events['insert'], event_action_map)
+
+        return issue_events['all']
+
+    def _store_issue_events(self, source_events, event_action_map):
+        """ Inserts the issue events the api returned
+
+        :param source_events: List of the events to insert, in the REST api's layout
+        """
         pk_issue_events = self.enrich_data_primary_keys(
-            issue_events['insert'], self.issues_table, ['issue.id'], ['gh_issue_id']
+            source_events, self.issues_table, ['issue.id'], ['gh_issue_id']
         )
 
         if len(pk_issue_events):
@@ -332,9 +509,10 @@ class GitHubWorker(Worker):
             unique_columns=event_action_map['insert']['augur']
         )
 
-        return issue_events['all']
-
-    def issue_nested_data_model(self, pk_source_issues, issue_events_all):
+    def issue_nested_data_model(
+        self, pk_source_issues, issue_events_all, assignee_action_map=None,
+        label_action_map=None
+    ):
 
         closed_issue_updates = []
 
@@ -385,10 +563,12 @@ class GitHubWorker(Worker):
                 and not is_nan(issue['assignee'])
             ):
                 source_assignees.append(issue['assignee'])
-            assignees_all += source_assignees
+            assignees_all += [
+                {**assignee, 'issue_id': issue['issue_id']} for assignee in source_assignees
+            ]
 
             # Issue Labels
-            labels_all += issue['labels']
+            labels_all += [{**label, 'issue_id': issue['issue_id']} for label in issue['labels']]
 
             # If the issue is closed, then we search for the closing event and store the user's id
             if 'closed_at' in issue and not skip_closed_issue_update:
@@ -416,7 +596,7 @@ class GitHubWorker(Worker):
         )
 
         # Issue assignees insertion
-        assignee_action_map = {
+        assignee_action_map = assignee_action_map or {
             'insert': {
                 'source': ['id'],
                 'augur': ['issue_assignee_src_id']
@@ -425,6 +605,9 @@ class GitHubWorker(Worker):
 
         source_assignees_insert, _ = self.new_organize_needed_data(
             assignees_all, augur_table=self.issue_assignees_table,
+            where_clause=self.repo_scope(
+                self.issue_assignees_table, ('issue_id', self.issues_table)
+            ),
             action_map=assignee_action_map
         )
 
@@ -439,7 +622,7 @@ class GitHubWorker(Worker):
 
         assignees_insert = [
             {
-                'issue_id': issue['issue_id'],
+                'issue_id': assignee['issue_id'],
                 'cntrb_id': assignee['cntrb_id'],
                 'tool_source': self.tool_source,
                 'tool_version': self.tool_version,
@@ -454,7 +637,7 @@ class GitHubWorker(Worker):
         )
 
         # Issue labels insertion
-        label_action_map = {
+        label_action_map = label_action_map or {
             'insert': {
                 'source': ['id'],
                 'augur': ['label_src_id']
@@ -462,11 +645,14 @@ class GitHubWorker(Worker):
         }
         source_labels_insert, _ = self.new_organize_needed_data(
             labels_all, augur_table=self.issue_labels_table,
+            where_clause=self.repo_scope(
+                self.issue_labels_table, ('issue_id', self.issues_table)
+            ),
             action_map=label_action_map
         )
         labels_insert = [
             {
-                'issue_id': issue['issue_id'],
+                'issue_id': label['issue_id'],
                 'label_text': label['name'],
                 'label_description': label['description'] if 'description' in label else None,
                 'label_color': label['color'],
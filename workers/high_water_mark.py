@@ -0,0 +1,97 @@
+#SPDX-License-Identifier: MIT
+""" Durable per repo and model high-water marks for incremental collection """
+import datetime
+
+import sqlalchemy as s
+
+# Format of timestamps in api responses and of the since parameter
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+def next_mark(values, started_at, skew=datetime.timedelta(minutes=5)):
+    """ Computes the new mark from the timestamps collected in this run
+
+    :param values: List of strings, timestamps (TIMESTAMP_FORMAT) of the collected data
+    :param started_at: datetime (UTC), when collection of the model started. The mark never
+        passes it, anything updated while we were paginating gets collected again next time
+    :return: String, the new mark, or None if nothing was collected
+    """
+    values = [value for value in values if value]
+    if not values:
+        return None
+    latest = max(values)
+    cap = (started_at - skew).strftime(TIMESTAMP_FORMAT)
+    return min(latest, cap)
+
+def older_than(page, mark, field='updated_at'):
+    """ True if every data point of the page was updated before the mark, used to stop paging
+        through endpoints sorted by most recently updated """
+    return bool(page) and all(
+        data.get(field) is not None and data[field] < mark for data in page
+    )
+
+class HighWaterMarks():
+    """ Latest updated_at collected per (repo, model), stored in
+        augur_operations.worker_collection_mark.
+
+        Like the etag cache, new marks are staged during a task and only written by flush()
+        after the task's data is stored.
+
+    :param db: SQLAlchemy engine connected to the augur_operations schema
+    """
+    def __init__(self, db):
+        self.db = db
+        self._started = {}
+        self._staged = {}
+
+    @staticmethod
+    def table_exists(db):
+        return 'worker_collection_mark' in s.inspect(db).get_table_names(
+            schema='augur_operations'
+        )
+
+    def get(self, repo_id, model):
+        """ Returns the mark of the model for the repo (TIMESTAMP_FORMAT), or None if the
+            model was never fully collected for it """
+        self._started[(repo_id, model)] = datetime.datetime.utcnow()
+        mark_sql = s.sql.text("""
+            SELECT high_water_mark AT TIME ZONE 'UTC' AS high_water_mark
+            FROM augur_operations.worker_collection_mark
+            WHERE repo_id = :repo_id AND job_model = :job_model
+        """)
+        row = self.db.execute(mark_sql, {'repo_id': repo_id, 'job_model': model}).fetchone()
+        if row is None:
+            return None
+        return row['high_water_mark'].strftime(TIMESTAMP_FORMAT)
+
+    def stage(self, repo_id, model, data, field='updated_at'):
+        """ Stages a new mark from the data collected for the model """
+        started_at = self._started.get((repo_id, model), datetime.datetime.utcnow())
+        mark = next_mark([point.get(field) for point in data], started_at)
+        if mark is None:
+            return
+        previous = self._staged.get((repo_id, model))
+        self._staged[(repo_id, model)] = max(mark, previous) if previous else mark
+
+    def flush(self):
+        """ Stores every staged mark, called once the task's data is in the database """
+        if not self._staged:
+            return
+        store_sql = s.sql.text("""
+            INSERT INTO augur_operations.worker_collection_mark
+                (repo_id, job_model, high_water_mark)
+            VALUES (:repo_id, :job_model, CAST(:high_water_mark AS timestamptz))
+            ON CONFLICT (repo_id, job_model) DO UPDATE
+            SET high_water_mark = GREATEST(
+                    worker_collection_mark.high_water_mark, EXCLUDED.high_water_mark
+                ),
+                last_update = CURRENT_TIMESTAMP
+        """)
+        self.db.execute(store_sql, [
+            {'repo_id': repo_id, 'job_model': model, 'high_water_mark': mark}
+            for (repo_id, model), mark in self._staged.items()
+        ])
+        self._staged = {}
+
+    def discard(self):
+        """ Forgets the staged marks, used when a task fails """
+        self._staged = {}
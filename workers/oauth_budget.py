@@ -0,0 +1,187 @@
+#SPDX-License-Identifier: MIT
+""" Coordinates API key usage between all worker processes through augur_operations """
+import hashlib
+import time
+
+import sqlalchemy as s
+
+# Requests a key has available right after its rate limit resets
+FRESH_BUDGET = {
+    'github': 5000,
+    'gitlab': 2000
+}
+
+def token_hash(access_token):
+    """ The budget tables only ever store a hash of the key, never the key itself """
+    return hashlib.sha256(str(access_token).encode('utf-8')).hexdigest()
+
+def best_oauth(candidates, now, fresh_budget):
+    """ Picks the key that gives the most requests to this worker
+
+    :param candidates: List of dicts with 'rate_limit' (None if unknown), 'reset_at' (epoch
+        seconds or None), 'leases' (number of other workers using the key) and
+        'bad_credentials'
+    :param now: Float, current epoch time
+    :param fresh_budget: Integer, requests a key has after its rate limit resets
+    :return: The chosen candidate dict, or None if every key has bad credentials
+    """
+    usable = [candidate for candidate in candidates if not candidate['bad_credentials']]
+    if not usable:
+        return None
+
+    def remaining(candidate):
+        if candidate['rate_limit'] is None or not candidate['reset_at'] \
+                or candidate['reset_at'] <= now:
+            return fresh_budget
+        return max(candidate['rate_limit'], 0)
+
+    def reset_at(candidate):
+        return candidate['reset_at'] or 0
+
+    # The budget of a key is split between every worker already leasing it
+    return max(
+        usable,
+        key=lambda candidate: (
+            remaining(candidate) / (candidate['leases'] + 1), -reset_at(candidate)
+        )
+    )
+
+class OAuthBudget():
+    """ Shared record of the remaining quota of every API key and which worker uses which key.
+        Workers report the quota they see in response headers and lease the key with the
+        best budget, so switching keys never costs probe requests.
+
+    :param db: SQLAlchemy engine connected to the augur_operations schema
+    :param platform: String, 'github' or 'gitlab'
+    :param worker: String, id of the worker leasing keys
+    :param report_interval: Integer, responses between writes of the same key's quota
+    :param lease_seconds: Integer, seconds a lease lasts without a report renewing it
+    """
+    def __init__(self, db, platform, worker, report_interval=25, lease_seconds=600):
+        self.db = db
+        self.platform = platform
+        self.worker = worker
+        self.report_interval = report_interval
+        self.lease_seconds = lease_seconds
+        self.fresh_budget = FRESH_BUDGET.get(platform, FRESH_BUDGET['github'])
+        self._unreported = {}
+
+    def register(self, oauths):
+        """ Makes sure every key has a row in the budget table, existing rows are kept """
+        register_sql = s.sql.text("""
+            INSERT INTO augur_operations.worker_oauth_budget (platform, token_hash, oauth_id)
+            VALUES (:platform, :token_hash, :oauth_id)
+            ON CONFLICT (platform, token_hash) DO NOTHING
+        """)
+        self.db.execute(register_sql, [
+            {
+                'platform': self.platform, 'token_hash': token_hash(oauth['access_token']),
+                'oauth_id': oauth['oauth_id']
+            } for oauth in oauths
+        ])
+
+    def report(self, oauth, reset_at=None, bad_credentials=False, force=False):
+        """ Records the quota of a key as seen in the last response. Writes are batched
+            to one every report_interval responses unless forced.
+
+        :param oauth: Dict, the oauth in use, its 'rate_limit' is what gets recorded
+        :param reset_at: Integer, epoch time at which the key's quota resets
+        """
+        hashed = token_hash(oauth['access_token'])
+        self._unreported[hashed] = self._unreported.get(hashed, 0) + 1
+        if not (force or bad_credentials) and self._unreported[hashed] < self.report_interval:
+            return
+        self._unreported[hashed] = 0
+
+        report_sql = s.sql.text("""
+            UPDATE augur_operations.worker_oauth_budget
+            SET rate_limit = :rate_limit,
+                reset_at = COALESCE(to_timestamp(:reset_at), reset_at),
+                bad_credentials = bad_credentials OR :bad_credentials,
+                last_update = CURRENT_TIMESTAMP
+            WHERE platform = :platform AND token_hash = :token_hash
+        """)
+        renew_sql = s.sql.text("""
+            UPDATE augur_operations.worker_oauth_lease
+            SET expires_at = now() + make_interval(secs => :lease_seconds)
+            WHERE platform = :platform AND worker = :worker
+        """)
+        with self.db.begin() as connection:
+            connection.execute(report_sql, {
+                'rate_limit': oauth.get('rate_limit'), 'reset_at': reset_at,
+                'bad_credentials': bad_credentials, 'platform': self.platform,
+                'token_hash': hashed
+            })
+            connection.execute(renew_sql, {
+                'lease_seconds': self.lease_seconds, 'platform': self.platform,
+                'worker': self.worker
+            })
+
+    def lease(self, oauths):
+        """ Leases the key with the best budget for this worker
+
+        :param oauths: List of dicts, the worker's oauths
+        :return: The oauth dict that was leased, with 'rate_limit' and 'seconds_to_reset'
+            filled in from the shared table, or None if every key has bad credentials
+        """
+        by_hash = {token_hash(oauth['access_token']): oauth for oauth in oauths}
+
+        budget_sql = s.sql.text("""
+            SELECT
+                b.token_hash, b.rate_limit, extract(epoch FROM b.reset_at) AS reset_at,
+                b.bad_credentials,
+                (
+                    SELECT COUNT(*) FROM augur_operations.worker_oauth_lease l
+                    WHERE l.platform = b.platform AND l.token_hash = b.token_hash
+                        AND l.worker <> :worker AND l.expires_at > now()
+                ) AS leases
+            FROM augur_operations.worker_oauth_budget b
+            WHERE b.platform = :platform AND b.token_hash = ANY(:token_hashes)
+        """)
+        lease_sql = s.sql.text("""
+            INSERT INTO augur_operations.worker_oauth_lease
+                (platform, worker, token_hash, expires_at)
+            VALUES (:platform, :worker, :token_hash, now() + make_interval(secs => :lease_seconds))
+            ON CONFLICT (platform, worker) DO UPDATE
+            SET token_hash = EXCLUDED.token_hash, expires_at = EXCLUDED.expires_at
+        """)
+
+        with self.db.begin() as connection:
+            candidates = [
+                {
+                    'token_hash': row['token_hash'], 'rate_limit': row['rate_limit'],
+                    'reset_at': float(row['reset_at']) if row['reset_at'] is not None else None,
+                    'bad_credentials': row['bad_credentials'], 'leases': row['leases']
+                } for row in connection.execute(budget_sql, {
+                    'worker': self.worker, 'platform': self.platform,
+                    'token_hashes': list(by_hash.keys())
+                })
+            ]
+
+            now = time.time()
+            chosen = best_oauth(candidates, now, self.fresh_budget)
+            if chosen is None:
+                return None
+
+            connection.execute(lease_sql, {
+                'platform': self.platform, 'worker': self.worker,
+                'token_hash': chosen['token_hash'], 'lease_seconds': self.lease_seconds
+            })
+
+        oauth = by_hash[chosen['token_hash']]
+        if chosen['reset_at'] and chosen['reset_at'] > now:
+            oauth['rate_limit'] = chosen['rate_limit'] \
+                if chosen['rate_limit'] is not None else self.fresh_budget
+            oauth['seconds_to_reset'] = chosen['reset_at'] - now
+        else:
+            oauth['rate_limit'] = self.fresh_budget
+            oauth['seconds_to_reset'] = 0
+        return oauth
+
+    def release(self):
+        """ Gives up this worker's lease so other workers see the key as free """
+        release_sql = s.sql.text("""
+            DELETE FROM augur_operations.worker_oauth_lease
+            WHERE platform = :platform AND worker = :worker
+        """)
+        self.db.execute(release_sql, {'platform': self.platform, 'worker': self.worker})
@@ -0,0 +1,185 @@
+#SPDX-License-Identifier: MIT
+""" Streams rows to PostgreSQL in the binary COPY format, typed by reflected table columns """
+import datetime
+import io
+import json
+import math
+import re
+import struct
+import uuid
+
+import sqlalchemy as s
+from sqlalchemy.dialects import postgresql
+
+HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+TRAILER = struct.pack('!h', -1)
+NULL = struct.pack('!i', -1)
+
+POSTGRES_EPOCH = datetime.datetime(2000, 1, 1)
+POSTGRES_EPOCH_DATE = POSTGRES_EPOCH.date()
+
+_field_count = struct.Struct('!h')
+_length = struct.Struct('!i')
+
+class UnsupportedType(Exception):
+    """ A column type the binary writer does not encode, callers fall back to CSV """
+    pass
+
+def _is_null(value):
+    return value is None or (isinstance(value, float) and math.isnan(value)) \
+        or (hasattr(value, 'to_pydatetime') and value != value)
+
+# ISO 8601 timestamps as returned by the apis, e.g. 2021-05-01T12:00:00Z
+_TIMESTAMP = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:\.(\d{1,6}))?)?)?'
+    r'\s*(Z|[+-]\d\d(?::?\d\d)?)?$'
+)
+
+def _to_datetime(value):
+    if hasattr(value, 'to_pydatetime'):
+        value = value.to_pydatetime()
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+
+    match = _TIMESTAMP.match(str(value).strip())
+    if match is None:
+        raise ValueError(f"Can not parse timestamp {value!r}")
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    tzinfo = None
+    if offset == 'Z':
+        tzinfo = datetime.timezone.utc
+    elif offset:
+        sign = -1 if offset[0] == '-' else 1
+        digits = offset[1:].replace(':', '')
+        tzinfo = datetime.timezone(sign * datetime.timedelta(
+            hours=int(digits[:2]), minutes=int(digits[2:] or 0)
+        ))
+    return datetime.datetime(
+        int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+        int((fraction or '0').ljust(6, '0')), tzinfo=tzinfo
+    )
+
+def _text(value):
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    if isinstance(value, (dict, list)):
+        return json.dumps(value).encode('utf-8')
+    if isinstance(value, datetime.datetime):
+        return value.isoformat().encode('utf-8')
+    return str(value).encode('utf-8')
+
+def _packer(format_string, convert):
+    packed = struct.Struct(format_string)
+    return lambda value: packed.pack(convert(value))
+
+def _timestamp(value):
+    """ timestamp without time zone, like the text input the offset is ignored """
+    value = _to_datetime(value).replace(tzinfo=None)
+    delta = value - POSTGRES_EPOCH
+    return struct.pack('!q', (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+def _timestamptz(value):
+    """ timestamp with time zone, naive values are taken as UTC """
+    value = _to_datetime(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return _timestamp(value)
+
+def _date(value):
+    return struct.pack('!i', (_to_datetime(value).date() - POSTGRES_EPOCH_DATE).days)
+
+def _boolean(value):
+    if isinstance(value, str):
+        value = value.lower() in ('t', 'true', 'y', 'yes', 'on', '1')
+    return b'\x01' if value else b'\x00'
+
+def _jsonb(value):
+    return b'\x01' + (value.encode('utf-8') if isinstance(value, str) else _text(value))
+
+def _uuid(value):
+    return (value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))).bytes
+
+def encoder_for(column_type):
+    """ Returns the function that encodes a (non-null) value of the SQLAlchemy column type
+
+    :raises UnsupportedType: if the type has no binary encoder here
+    """
+    if isinstance(column_type, s.types.Boolean):
+        return _boolean
+    if isinstance(column_type, s.types.BigInteger):
+        return _packer('!q', int)
+    if isinstance(column_type, s.types.SmallInteger):
+        return _packer('!h', int)
+    if isinstance(column_type, s.types.Integer):
+        return _packer('!i', int)
+    if isinstance(column_type, s.types.Float) and not column_type.asdecimal:
+        if isinstance(column_type, postgresql.REAL):
+            return _packer('!f', float)
+        return _packer('!d', float)
+    if isinstance(column_type, s.types.DateTime):
+        return _timestamptz if column_type.timezone else _timestamp
+    if isinstance(column_type, s.types.Date):
+        return _date
+    if isinstance(column_type, postgresql.JSONB):
+        return _jsonb
+    if isinstance(column_type, s.types.JSON):
+        return _text
+    if isinstance(column_type, postgresql.UUID):
+        return _uuid
+    if isinstance(column_type, s.types.String) and not isinstance(column_type, s.types.Enum):
+        return _text
+    raise UnsupportedType(f"No binary COPY encoder for column type {column_type!r}")
+
+class BinaryCopyStream(io.RawIOBase):
+    """ File-like object that encodes rows into the binary COPY format as it is read, so the
+        whole batch never has to exist as one buffer. Give it to psycopg2's copy_expert.
+
+    :param columns: List of strings, the columns being copied, in order
+    :param column_types: List of SQLAlchemy types of those columns
+    :param rows: Iterable of dicts, missing keys are copied as NULL
+    :raises UnsupportedType: if any of the column types can not be encoded
+    """
+    def __init__(self, columns, column_types, rows):
+        self.columns = list(columns)
+        self.encoders = [encoder_for(column_type) for column_type in column_types]
+        self.rows = iter(rows)
+        self.buffer = bytearray(HEADER)
+        self.finished = False
+        self.row_prefix = _field_count.pack(len(self.columns))
+
+    def readable(self):
+        return True
+
+    def _encode(self, row):
+        buffer = self.buffer
+        buffer += self.row_prefix
+        for column, encode in zip(self.columns, self.encoders):
+            value = row.get(column)
+            if _is_null(value):
+                buffer += NULL
+                continue
+            encoded = encode(value)
+            buffer += _length.pack(len(encoded))
+            buffer += encoded
+
+    def read(self, size=-1):
+        while not self.finished and (size < 0 or len(self.buffer) < size):
+            try:
+                self._encode(next(self.rows))
+            except StopIteration:
+                self.buffer += TRAILER
+                self.finished = True
+        if size < 0 or size >= len(self.buffer):
+            chunk = bytes(self.buffer)
+            self.buffer.clear()
+            return chunk
+        chunk = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return chunk
+
+    def readinto(self, target):
+        chunk = self.read(len(target))
+        target[:len(chunk)] = chunk
+        return len(chunk)
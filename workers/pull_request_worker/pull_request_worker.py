@@ -9,12 +9,18 @@ import time
 import traceback
 import requests
 import copy
+from concurrent import futures
 from datetime import datetime
 from multiprocessing import Process, Queue
 import pandas as pd
 import sqlalchemy as s
 from sqlalchemy.sql.expression import bindparam
 from workers.worker_base import Worker
+from workers.task_context import bind_context
+from workers.high_water_mark import older_than
+from workers.github_pr_files import (
+    PULL_REQUESTS_PER_QUERY, pr_files_from_response, pr_files_query
+)
 
 class GitHubPullRequestWorker(Worker):
     """
@@ -109,8 +115,8 @@ class GitHubPullRequestWorker(Worker):
                     self.logger.info(f'Attempt #{attempt + 1} for hitting GraphQL endpoint '
                         f'page number {page_count}\n')
 
-                    response = requests.post(base_url, json={'query': query.format(
-                        **before_parameters)}, headers=self.headers)
+                    response = self.api_request('POST', base_url, json={'query': query.format(
+                        **before_parameters)})
 
                     self.update_gh_rate_limit(response)
 
@@ -177,6 +183,61 @@ class GitHubPullRequestWorker(Worker):
                 before_parameters=before_parameters)
 
 
+    def query_pr_files_page(self, owner, repo, pages):
+        """ Queries one page of files of up to PULL_REQUESTS_PER_QUERY pull requests
+
+        :param pages: List of (pr_src_number, cursor) tuples, see pr_files_query
+        :return: Dict of pr_src_number to (file nodes, cursor of the next page or None), or None
+            if the query failed
+        """
+        data = self.query_graphql(pr_files_query(owner, repo, pages))
+        if data is not None:
+            return pr_files_from_response(pages, data)
+
+        self.logger.warning(f"Could not query files of pull requests: {pages}\n")
+        return None
+
+    def query_pr_files(self, owner, repo, pr_numbers):
+        """ Collects the files of many pull requests, PULL_REQUESTS_PER_QUERY per GraphQL query.
+            Only pull requests with more than a page of files are queried again for their next
+            page, and the queries of each round are sent concurrently.
+
+        :param pr_numbers: List of pr_src_numbers
+        :return: Dict of pr_src_number to a list of file nodes (additions, deletions, path)
+        """
+        pr_files = {}
+        pending = [(number, None) for number in pr_numbers]
+        concurrency = self.config.get('graphql_concurrency', 4)
+
+        with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            page_count = 0
+            while pending:
+                batches = [
+                    pending[start:start + PULL_REQUESTS_PER_QUERY]
+                    for start in range(0, len(pending), PULL_REQUESTS_PER_QUERY)
+                ]
+                self.logger.info(
+                    f"Querying files of {len(pending)} pull requests in {len(batches)} queries\n"
+                )
+                page_count += len(batches)
+                pending = []
+                # The queries count towards this task's metrics
+                pages = executor.map(bind_context(
+                    lambda batch: self.query_pr_files_page(owner, repo, batch)
+                ), batches)
+                for files in pages:
+                    if files is None:
+                        continue
+                    for number, (nodes, cursor) in files.items():
+                        pr_files.setdefault(number, []).extend(nodes)
+                        if cursor is not None:
+                            pending.append((number, cursor))
+
+        self.logger.info(
+            f"Collected files of {len(pr_files)} pull requests in {page_count} queries\n"
+        )
+        return pr_files
+
     def pull_request_files_model(self, task_info, repo_id):
 
         # query existing PRs and the respective url we will append the commits url to
@@ -187,47 +248,18 @@ class GitHubPullRequestWorker(Worker):
         """.format(self.repo_id))
         pr_numbers = pd.read_sql(pr_number_sql, self.db, params={})
 
-        pr_file_rows = []
-
-        for index, pull_request in enumerate(pr_numbers.itertuples()):
-
-            self.logger.info(f'Querying files for pull request #{index + 1} of {len(pr_numbers)}')
-
-            query = """
-                {{
-                  repository(owner:"%s", name:"%s"){{
-                    pullRequest (number: %s) {{
-                """ % (self.owner, self.repo, pull_request.pr_src_number) + """
-                      files (last: 100{files}) {{
-                        pageInfo {{
-                          hasPreviousPage
-                          hasNextPage
-                          endCursor
-                          startCursor
-                        }}
-                        edges {{
-                          node {{
-                            additions
-                            deletions
-                            path
-                          }}
-                        }}
-                      }}
-                    }}
-                  }}
-                }}
-            """
-
-            pr_file_rows += [{
-                'pull_request_id': pull_request.pull_request_id,
-                'pr_file_additions': pr_file['node']['additions'],
-                'pr_file_deletions': pr_file['node']['deletions'],
-                'pr_file_path': pr_file['node']['path'],
-                'tool_source': self.tool_source,
-                'tool_version': self.tool_version,
-                'data_source': 'GitHub API',
-            } for pr_file in self.graphql_paginate(query, {'files': None})]
+        pr_ids = dict(zip(pr_numbers['pr_src_number'], pr_numbers['pull_request_id']))
+        pr_files = self.query_pr_files(self.owner, self.repo, list(pr_ids.keys()))
 
+        pr_file_rows = [{
+            'pull_request_id': pr_ids[number],
+            'pr_file_additions': pr_file['additions'],
+            'pr_file_deletions': pr_file['deletions'],
+            'pr_file_path': pr_file['path'],
+            'tool_source': self.tool_source,
+            'tool_version': self.tool_version,
+            'data_source': 'GitHub API',
+        } for number, files in pr_files.items() for pr_file in files]
 
         # Get current table values
         table_values_sql = s.sql.text("""
@@ -369,9 +401,13 @@ class GitHubPullRequestWorker(Worker):
 
     def _get_pk_source_prs(self):
 
+        # The pulls endpoint has no since parameter, so once a mark exists sort by most
+        #   recently updated and stop at the first page that is entirely older than it
+        since = self.get_high_water_mark('pull_requests')
         pr_url = (
-            f"https://api.github.com/repos/{self.owner}/{self.repo}/pulls?state=all&"
-            "direction=asc&per_page=100&page={}"
+            f"https://api.github.com/repos/{self.owner}/{self.repo}/pulls?state=all&" + (
+                "sort=updated&direction=desc" if since else "direction=asc"
+            ) + "&per_page=100&page={}"
         )
 
         pr_action_map = {
@@ -387,13 +423,18 @@ class GitHubPullRequestWorker(Worker):
 
         source_prs = self.new_paginate_endpoint(
             pr_url, action_map=pr_action_map, table=self.pull_requests_table,
-            where_clause=self.pull_requests_table.c.repo_id == self.repo_id
+            where_clause=self.pull_requests_table.c.repo_id == self.repo_id,
+            stop_condition=(lambda page: older_than(page, since)) if since else None
         )
 
         self.write_debug_data(source_prs, 'source_prs')
 
+        if since:
+            source_prs['all'] = [pr for pr in source_prs['all'] if pr['updated_at'] >= since]
+        self.stage_high_water_mark('pull_requests', source_prs['all'])
+
         if len(source_prs['all']) == 0:
-            self.logger.info("There are no prs for this repository.\n")
+            self.logger.info("There are no new or updated prs for this repository.\n")
             self.register_task_completion(self.task_info, self.repo_id, 'pull_requests')
             return
 
@@ -508,9 +549,10 @@ class GitHubPullRequestWorker(Worker):
 
     def pull_request_comments_model(self):
 
+        since = self.get_high_water_mark('pull_request_comments')
         comments_url = (
             f"https://api.github.com/repos/{self.owner}/{self.repo}/issues/comments?per_page=100"
-            "&page={}"
+            + (f"&since={since}" if since else "") + "&page={}"
         )
 
         comment_action_map = {
@@ -520,63 +562,69 @@ class GitHubPullRequestWorker(Worker):
             }
         }
 
-        # TODO: add relational table so we can include a where_clause here
-        pr_comments = self.new_paginate_endpoint(
-            comments_url, action_map=comment_action_map, table=self.message_table
-        )
+        def insert_comment_batch(pr_comments):
+            self.write_debug_data(pr_comments, 'pr_comments')
 
-        self.write_debug_data(pr_comments, 'pr_comments')
+            self.stage_high_water_mark('pull_request_comments', pr_comments['all'])
 
-        pr_comments['insert'] = self.text_clean(pr_comments['insert'], 'body')
+            pr_comments['insert'] = self.text_clean(pr_comments['insert'], 'body')
 
-        pr_comments['insert'] = self.enrich_cntrb_id(
-            pr_comments['insert'], 'user.login', action_map_additions={
-                'insert': {
-                    'source': ['user.node_id'],
-                    'augur': ['gh_node_id']
-                }
-            }, prefix='user.'
-        )
+            pr_comments['insert'] = self.enrich_cntrb_id(
+                pr_comments['insert'], 'user.login', action_map_additions={
+                    'insert': {
+                        'source': ['user.node_id'],
+                        'augur': ['gh_node_id']
+                    }
+                }, prefix='user.'
+            )
 
-        pr_comments_insert = [
-            {
-                'pltfrm_id': self.platform_id,
-                'msg_text': comment['body'].replace("\x00", "\uFFFD"),
-                'msg_timestamp': comment['created_at'],
-                'cntrb_id': comment['cntrb_id'],
-                'tool_source': self.tool_source,
-                'tool_version': self.tool_version,
-                'data_source': self.data_source
-            } for comment in pr_comments['insert']
-        ]
+            pr_comments_insert = [
+                {
+                    'pltfrm_id': self.platform_id,
+                    'msg_text': comment['body'].replace("\x00", "\uFFFD"),
+                    'msg_timestamp': comment['created_at'],
+                    'cntrb_id': comment['cntrb_id'],
+                    'tool_source': self.tool_source,
+                    'tool_version': self.tool_version,
+                    'data_source': self.data_source
+                } for comment in pr_comments['insert']
+            ]
 
-        self.bulk_insert(self.message_table, insert=pr_comments_insert)
+            self.bulk_insert(self.message_table, insert=pr_comments_insert)
 
-        # PR MESSAGE REF TABLE
+            # PR MESSAGE REF TABLE
 
-        c_pk_source_comments = self.enrich_data_primary_keys(pr_comments['insert'],
-            self.message_table, ['created_at', 'body'], ['msg_timestamp', 'msg_text'])
+            c_pk_source_comments = self.enrich_data_primary_keys(pr_comments['insert'],
+                self.message_table, ['created_at', 'body'], ['msg_timestamp', 'msg_text'])
 
-        self.write_debug_data(c_pk_source_comments, 'c_pk_source_comments')
+            self.write_debug_data(c_pk_source_comments, 'c_pk_source_comments')
 
-        both_pk_source_comments = self.enrich_data_primary_keys(c_pk_source_comments,
-            self.pull_requests_table, ['issue_url'], ['pr_issue_url'])
+            both_pk_source_comments = self.enrich_data_primary_keys(c_pk_source_comments,
+                self.pull_requests_table, ['issue_url'], ['pr_issue_url'])
 
-        self.write_debug_data(both_pk_source_comments, 'both_pk_source_comments')
+            self.write_debug_data(both_pk_source_comments, 'both_pk_source_comments')
 
-        pr_message_ref_insert = [
-            {
-                'pull_request_id': comment['pull_request_id'],
-                'msg_id': comment['msg_id'],
-                'pr_message_ref_src_comment_id': comment['id'],
-                'pr_message_ref_src_node_id': comment['node_id'],
-                'tool_source': self.tool_source,
-                'tool_version': self.tool_version,
-                'data_source': self.data_source
-            } for comment in both_pk_source_comments
-        ]
+            pr_message_ref_insert = [
+                {
+                    'pull_request_id': comment['pull_request_id'],
+                    'msg_id': comment['msg_id'],
+                    'pr_message_ref_src_comment_id': comment['id'],
+                    'pr_message_ref_src_node_id': comment['node_id'],
+                    'tool_source': self.tool_source,
+                    'tool_version': self.tool_version,
+                    'data_source': self.data_source
+                } for comment in both_pk_source_comments
+            ]
 
-        self.bulk_insert(self.pull_request_message_ref_table, insert=pr_message_ref_insert)
+            self.bulk_insert(self.pull_request_message_ref_table, insert=pr_message_ref_insert)
+
+        # TODO: add relational table so we can include a where_clause here
+        # Comments are organized and inserted a batch at a time as the pages arrive
+        comment_count = self.new_paginate_endpoint(
+            comments_url, action_map=comment_action_map, table=self.message_table,
+            batch_callback=insert_comment_batch
+        )
+        self.logger.info(f"Collected {comment_count} pr comments.\n")
 
     def pull_request_events_model(self, pk_source_prs=[]):
 
@@ -678,6 +726,9 @@ class GitHubPullRequestWorker(Worker):
 
         source_reviews_insert, source_reviews_update = self.new_organize_needed_data(
             pr_pk_source_reviews, augur_table=self.pull_request_reviews_table,
+            where_clause=self.repo_scope(
+                self.pull_request_reviews_table, ('pull_request_id', self.pull_requests_table)
+            ),
             action_map=review_action_map
         )
 
@@ -740,21 +791,12 @@ class GitHubPullRequestWorker(Worker):
             }
         }
 
-        in_clause = [] if len(both_pr_review_pk_source_reviews) == 0 else \
-            set(pd.DataFrame(both_pr_review_pk_source_reviews)['pr_review_id'])
-
         review_msgs = self.new_paginate_endpoint(
             review_msg_url, action_map=review_msg_action_map, table=self.message_table,
-            where_clause=self.message_table.c.msg_id.in_(
-                [
-                    msg_row[0] for msg_row in self.db.execute(
-                        s.sql.select([self.pull_request_review_message_ref_table.c.msg_id]).where(
-                            self.pull_request_review_message_ref_table.c.pr_review_id.in_(
-                                in_clause
-                            )
-                        )
-                    ).fetchall()
-                ]
+            where_clause=self.repo_scope(
+                self.message_table, ('msg_id', self.pull_request_review_message_ref_table),
+                ('pr_review_id', self.pull_request_reviews_table),
+                ('pull_request_id', self.pull_requests_table)
             )
         )
         self.write_debug_data(review_msgs, 'review_msgs')
@@ -876,7 +918,11 @@ class GitHubPullRequestWorker(Worker):
             }
         }
         source_labels_insert, _ = self.new_organize_needed_data(
-            labels_all, augur_table=self.pull_request_labels_table, action_map=label_action_map
+            labels_all, augur_table=self.pull_request_labels_table,
+            where_clause=self.repo_scope(
+                self.pull_request_labels_table, ('pull_request_id', self.pull_requests_table)
+            ),
+            action_map=label_action_map
         )
         labels_insert = [
             {
@@ -903,6 +949,9 @@ class GitHubPullRequestWorker(Worker):
         }
         source_reviewers_insert, _ = self.new_organize_needed_data(
             reviewers_all, augur_table=self.pull_request_reviewers_table,
+            where_clause=self.repo_scope(
+                self.pull_request_reviewers_table, ('pull_request_id', self.pull_requests_table)
+            ),
             action_map=reviewer_action_map
         )
         source_reviewers_insert = self.enrich_cntrb_id(
@@ -934,6 +983,9 @@ class GitHubPullRequestWorker(Worker):
         }
         source_assignees_insert, _ = self.new_organize_needed_data(
             assignees_all, augur_table=self.pull_request_assignees_table,
+            where_clause=self.repo_scope(
+                self.pull_request_assignees_table, ('pull_request_id', self.pull_requests_table)
+            ),
             action_map=assignee_action_map
         )
         source_assignees_insert = self.enrich_cntrb_id(
@@ -965,7 +1017,11 @@ class GitHubPullRequestWorker(Worker):
         }
 
         source_meta_insert, _ = self.new_organize_needed_data(
-            meta_all, augur_table=self.pull_request_meta_table, action_map=meta_action_map
+            meta_all, augur_table=self.pull_request_meta_table,
+            where_clause=self.repo_scope(
+                self.pull_request_meta_table, ('pull_request_id', self.pull_requests_table)
+            ),
+            action_map=meta_action_map
         )
         source_meta_insert = self.enrich_cntrb_id(
             source_meta_insert, 'user.login', action_map_additions={
@@ -0,0 +1,69 @@
+#SPDX-License-Identifier: MIT
+""" State of the task a collection thread is working on, so a worker can collect several repos
+    at once """
+import functools
+import threading
+
+from workers.task_metrics import TaskMetrics
+
+_local = threading.local()
+
+class TaskContext():
+    """ Everything a worker tracks about one task: the repo, the history row it reports to,
+        its counters and the caches that are flushed when it completes.
+
+    :param task: Dict, the task message sent by the broker
+    :param repo_id: Integer, the repo the task collects
+    :param history_id: Integer, the worker_history row of the task
+    """
+    def __init__(self, task=None, repo_id=None, history_id=None):
+        self.task_info = task
+        self.repo_id = repo_id
+        self.owner = None
+        self.repo = None
+        self.history_id = history_id
+        self.collection_start_time = None
+        self._results_counter = 0
+        self.insert_counter = 0
+        self.update_counter = 0
+        self.contributor_caches = {}
+        self.validator_cache = None
+        self.high_water_marks = None
+        self.metrics = TaskMetrics()
+
+def current_context():
+    """ Returns the context of the calling thread, threads that were not given one get an
+        empty context of their own """
+    try:
+        return _local.context
+    except AttributeError:
+        _local.context = TaskContext()
+        return _local.context
+
+def set_current_context(context):
+    _local.context = context
+
+def bind_context(function):
+    """ Wraps the function so it runs with the calling thread's context in whichever thread
+        calls it, e.g. the threads of an executor a task hands its requests to """
+    context = current_context()
+
+    @functools.wraps(function)
+    def bound(*args, **kwargs):
+        set_current_context(context)
+        return function(*args, **kwargs)
+    return bound
+
+class task_attribute():
+    """ Worker attribute whose value belongs to the task of the calling thread rather than to
+        the worker """
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, worker, owner=None):
+        if worker is None:
+            return self
+        return getattr(current_context(), self.name)
+
+    def __set__(self, worker, value):
+        setattr(current_context(), self.name, value)
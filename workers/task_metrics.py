@@ -0,0 +1,97 @@
+#SPDX-License-Identifier: MIT
+""" Per task timing and throughput of worker collection """
+import contextlib
+import datetime
+import functools
+import resource
+import sys
+import threading
+import time
+
+import sqlalchemy as s
+
+PHASES = ('fetch', 'decode', 'organize', 'enrich', 'insert')
+COUNTERS = ('request_count', 'bytes_downloaded', 'rows_inserted', 'rows_updated')
+
+def peak_rss_kb():
+    """ Peak resident set size of this process in kilobytes """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def timed(phase):
+    """ Decorates a Worker method so the time spent in it is added to the phase of the
+        metrics of the worker's current task """
+    def decorator(method):
+        @functools.wraps(method)
+        def timed_method(worker, *args, **kwargs):
+            with worker.metrics.phase(phase):
+                return method(worker, *args, **kwargs)
+        return timed_method
+    return decorator
+
+class TaskMetrics():
+    """ Seconds spent in each of the PHASES of a task and its COUNTERS, stored in
+        augur_operations.worker_task_metrics when the task completes or fails.
+
+        Phases can be timed from several threads at once, e.g. the fetch threads of the
+        async fetch engine, so their seconds can add up to more than the task's total. A
+        phase timed inside another one (e.g. fetching the users of an enrichment) is counted
+        in both.
+    """
+    def __init__(self):
+        self.started_at = datetime.datetime.now()
+        self._start = time.monotonic()
+        self.seconds = {phase: 0.0 for phase in PHASES}
+        self.counts = {counter: 0 for counter in COUNTERS}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def table_exists(db):
+        return 'worker_task_metrics' in s.inspect(db).get_table_names(schema='augur_operations')
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Adds the time spent in the with block to the phase """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_seconds(name, time.monotonic() - start)
+
+    def add_seconds(self, name, seconds):
+        with self._lock:
+            self.seconds[name] += seconds
+
+    def count(self, counter, amount=1):
+        with self._lock:
+            self.counts[counter] += amount
+
+    def as_dict(self):
+        """ The metrics so far, in the layout of the worker_task_metrics table """
+        with self._lock:
+            metrics = {
+                'started_at': self.started_at,
+                'total_seconds': round(time.monotonic() - self._start, 3),
+                'peak_rss_kb': peak_rss_kb()
+            }
+            metrics.update({
+                f'{phase}_seconds': round(seconds, 3) for phase, seconds in self.seconds.items()
+            })
+            metrics.update(self.counts)
+        return metrics
+
+    def store(self, db, **task):
+        """ Stores the metrics of the task
+
+        :param db: SQLAlchemy engine connected to the augur_operations schema
+        :param task: history_id, repo_id, worker, job_model and status of the task
+        :return: Dict, the stored row
+        """
+        row = {**task, **self.as_dict()}
+        columns = ', '.join(row)
+        values = ', '.join(f':{column}' for column in row)
+        db.execute(s.sql.text(f"""
+            INSERT INTO augur_operations.worker_task_metrics ({columns}) VALUES ({values})
+        """), row)
+        return row
@@ -62,8 +62,11 @@ def create_server(app, worker=None):
         """
         if request.method == 'POST': #will post a task to be added to the queue
             app.worker.logger.info("Sending to work on task: {}".format(str(request.json)))
-            app.worker.task = request.json
-            return Response(response=request.json,
+            # The broker sends the tasks for all of the worker's free slots at once
+            tasks = request.json if isinstance(request.json, list) else [request.json]
+            for task in tasks:
+                app.worker.task = task
+            return Response(response=json.dumps(request.json),
                         status=200,
                         mimetype="application/json")
         if request.method == 'GET': #will retrieve the current tasks/status of the worker
@@ -89,6 +92,17 @@ def create_server(app, worker=None):
         """
         return app.worker.config
 
+    @app.route("/AUGWOP/metrics")
+    def augwop_metrics():
+        """ Retrieve the phase timings and counters of the worker's most recent tasks
+        """
+        return jsonify(app.worker.task_metrics())
+
+    # Workers that claim their tasks from the task queue collect from the start instead of
+    #   waiting for the broker
+    if app.worker.config.get('task_queue'):
+        app.worker.run()
+
 class WorkerGunicornApplication(gunicorn.app.base.BaseApplication):
 
     def __init__(self, app):
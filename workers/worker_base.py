@@ -9,31 +9,67 @@ import os
 import sys
 import math
 import logging
+import collections
 import numpy
 import copy
 import concurrent
 import multiprocessing
+import threading
 import psycopg2
 import csv
 import io
 from logging import FileHandler, Formatter, StreamHandler
 from multiprocessing import Process, Queue, Pool
 from os import getpid
+from queue import Empty
 import sqlalchemy as s
 import pandas as pd
 from pathlib import Path
 from urllib.parse import urlparse, quote
 from sqlalchemy.ext.automap import automap_base
 from augur.config import AugurConfig
+from augur.database import create_database_engine, pool_options
+from augur.task_queue import TaskQueue
+from augur.collection_status import CollectionStatus
 from augur.logging import AugurLogging
 from sqlalchemy.sql.expression import bindparam
 from concurrent import futures
 import dask.dataframe as dd
+from workers.fetch_engine import AsyncFetchEngine, RATE_LIMIT_HEADERS
+from workers.oauth_budget import OAuthBudget
+from workers.etag_cache import ValidatorCache
+from workers.high_water_mark import HighWaterMarks
+from workers.diff_engine import DiffEngine, MISSING, source_value
+from workers.pg_copy import BinaryCopyStream, UnsupportedType
+from workers.contributor_cache import ContributorCache, IDENTITY_COLUMNS
+from workers.cassette import Cassette
+from workers.task_context import TaskContext, bind_context, set_current_context, task_attribute
+from workers.task_metrics import TaskMetrics, timed
+from workers.field_map import flatten
+from workers.github_users import (
+    GRAPHQL_URL, REST_USER_FIELDS, USERS_PER_QUERY, contributor_from_user, users_from_response,
+    users_query
+)
 
 class Worker():
 
     ROOT_AUGUR_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 
+    # State of the task being collected, each collection thread sees its own task's values
+    task_info = task_attribute()
+    repo_id = task_attribute()
+    owner = task_attribute()
+    repo = task_attribute()
+    history_id = task_attribute()
+    collection_start_time = task_attribute()
+    _results_counter = task_attribute()
+    insert_counter = task_attribute()
+    update_counter = task_attribute()
+    contributor_caches = task_attribute()
+    validator_cache = task_attribute()
+    high_water_marks = task_attribute()
+    metrics = task_attribute()
+
     ## Set Thread Safety for OSX
     # os.system("./osx-thread.sh")
 
@@ -42,8 +78,11 @@ class Worker():
         self.worker_type = worker_type
         self.collection_start_time = None
         self._task = None # task currently being worked on (dict)
-        self._child = None # process of currently running task (multiprocessing process)
+        self._child = None # long-lived process that works through the tasks (multiprocessing process)
         self._queue = Queue() # tasks stored here 1 at a time (in a mp queue so it can translate across multiple processes)
+        self.task_queue = None # durable queue tasks are claimed from, when the task_queue config is on
+        self._claimed_tasks = set() # task_queue_ids of the claimed tasks being worked on
+        self._claimed_lock = threading.Lock() # task threads and the lease renewal share the set
         self.data_tables = data_tables
         self.operations_tables = operations_tables
         self._root_augur_dir = Worker.ROOT_AUGUR_DIR
@@ -99,7 +138,8 @@ class Worker():
             'port_database': self.augur_config.get_value('Database', 'port'),
             'user_database': self.augur_config.get_value('Database', 'user'),
             'name_database': self.augur_config.get_value('Database', 'name'),
-            'password_database': self.augur_config.get_value('Database', 'password')
+            'password_database': self.augur_config.get_value('Database', 'password'),
+            'pool_database': pool_options(self.augur_config.get_section('Database'))
         })
         self.config.update(config)
 
@@ -118,6 +158,29 @@ class Worker():
         self.repo_id = None
         self.owner = None
         self.repo = None
+        self.oauth_budget = None # shared key budgets, set up in init_oauths
+        self.validator_cache = None # etag cache for conditional requests
+        self.high_water_marks = None # incremental collection marks per repo and model
+        self.contributor_caches = {} # contributor ids by data_source, reset every task
+        self._sessions = threading.local() # http session of each thread, see session
+        self.oauth_lock = threading.RLock() # serializes switching between the shared api keys
+        self.has_task_metrics_table = False # whether augur_operations.worker_task_metrics exists
+        self.collection_status = None # per repo status the housekeeper orders repos by
+
+        # Metrics of finished tasks are handed from the collection process to the server
+        #   process, which keeps the most recent ones for /AUGWOP/metrics
+        self._metrics_queue = Queue()
+        self.recent_task_metrics = collections.deque(maxlen=100)
+
+        # Api responses are recorded to disk, or replayed from it without the network, when
+        #   the worker's cassette_mode is 'record' or 'replay'
+        self.cassette = None
+        if self.config.get('cassette_mode'):
+            self.cassette = Cassette(
+                self.config.get('cassette_directory', os.path.join(
+                    self._root_augur_dir, 'runtime', 'cassettes', self.worker_type
+                )), mode=self.config['cassette_mode']
+            )
         self.given = given
         self.models = models
         self.debug_data = [] if 'debug_data' not in self.config else self.config['debug_data']
@@ -133,8 +196,9 @@ class Worker():
             'config': self.config
         }
 
-        # Send broker hello message
-        if self.config['offline_mode'] is False:
+        # Send broker hello message, workers that claim their tasks from the task queue are
+        #   not sent any
+        if self.config['offline_mode'] is False and not self.config.get('task_queue'):
             self.connect_to_broker()
 
         try:
@@ -217,13 +281,13 @@ class Worker():
         # Create an sqlalchemy engine for both database schemas
         self.logger.info("Making database connections")
 
+        pooling = self.config.get('pool_database', {})
+
         db_schema = 'augur_data'
-        self.db = s.create_engine(DB_STR,  poolclass=s.pool.NullPool,
-            connect_args={'options': '-csearch_path={}'.format(db_schema)})
+        self.db = create_database_engine(DB_STR, db_schema, pooling)
 
         helper_schema = 'augur_operations'
-        self.helper_db = s.create_engine(DB_STR, poolclass=s.pool.NullPool,
-            connect_args={'options': '-csearch_path={}'.format(helper_schema)})
+        self.helper_db = create_database_engine(DB_STR, helper_schema, pooling)
 
         metadata = s.MetaData()
         helper_metadata = s.MetaData()
@@ -256,6 +320,22 @@ class Worker():
         # Increment so we are ready to insert the 'next one' of each of these most recent ids
         self.history_id = self.get_max_id('worker_history', 'history_id', operations_table=True) + 1
 
+        # Revalidate api pages with their stored ETags so unchanged pages cost no rate limit
+        if self.config.get('conditional_requests', True) and \
+                ValidatorCache.table_exists(self.helper_db):
+            self.validator_cache = ValidatorCache(self.helper_db)
+
+        # Only request what changed since the last complete collection of a model. Cassettes
+        #   record the urls of whole collections, which later marks would change on replay
+        if self.config.get('incremental_collection', True) and self.cassette is None and \
+                HighWaterMarks.table_exists(self.helper_db):
+            self.high_water_marks = HighWaterMarks(self.helper_db)
+
+        self.has_task_metrics_table = TaskMetrics.table_exists(self.helper_db)
+
+        if CollectionStatus.table_exists(self.helper_db):
+            self.collection_status = CollectionStatus(self.helper_db)
+
         # Organize different api keys/oauths available
         self.logger.info("Initializing API key.")
         if 'gh_api_key' in self.config or 'gitlab_api_key' in self.config:
@@ -314,65 +394,177 @@ class Worker():
         """ Kicks off the processing of the queue if it is not already being processed
         Gets run whenever a new task is added
         """
+        # The collection process outlives its tasks, a new one is only spawned the first time
+        #   or when the previous one died
+        if self._child is not None and self._child.is_alive():
+            return
+        if self._child is not None:
+            self.logger.info(f"Collection process exited with code {self._child.exitcode}, restarting it")
         # Spawn a subprocess to handle message reading and performing the tasks
         self._child = Process(target=self.collect, args=())
         self._child.start()
 
+    def next_message(self):
+        """ Blocks until the next task is on the queue and returns it, or returns None once the
+            worker's server process is gone so the collection process does not outlive it
+        """
+        parent_pid = os.getppid()
+        poll_interval = self.config.get('idle_poll_interval', 30)
+        while True:
+            if self.task_queue is not None:
+                message = self.task_queue.claim(
+                    self.config['id'], self.models, self.given,
+                    lease_seconds=self.config.get('task_lease_seconds', 600)
+                )
+                if message is not None:
+                    with self._claimed_lock:
+                        self._claimed_tasks.add(message['task_queue_id'])
+                    return message
+                time.sleep(poll_interval)
+            else:
+                try:
+                    return self._queue.get(timeout=poll_interval)
+                except Empty:
+                    pass
+            if os.getppid() != parent_pid:
+                return None
+
+    def renew_task_leases(self):
+        """ Keeps renewing the leases of the claimed tasks being worked on, so other workers do
+            not claim them again while they run """
+        lease_seconds = self.config.get('task_lease_seconds', 600)
+        while True:
+            time.sleep(lease_seconds / 3)
+            with self._claimed_lock:
+                task_ids = list(self._claimed_tasks)
+            try:
+                self.task_queue.renew(self.config['id'], task_ids, lease_seconds=lease_seconds)
+            except Exception as e:
+                self.logger.error(f"Could not renew the task leases: {e}")
+
     def collect(self):
         """ Function to process each entry in the worker's task queue
         Determines what action to take based off the message type
+
+        Runs in a child process that is kept alive between tasks, so the database engines,
+        reflected tables, api keys and http session are set up once rather than per task.
         """
         self.initialize_logging() # need to initialize logging again in child process cause multiprocessing
         self.logger.info("Starting data collection process\n")
         self.initialize_database_connections()
-        while True:
-            if not self._queue.empty():
-                message = self._queue.get() # Get the task off our MP queue
-            else:
-                self.logger.info("No job found.")
-                break
-            self.logger.info("Popped off message: {}\n".format(str(message)))
+        # Connections opened by the server process are not shared with this one
+        self._sessions = threading.local()
+        if self.config.get('task_queue'):
+            self.logger.info("Claiming tasks from the task queue")
+            self.task_queue = TaskQueue(self.helper_db)
+            threading.Thread(target=self.renew_task_leases, daemon=True).start()
+        # With a task_concurrency above 1 that many repos are collected at once, each task in
+        #   its own thread with its own TaskContext, sharing the api keys and database pools
+        concurrency = int(self.config.get('task_concurrency', 1))
+        executor = None
+        if concurrency > 1:
+            self.logger.info(f"Collecting up to {concurrency} repos at once")
+            executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+            slots = threading.BoundedSemaphore(concurrency)
+        try:
+            while True:
+                if executor is not None:
+                    # Wait for a free thread before taking a task, so at most task_concurrency
+                    #   tasks are collected at once and none sits claimed while the others run
+                    slots.acquire()
+                message = self.next_message()
+                if message is None:
+                    self.logger.info("Worker server process exited.")
+                    break
+                self.logger.info("Popped off message: {}\n".format(str(message)))
 
-            if message['job_type'] == 'STOP':
-                break
+                if message['job_type'] == 'STOP':
+                    break
 
-            # If task is not a valid job type
-            if message['job_type'] != 'MAINTAIN' and message['job_type'] != 'UPDATE':
-                raise ValueError('{} is not a recognized task type'.format(message['job_type']))
-                pass
+                # If task is not a valid job type
+                if message['job_type'] != 'MAINTAIN' and message['job_type'] != 'UPDATE':
+                    raise ValueError('{} is not a recognized task type'.format(message['job_type']))
+                    pass
+
+                # The broker's task setter ran in the server process, after this one was forked
+                self._task = message
+                if message.get('focused_task') == 1:
+                    self.finishing_task = True
+
+                # Query repo_id corresponding to repo url of given task
+                repoUrlSQL = s.sql.text("""
+                    SELECT min(repo_id) as repo_id FROM repo WHERE repo_git = '{}'
+                    """.format(message['given'][self.given[0][0]]))
+                repo_id = int(pd.read_sql(repoUrlSQL, self.db, params={}).iloc[0]['repo_id'])
+                self.logger.info("repo_id for which data collection is being initiated: {}".format(str(repo_id)))
+
+                context = self.new_task_context(message, repo_id)
+                if executor is None:
+                    self.run_task(context)
+                    continue
+                executor.submit(self.run_task, context).add_done_callback(
+                    lambda future: slots.release()
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            # Other workers get this one's share of the shared budgets right away, rather
+            #   than once its lease expired, also when the process ends on an error
+            self.release_oauth_lease()
+            self.logger.debug('Closing database connections\n')
+            self.db.dispose()
+            self.helper_db.dispose()
+            self.logger.info("Collection process finished")
+
+    def release_oauth_lease(self):
+        """ Gives up the lease this worker holds on a shared api key """
+        if self.oauth_budget is None:
+            return
+        try:
+            self.oauth_budget.release()
+        except Exception as e:
+            self.logger.error(f"Could not release the oauth lease: {e}")
 
-            # Query repo_id corresponding to repo url of given task
-            repoUrlSQL = s.sql.text("""
-                SELECT min(repo_id) as repo_id FROM repo WHERE repo_git = '{}'
-                """.format(message['given'][self.given[0][0]]))
-            repo_id = int(pd.read_sql(repoUrlSQL, self.db, params={}).iloc[0]['repo_id'])
-            self.logger.info("repo_id for which data collection is being initiated: {}".format(str(repo_id)))
-            # Call method corresponding to model sent in task
-            try:
-                model_method = getattr(self, '{}_model'.format(message['models'][0]))
-                self.record_model_process(repo_id, 'repo_info')
-            except Exception as e:
-                self.logger.error('Error: {}.\nNo defined method for model: {}, '.format(e, message['models'][0]) +
-                    'must have name of {}_model'.format(message['models'][0]))
-                self.register_task_failure(message, repo_id, e)
-                break
+    def new_task_context(self, message, repo_id):
+        """ Returns the state a task starts from, with empty counters and caches of its own
 
-            # Model method calls wrapped in try/except so that any unexpected error that occurs can be caught
-            #   and worker can move onto the next task without stopping
-            try:
-                self.logger.info("Calling model method {}_model".format(message['models'][0]))
-                self.task_info = message
-                self.repo_id = repo_id
-                self.owner, self.repo = self.get_owner_repo(list(message['given'].values())[0])
-                model_method(message, repo_id)
-            except Exception as e: # this could be a custom exception, might make things easier
-                self.register_task_failure(message, repo_id, e)
-                break
+        :param message: Dict, the task message sent by the broker
+        :param repo_id: Integer, the repo the task collects
+        """
+        context = TaskContext(message, repo_id, history_id=self.history_id)
+        if self.validator_cache is not None:
+            context.validator_cache = ValidatorCache(self.helper_db, message['models'][0])
+        if self.high_water_marks is not None:
+            context.high_water_marks = HighWaterMarks(self.helper_db)
+        return context
+
+    def run_task(self, context):
+        """ Calls the model method of a task in the calling thread, with the task's context as
+            the thread's current context
+
+        :param context: TaskContext of the task, see new_task_context
+        """
+        set_current_context(context)
+        message, repo_id = context.task_info, context.repo_id
 
-        self.logger.debug('Closing database connections\n')
-        self.db.dispose()
-        self.helper_db.dispose()
-        self.logger.info("Collection process finished")
+        # Call method corresponding to model sent in task
+        try:
+            model_method = getattr(self, '{}_model'.format(message['models'][0]))
+            self.record_model_process(repo_id, 'repo_info')
+        except Exception as e:
+            self.logger.error('Error: {}.\nNo defined method for model: {}, '.format(e, message['models'][0]) +
+                'must have name of {}_model'.format(message['models'][0]))
+            self.register_task_failure(message, repo_id, e)
+            return
+
+        # Model method calls wrapped in try/except so that any unexpected error that occurs can be caught
+        #   and worker can move onto the next task without stopping
+        try:
+            self.logger.info("Calling model method {}_model".format(message['models'][0]))
+            self.owner, self.repo = self.get_owner_repo(list(message['given'].values())[0])
+            model_method(message, repo_id)
+        except Exception as e: # this could be a custom exception, might make things easier
+            self.register_task_failure(message, repo_id, e)
 
     def sync_df_types(self, subject, source, subject_columns, source_columns):
 
@@ -471,37 +663,17 @@ class Worker():
         self.logger.info("Merge tables dropped")
 
     def _get_data_set_columns(self, data, columns):
+        """ Flattens the data points (see field_map.flatten) down to the columns and the
+            attributes of the objects the dotted columns are in """
         if not len(data):
             return []
-        self.logger.info("Getting data set columns")
-        df = pd.DataFrame(data, columns=data[0].keys())
-        final_columns = copy.deepcopy(columns)
-        for column in columns:
-            if '.' not in column:
-                continue
-            root = column.split('.')[0]
-            if root not in df.columns:
-                df[root] = None
-            expanded_column = pd.DataFrame(
-                df[root].where(df[root].notna(), lambda x: [{}]).tolist()
-            )
-            expanded_column.columns = [
-                f'{root}.{attribute}' for attribute in expanded_column.columns
-            ]
-            if column not in expanded_column.columns:
-                expanded_column[column] = None
-            final_columns += list(expanded_column.columns)
-            try:
-                df = df.join(expanded_column)
-            except ValueError:
-                # columns already added (happens if trying to expand the same column twice)
-                # TODO: Catch this before by only looping unique prefixs?
-                self.logger.info("Columns have already been added, moving on...")
-                pass
-        self.logger.info(final_columns)
-        self.logger.info(list(set(final_columns)))
-        self.logger.info("Finished getting data set columns")
-        return df[list(set(final_columns))].to_dict(orient='records')
+        roots = tuple(f"{column.split('.')[0]}." for column in columns if '.' in column)
+        return [
+            {
+                column: value for column, value in data_point.items()
+                if column in columns or column.startswith(roots)
+            } for data_point in flatten(data, columns)
+        ]
 
     def organize_needed_data(
         self, new_data, table_values, table_pkey, action_map={}, in_memory=True
@@ -573,54 +745,23 @@ class Worker():
 
         else:
 
-            table_values_df = pd.DataFrame(table_values, columns=table_values[0].keys())
-            new_data_df = pd.DataFrame(new_data).dropna(subset=action_map['insert']['source'])
-
-            new_data_df, table_values_df = self.sync_df_types(new_data_df, table_values_df,
-                    action_map['insert']['source'], action_map['insert']['augur'])
-
-            need_insertion = new_data_df.merge(table_values_df, suffixes=('','_table'),
-                    how='outer', indicator=True, left_on=action_map['insert']['source'],
-                    right_on=action_map['insert']['augur']).loc[lambda x : x['_merge']=='left_only']
-
-            if 'update' in action_map:
-                new_data_df, table_values_df = self.sync_df_types(new_data_df, table_values_df,
-                    action_map['update']['source'], action_map['update']['augur'])
-
-                partitions = math.ceil(len(new_data_df) / 1000)
-                attempts = 0
-                while attempts < 50:
-                    try:
-                        need_updates = pd.DataFrame()
-                        self.logger.info(f"Trying {partitions} partitions\n")
-                        for sub_df in numpy.array_split(new_data_df, partitions):
-                            self.logger.info(f"Trying a partition, len {len(sub_df)}\n")
-                            need_updates = pd.concat([ need_updates, sub_df.merge(table_values_df, left_on=action_map['insert']['source'],
-                                right_on=action_map['insert']['augur'], suffixes=('','_table'), how='inner',
-                                indicator=False).merge(table_values_df, left_on=action_map['update']['source'],
-                                right_on=action_map['update']['augur'], suffixes=('','_table'), how='outer',
-                                indicator=True).loc[lambda x : x['_merge']=='left_only'] ])
-                            self.logger.info(f"need_updates merge: {len(sub_df)} worked\n")
-                        break
-
-                    except MemoryError as e:
-                        self.logger.info(f"new_data ({sub_df.shape}) is too large to allocate memory for " +
-                            f"need_updates df merge.\nMemoryError: {e}\nTrying again with {partitions + 1} partitions...\n")
-                        partitions += 1
-                        attempts += 1
-                    # self.logger.info(f"End attempt # {attempts}\n")
-                if attempts >= 50:
-                    self.loggger.info("Max need_updates merge attempts exceeded, cannot perform " +
-                        "updates on this repo.\n")
-                else:
-                    need_updates = need_updates.drop([column for column in list(need_updates.columns) if \
-                        column not in action_map['update']['augur'] and column not in action_map['insert']['augur']],
-                        axis='columns')
-
-                    for column in action_map['insert']['augur']:
-                        need_updates[f'b_{column}'] = need_updates[column]
+            # Hash index over the existing rows' key and update columns, each new data
+            #   point is then classified with a single lookup
+            diff_engine = DiffEngine(
+                action_map['insert']['augur'],
+                action_map['update']['augur'] if 'update' in action_map else []
+            )
+            diff_engine.index(table_values)
+            need_insertion, need_updates = diff_engine.classify(
+                new_data, action_map['insert']['source'],
+                action_map['update']['source'] if 'update' in action_map else []
+            )
 
-                    need_updates = need_updates.drop([column for column in action_map['insert']['augur']], axis='columns')
+            self.logger.info(
+                f"Table needs {len(need_insertion)} insertions and "
+                f"{len(need_updates)} updates.\n"
+            )
+            return need_insertion, need_updates
 
         return need_insertion.to_dict('records'), need_updates.to_dict('records')
 
@@ -776,6 +917,110 @@ class Worker():
         # time.sleep(.1)
         return result
 
+    def query_graphql(self, query):
+        """ Sends a query to the GitHub GraphQL api, retrying up to 3 times
+
+        :param query: String, the GraphQL query
+        :return: Dict, the 'data' of the response, or None if the query failed. Nodes that
+            were not found are null in the data, next to the nodes that were.
+        """
+        num_attempts = 0
+        while num_attempts < 3:
+            num_attempts += 1
+            try:
+                r = self.api_request('POST', GRAPHQL_URL, json={'query': query})
+            except TimeoutError:
+                self.logger.info("Request timed out. Sleeping 10 seconds and trying again...\n")
+                time.sleep(10)
+                continue
+            self.update_gh_rate_limit(r)
+
+            try:
+                with self.metrics.phase('decode'):
+                    response = r.json()
+            except ValueError:
+                self.logger.info(f"Request returned a non-json response: {r.text}\n")
+                continue
+
+            if response.get('data'):
+                return response['data']
+
+            self.logger.info(f"Request returned a non-data dict: {response}\n")
+            message = response.get('message', '')
+            if message == 'Bad credentials':
+                self.update_gh_rate_limit(r, bad_credentials=True)
+            elif 'abuse detection' in message:
+                self.update_gh_rate_limit(r, temporarily_disable=True)
+
+        return None
+
+    def query_github_users(self, logins):
+        """ Looks up GitHub users USERS_PER_QUERY at a time with aliased GraphQL user(login:)
+            fields, instead of one REST call to /users/<login> each
+
+        :param logins: List of strings, GitHub logins
+        :return: Dict of login to a dict in the contributors table layout, logins that are
+            not users (e.g. organizations, bots, deleted accounts) are left out
+        """
+        logins = list(dict.fromkeys(login for login in logins if login))
+        contributors = {}
+
+        for start in range(0, len(logins), USERS_PER_QUERY):
+            batch = logins[start:start + USERS_PER_QUERY]
+            query = users_query(batch)
+
+            self.logger.info(f"Querying {len(batch)} users at {GRAPHQL_URL} ...\n")
+            data = self.query_graphql(query)
+
+            if data is None:
+                self.logger.warning(f"Could not look up users: {batch}\n")
+                continue
+
+            for login, user in users_from_response(batch, data).items():
+                contributors[login] = {
+                    **contributor_from_user(user),
+                    'tool_source': self.tool_source,
+                    'tool_version': self.tool_version,
+                    'data_source': self.data_source
+                }
+
+        return contributors
+
+    def find_ids_from_logins(self, logins, platform='github'):
+        """ Retrieves the contributor ids of many logins at once. Logins that are not in the
+            contributors table yet are looked up in batches and inserted.
+
+        :param logins: List of strings, logins to find the primary key ids for
+        :return: Dict of login to the id of the row in our database with that login
+        """
+        cache = self.get_contributor_cache(f'{platform} api')
+        cache.fetch([{'cntrb_login': login} for login in logins])
+        unknown = list(dict.fromkeys(
+            login for login in logins if login and cache.get(cntrb_login=login) is None
+        ))
+
+        if unknown and platform == 'github':
+            self.logger.info(f"{len(unknown)} contributors need to be added...")
+            new_contributors = self.query_github_users(unknown)
+            if new_contributors:
+                self.bulk_insert(self.contributors_table, list(new_contributors.values()))
+                self.results_counter += len(new_contributors)
+                cache.fetch([
+                    {'cntrb_login': contributor['cntrb_login']}
+                    for contributor in new_contributors.values()
+                ])
+                # The logins asked for can differ from the stored ones in case
+                for login, contributor in new_contributors.items():
+                    cntrb_id = cache.get(cntrb_login=contributor['cntrb_login'])
+                    if cntrb_id is not None:
+                        cache.add(cntrb_id, cntrb_login=login)
+
+        # Logins GraphQL could not resolve and other platforms go through the REST api
+        return {
+            login: cache.get(cntrb_login=login) or self.find_id_from_login(login, platform)
+            for login in logins if login
+        }
+
     def find_id_from_login(self, login, platform='github'):
         """ Retrieves our contributor table primary key value for the contributor with
             the given GitHub login credentials, if this contributor is not there, then
@@ -784,17 +1029,12 @@ class Worker():
         :param login: String, the GitHub login username to find the primary key id for
         :return: Integer, the id of the row in our database with the matching GitHub login
         """
-        idSQL = s.sql.text("""
-            SELECT cntrb_id FROM contributors WHERE cntrb_login = '{}' \
-            AND LOWER(data_source) = '{} api'
-            """.format(login, platform))
-
-        rs = pd.read_sql(idSQL, self.db, params={})
-        data_list = [list(row) for row in rs.itertuples(index=False)]
-        try:
-            return data_list[0][0]
-        except:
-            self.logger.info('contributor needs to be added...')
+        cache = self.get_contributor_cache(f'{platform} api')
+        cache.fetch([{'cntrb_login': login}])
+        cntrb_id = cache.get(cntrb_login=login)
+        if cntrb_id is not None:
+            return cntrb_id
+        self.logger.info('contributor needs to be added...')
 
         if platform == 'github':
             cntrb_url = ("https://api.github.com/users/" + login)
@@ -805,7 +1045,7 @@ class Worker():
 
         while True:
             try:
-                r = requests.get(url=cntrb_url, headers=self.headers)
+                r = self.api_request('GET', cntrb_url)
                 break
             except TimeoutError as e:
                 self.logger.info("Request timed out. Sleeping 10 seconds and trying again...\n")
@@ -833,7 +1073,7 @@ class Worker():
                 'cntrb_company': contributor['company'] if 'company' in contributor else None,
                 'cntrb_location': contributor['location'] if 'location' in contributor else None,
                 'cntrb_created_at': contributor['created_at'] if 'created_at' in contributor else None,
-                'cntrb_canonical': None,
+                'cntrb_canonical': contributor['email'] if 'email' in contributor else None,
                 'gh_user_id': contributor['id'] if 'id' in contributor else None,
                 'gh_login': contributor['login'] if 'login' in contributor else None,
                 'gh_url': contributor['url'] if 'url' in contributor else None,
@@ -893,7 +1133,10 @@ class Worker():
         self.cntrb_id_inc = int(result.inserted_primary_key[0])
         self.logger.info(f"Inserted contributor: {cntrb['cntrb_login']}\n")
 
-        return self.find_id_from_login(login, platform)
+        # The login looked up is cached too, it can differ from the stored login in case
+        cache.add(self.cntrb_id_inc, cntrb_login=login)
+        cache.add(self.cntrb_id_inc, **cntrb)
+        return self.cntrb_id_inc
 
     def get_owner_repo(self, git_url):
         """ Gets the owner and repository names of a repository from a git url
@@ -995,25 +1238,56 @@ class Worker():
             rate_limit_header_key = 'ratelimit-remaining'
             rate_limit_reset_header_key = 'ratelimit-reset'
 
-        for oauth in [{'oauth_id': 0, 'access_token': self.config[key_name]}] + json.loads(
-            pd.read_sql(oauthSQL, self.helper_db, params={}).to_json(orient="records")
-        ):
-            if platform == 'github':
-                self.headers = {'Authorization': 'token %s' % oauth['access_token']}
-            elif platform == 'gitlab':
-                self.headers = {'Authorization': 'Bearer %s' % oauth['access_token']}
-            response = requests.get(url=url, headers=self.headers)
-            self.oauths.append({
-                    'oauth_id': oauth['oauth_id'],
-                    'access_token': oauth['access_token'],
-                    'rate_limit': int(response.headers[rate_limit_header_key]),
-                    'seconds_to_reset': (
-                        datetime.datetime.fromtimestamp(
-                            int(response.headers[rate_limit_reset_header_key])
-                        ) - datetime.datetime.now()
-                    ).total_seconds()
-                })
-            self.logger.debug("Found OAuth available for use: {}".format(self.oauths[-1]))
+        oauths = [
+            {'oauth_id': oauth['oauth_id'], 'access_token': oauth['access_token']}
+            for oauth in [{'oauth_id': 0, 'access_token': self.config[key_name]}] + json.loads(
+                pd.read_sql(oauthSQL, self.helper_db, params={}).to_json(orient="records")
+            )
+        ]
+
+        # Keys' remaining budgets are shared between workers through augur_operations, so
+        #   no key needs to be probed. Databases that predate the budget tables fall back
+        #   to probing every key.
+        self.oauth_budget = OAuthBudget(self.helper_db, platform, self.config['id'])
+        try:
+            self.oauth_budget.register(oauths)
+        except s.exc.SQLAlchemyError as e:
+            self.logger.warning(
+                "Could not register API keys in worker_oauth_budget, probing each key "
+                f"instead. Upgrading the database schema fixes this. Error: {e}"
+            )
+            self.oauth_budget = None
+
+        if self.oauth_budget is not None:
+            for oauth in oauths:
+                self.oauths.append({**oauth, 'rate_limit': None, 'seconds_to_reset': 0})
+            leased_oauth = self.oauth_budget.lease(self.oauths)
+            if leased_oauth is not None:
+                index = self.oauths.index(leased_oauth)
+                self.oauths[0], self.oauths[index] = self.oauths[index], self.oauths[0]
+            self.logger.debug("Leased OAuth from shared budgets: {}".format(self.oauths[0]))
+        elif self.cassette is not None and self.cassette.replaying:
+            # Replayed responses cost no rate limit, so the keys are not probed
+            for oauth in oauths:
+                self.oauths.append({**oauth, 'rate_limit': None, 'seconds_to_reset': 0})
+        else:
+            for oauth in oauths:
+                if platform == 'github':
+                    self.headers = {'Authorization': 'token %s' % oauth['access_token']}
+                elif platform == 'gitlab':
+                    self.headers = {'Authorization': 'Bearer %s' % oauth['access_token']}
+                response = requests.get(url=url, headers=self.headers)
+                self.oauths.append({
+                        'oauth_id': oauth['oauth_id'],
+                        'access_token': oauth['access_token'],
+                        'rate_limit': int(response.headers[rate_limit_header_key]),
+                        'seconds_to_reset': (
+                            datetime.datetime.fromtimestamp(
+                                int(response.headers[rate_limit_reset_header_key])
+                            ) - datetime.datetime.now()
+                        ).total_seconds()
+                    })
+                self.logger.debug("Found OAuth available for use: {}".format(self.oauths[-1]))
 
         if len(self.oauths) == 0:
             self.logger.info(
@@ -1030,6 +1304,7 @@ class Worker():
 
         self.logger.info("OAuth initialized\n")
 
+    @timed('insert')
     def bulk_insert(
         self, table, insert=[], update=[], unique_columns=[], update_columns=[],
         max_attempts=3, attempt_delay=3, increment_counter=True, convert_float_int=False
@@ -1063,23 +1338,12 @@ class Worker():
             update_start_time = time.time()
             while attempts < max_attempts:
                 try:
-                    update_result = self.db.execute(
-                        table.update().where(
-                                eval(
-                                    ' and '.join(
-                                        [
-                                            f"self.{table}_table.c.{key} == bindparam('b_{key}')"
-                                            for key in unique_columns
-                                        ]
-                                    )
-                                )
-                            ).values(
-                                {key: key for key in update_columns}
-                            ),
-                        update
+                    update_result = self._staged_update(
+                        table, update, unique_columns, update_columns
                     )
                     if increment_counter:
                         self.update_counter += update_result.rowcount
+                    self.metrics.count('rows_updated', update_result.rowcount)
                     self.logger.info(
                         f"Updated {update_result.rowcount} rows in "
                         f"{time.time() - update_start_time} seconds"
@@ -1094,56 +1358,202 @@ class Worker():
 
             insert_start_time = time.time()
 
-            def psql_insert_copy(table, conn, keys, data_iter):
-                """
-                Execute SQL statement inserting data
-
-                Parameters
-                ----------
-                table : pandas.io.sql.SQLTable
-                conn : sqlalchemy.engine.Engine or sqlalchemy.engine.Connection
-                keys : list of str
-                    Column names
-                data_iter : Iterable that iterates the values to be inserted
-                """
-                # gets a DBAPI connection that can provide a cursor
-                dbapi_conn = conn.connection
-                with dbapi_conn.cursor() as cur:
-                    s_buf = io.StringIO()
-                    writer = csv.writer(s_buf)
-                    writer.writerows(data_iter)
-                    s_buf.seek(0)
-
-                    columns = ', '.join('"{}"'.format(k) for k in keys)
-                    if table.schema:
-                        table_name = '{}.{}'.format(table.schema, table.name)
-                    else:
-                        table_name = table.name
-
-                    sql = 'COPY {} ({}) FROM STDIN WITH CSV'.format(
-                        table_name, columns)
-                    cur.copy_expert(sql=sql, file=s_buf)
-
-            df = pd.DataFrame(insert)
-            if convert_float_int:
-                df = self._convert_float_nan_to_int(df)
-            df.to_sql(
-                name=table.name,
-                con=self.db,
-                if_exists="append",
-                index=False,
-                method=psql_insert_copy
+            insert_result = self._staged_insert(
+                table, insert, unique_columns, update_columns,
+                convert_float_int=convert_float_int
             )
             if increment_counter:
-                self.insert_counter += len(insert)
+                self.insert_counter += insert_result.rowcount
+            self.metrics.count('rows_inserted', insert_result.rowcount)
 
             self.logger.info(
-                f"Inserted {len(insert)} rows in {time.time() - insert_start_time} seconds "
-                "thanks to postgresql's COPY FROM CSV! :)"
+                f"Inserted {insert_result.rowcount} of {len(insert)} rows in "
+                f"{time.time() - insert_start_time} seconds thanks to postgresql's COPY!"
             )
 
         return insert_result, update_result
 
+    def _csv_value(self, value):
+        """ Formats a value as a quoted CSV field for COPY, None and NaN become NULL """
+        if value is None or value is pd.NaT or (isinstance(value, float) and math.isnan(value)):
+            return ''
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        elif isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        else:
+            value = str(value)
+        return '"' + value.replace('"', '""') + '"'
+
+    def _copy_rows(
+        self, connection, table_name, columns, rows, column_types=None, convert_float_int=False
+    ):
+        """ COPYs rows into a table over the connection's open transaction. Rows are streamed
+            in the binary format when every column type has a binary encoder, otherwise they
+            are written as CSV.
+
+        :param connection: SQLAlchemy connection (inside a transaction)
+        :param table_name: String, name of the table to copy into
+        :param columns: List of strings, columns of the table that are being filled
+        :param rows: List of dicts, missing keys are copied as NULL
+        :param column_types: List of SQLAlchemy types of the columns, needed for binary COPY
+        :param convert_float_int: Boolean, write integral floats as integers in CSV
+        """
+        column_list = ', '.join(f'"{column}"' for column in columns)
+
+        if column_types is not None:
+            try:
+                stream = BinaryCopyStream(columns, column_types, rows)
+            except UnsupportedType as e:
+                self.logger.debug(f"Copying {table_name} as CSV: {e}")
+            else:
+                with connection.connection.cursor() as cursor:
+                    cursor.copy_expert(
+                        sql=f'COPY {table_name} ({column_list}) FROM STDIN WITH (FORMAT binary)',
+                        file=stream
+                    )
+                return
+
+        if convert_float_int:
+            rows = [
+                {
+                    key: int(value) if isinstance(value, float) and value.is_integer() else value
+                    for key, value in row.items()
+                } for row in rows
+            ]
+
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(','.join(self._csv_value(row.get(column)) for column in columns))
+            buffer.write('\n')
+        buffer.seek(0)
+
+        with connection.connection.cursor() as cursor:
+            cursor.copy_expert(
+                sql=f'COPY {table_name} ({column_list}) FROM STDIN WITH CSV', file=buffer
+            )
+
+    def _create_staging_table(self, connection, table, columns, name=None):
+        """ Creates a temp table with the given columns of the table, typed like the table,
+            that is dropped at the end of the transaction """
+        staging_table = name or f"staging_{table.name}"
+        column_list = ', '.join(f'"{column}"' for column in columns)
+        connection.execute(s.sql.text(f"""
+            CREATE TEMP TABLE {staging_table} ON COMMIT DROP AS
+            SELECT {column_list} FROM {table.name} WITH NO DATA
+        """))
+        return staging_table
+
+    def _has_unique_constraint(self, table, columns):
+        """ Whether a primary key, unique constraint or unique index covers exactly the
+            given columns, so they can be the target of ON CONFLICT """
+        if not columns:
+            return False
+        if not hasattr(self, '_unique_column_sets'):
+            self._unique_column_sets = {}
+        if table.name not in self._unique_column_sets:
+            inspector = s.inspect(self.db)
+            unique_sets = [
+                set(constraint['column_names'])
+                for constraint in inspector.get_unique_constraints(table.name)
+            ]
+            unique_sets += [
+                set(index['column_names']) for index in inspector.get_indexes(table.name)
+                if index['unique']
+            ]
+            unique_sets.append(
+                set(inspector.get_pk_constraint(table.name)['constrained_columns'])
+            )
+            self._unique_column_sets[table.name] = unique_sets
+        return set(columns) in self._unique_column_sets[table.name]
+
+    def _staged_update(self, table, update, unique_columns, update_columns):
+        """ COPYs the updates into a staging table and applies them with one UPDATE ... FROM
+
+        :param update: List of dicts with the update_columns and b_<unique column> keys,
+            the format organize_needed_data returns
+        """
+        staging_rows = [
+            {
+                **{column: data_point.get(column) for column in update_columns},
+                **{column: data_point.get(f'b_{column}') for column in unique_columns}
+            } for data_point in update
+        ]
+        columns = list(unique_columns) + [
+            column for column in update_columns if column not in unique_columns
+        ]
+
+        set_clause = ', '.join(
+            f'"{column}" = staging."{column}"' for column in update_columns
+        )
+        key_match = ' AND '.join(
+            f'target."{column}" = staging."{column}"' for column in unique_columns
+        )
+        changed = ' OR '.join(
+            f'target."{column}" IS DISTINCT FROM staging."{column}"' for column in update_columns
+        )
+
+        with self.db.begin() as connection:
+            staging_table = self._create_staging_table(connection, table, columns)
+            self._copy_rows(
+                connection, staging_table, columns, staging_rows,
+                column_types=[table.c[column].type for column in columns]
+            )
+            return connection.execute(s.sql.text(f"""
+                UPDATE {table.name} AS target SET {set_clause}
+                FROM {staging_table} AS staging
+                WHERE {key_match} AND ({changed})
+            """))
+
+    def _staged_insert(
+        self, table, insert, unique_columns, update_columns, convert_float_int=False
+    ):
+        """ COPYs the data points into a staging table and inserts them with one statement.
+            With a unique constraint on the unique_columns, rows that already exist are
+            updated (ON CONFLICT). Without one, rows whose unique_columns already exist are
+            skipped.
+        """
+        columns = []
+        for data_point in insert:
+            columns += [column for column in data_point.keys() if column not in columns]
+        column_list = ', '.join(f'"{column}"' for column in columns)
+
+        key_list = ', '.join(f'"{column}"' for column in unique_columns)
+        key_match = ' AND '.join(
+            f'target."{column}" = staging."{column}"' for column in unique_columns
+        )
+
+        with self.db.begin() as connection:
+            staging_table = self._create_staging_table(connection, table, columns)
+            self._copy_rows(
+                connection, staging_table, columns, insert,
+                column_types=[table.c[column].type for column in columns],
+                convert_float_int=convert_float_int
+            )
+
+            if self._has_unique_constraint(table, unique_columns):
+                conflict_action = 'DO NOTHING' if not update_columns else 'DO UPDATE SET ' + \
+                    ', '.join(f'"{column}" = EXCLUDED."{column}"' for column in update_columns)
+                insert_sql = f"""
+                    INSERT INTO {table.name} ({column_list})
+                    SELECT DISTINCT ON ({key_list}) {column_list} FROM {staging_table}
+                    ON CONFLICT ({key_list}) {conflict_action}
+                """
+            elif unique_columns:
+                insert_sql = f"""
+                    INSERT INTO {table.name} ({column_list})
+                    SELECT {column_list} FROM {staging_table} AS staging
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {table.name} AS target WHERE {key_match}
+                    )
+                """
+            else:
+                insert_sql = f"""
+                    INSERT INTO {table.name} ({column_list})
+                    SELECT {column_list} FROM {staging_table}
+                """
+            return connection.execute(s.sql.text(insert_sql))
+
     def text_clean(self, data, field):
         """ "Cleans" the provided field of each dict in the list of dicts provided
             by removing NUL (C text termination) characters
@@ -1161,33 +1571,18 @@ class Worker():
             } for data_point in data
         ]
 
-    def _add_nested_columns(self, df, column_names):
-        # todo: support deeper nests (>1) and only expand necessary columns
-        # todo: merge with _get_data_set_columns
-
-        for column in column_names:
-            if '.' not in column:
-                continue
-            root = column.split('.')[0]
-            if root not in df.columns:
-                df[root] = None
-            expanded_column = pd.DataFrame(
-                df[root].where(df[root].notna(), lambda x: [{}]).tolist()
+    def get_contributor_cache(self, data_source=None):
+        """ Returns the contributor id cache of the current task, for the contributors with the
+            given data_source (e.g. 'github api'), or for all contributors """
+        if data_source not in self.contributor_caches:
+            self.contributor_caches[data_source] = ContributorCache(
+                self.db, self.contributors_table,
+                max_size=self.config.get('contributor_cache_size', 100000),
+                data_source=data_source
             )
-            expanded_column.columns = [
-                f'{root}.{attribute}' for attribute in expanded_column.columns
-            ]
-            if column not in expanded_column.columns:
-                expanded_column[column] = None
-            try:
-                df = df.join(expanded_column)
-            except ValueError:
-                # columns already added (happens if trying to expand the same column twice)
-                # TODO: Catch this before by only looping unique prefixs?
-                pass
-
-        return df
+        return self.contributor_caches[data_source]
 
+    @timed('enrich')
     def enrich_cntrb_id(
         self, data, key, action_map_additions={'insert': {'source': [], 'augur': []}},
         platform='github', prefix=''
@@ -1198,121 +1593,69 @@ class Worker():
 
         self.logger.info(f"Enriching contributor ids for {len(data)} data points...")
 
-        source_df = pd.DataFrame(data)
-        expanded_source_df = self._add_nested_columns(
-            source_df.copy(), [key] + action_map_additions['insert']['source']
-        )
+        expanded_source = flatten(data, [key] + action_map_additions['insert']['source'])
+
+        # Identity columns of the contributors table the data points have
+        identity_sources = {'cntrb_login': key}
+        identity_sources.update({
+            augur_column: source_column for source_column, augur_column in zip(
+                action_map_additions['insert']['source'], action_map_additions['insert']['augur']
+            ) if augur_column in IDENTITY_COLUMNS
+        })
+        identities = [
+            {
+                column: data_point.get(source) for column, source in identity_sources.items()
+            } for data_point in expanded_source
+        ]
+
+        cache = self.get_contributor_cache()
+        cache.fetch(identities)
 
         # Insert cntrbs that are not in db
 
-        cntrb_action_map = {
-            'insert': {
-                'source': [key] + action_map_additions['insert']['source'],
-                'augur': ['cntrb_login'] + action_map_additions['insert']['augur']
-            }
-        }
-        source_cntrb_insert, _ = self.new_organize_needed_data(
-            expanded_source_df.to_dict(orient='records'), augur_table=self.contributors_table,
-            action_map=cntrb_action_map
-        )
+        source_cntrb_insert = []
+        new_logins = set()
+        for data_point, identity in zip(expanded_source, identities):
+            login = data_point.get(f'{prefix}login')
+            if not login or isinstance(login, float) or login in new_logins:
+                continue
+            if cache.get(**identity) is None:
+                new_logins.add(login)
+                source_cntrb_insert.append(data_point)
 
         cntrb_insert = [
             {
-                'cntrb_login': contributor[f'{prefix}login'],
-                'cntrb_created_at': None if (
-                    f'{prefix}created_at' not in contributor
-                ) else contributor[f'{prefix}created_at'],
-                'cntrb_email': None if f'{prefix}email' not in contributor else contributor[f'{prefix}email'],
-                'cntrb_company': None if f'{prefix}company' not in contributor else contributor[f'{prefix}company'],
-                'cntrb_location': None if (
-                    f'{prefix}location' not in contributor
-                ) else contributor[f'{prefix}location'],
-                'gh_user_id': None if (
-                    not contributor[f'{prefix}id']
-                ) else int(float(contributor[f'{prefix}id'])),
-                'gh_login': contributor[f'{prefix}login'],
-                'gh_url': contributor[f'{prefix}url'],
-                'gh_html_url': contributor[f'{prefix}html_url'],
-                'gh_node_id': contributor[f'{prefix}node_id'],
-                'gh_avatar_url': contributor[f'{prefix}avatar_url'],
-                'gh_gravatar_id': contributor[f'{prefix}gravatar_id'],
-                'gh_followers_url': contributor[f'{prefix}followers_url'],
-                'gh_following_url': contributor[f'{prefix}following_url'],
-                'gh_gists_url': contributor[f'{prefix}gists_url'],
-                'gh_starred_url': contributor[f'{prefix}starred_url'],
-                'gh_subscriptions_url': contributor[f'{prefix}subscriptions_url'],
-                'gh_organizations_url': contributor[f'{prefix}organizations_url'],
-                'gh_repos_url': contributor[f'{prefix}repos_url'],
-                'gh_events_url': contributor[f'{prefix}events_url'],
-                'gh_received_events_url': contributor[f'{prefix}received_events_url'],
-                'gh_type': contributor[f'{prefix}type'],
-                'gh_site_admin': contributor[f'{prefix}site_admin'],
+                **contributor,
                 'tool_source': self.tool_source,
                 'tool_version': self.tool_version,
                 'data_source': self.data_source
-            } for contributor in source_cntrb_insert if contributor[f'{prefix}login']
+            } for contributor in REST_USER_FIELDS.prefixed(prefix).records(source_cntrb_insert)
         ]
 
-        self.bulk_insert(self.contributors_table, cntrb_insert)
-
-        # Query db for inserted cntrb pkeys and add to shallow level of data
-
-        # Query
-        cntrb_pk_name = list(self.contributors_table.primary_key)[0].name
-        session = s.orm.Session(self.db)
-        inserted_pks = pd.DataFrame(
-            session.query(
-                self.contributors_table.c[cntrb_pk_name], self.contributors_table.c.cntrb_login,
-                self.contributors_table.c.gh_node_id
-            ).distinct(self.contributors_table.c.cntrb_login).order_by(
-                self.contributors_table.c.cntrb_login, self.contributors_table.c[cntrb_pk_name]
-            ).all(), columns=[cntrb_pk_name, 'cntrb_login', 'gh_node_id']
-        ).to_dict(orient='records')
-        session.close()
+        if cntrb_insert:
+            self.bulk_insert(self.contributors_table, cntrb_insert)
 
-        # Prepare for merge
-        source_columns = sorted(list(source_df.columns))
-        necessary_columns = sorted(list(set(source_columns + cntrb_action_map['insert']['source'])))
-        (source_table, inserted_pks_table), metadata, session = self._setup_postgres_merge(
-            [
-                expanded_source_df[necessary_columns].to_dict(orient='records'),
-                inserted_pks
-            ], sort=True
-        )
-        final_columns = [cntrb_pk_name] + sorted(list(set(necessary_columns)))
+            # Add the new contributors' ids to the cache
+            cache.fetch([
+                {column: contributor.get(column) for column in IDENTITY_COLUMNS}
+                for contributor in cntrb_insert
+            ])
 
-        # Merge
-        source_pk = pd.DataFrame(
-            session.query(
-                inserted_pks_table.c.cntrb_id, source_table
-            ).join(
-                source_table,
-                eval(
-                    ' and '.join(
-                        [
-                            (
-                                f"inserted_pks_table.c['{table_column}'] "
-                                f"== source_table.c['{source_column}']"
-                            ) for table_column, source_column in zip(
-                                cntrb_action_map['insert']['augur'],
-                                cntrb_action_map['insert']['source']
-                            )
-                        ]
-                    )
-                )
-            ).all(), columns=final_columns
-        )
+        # Add cntrb pkeys to shallow level of data, data points without a known contributor
+        # are left out
 
-        # Cleanup merge
-        source_pk = self._eval_json_columns(source_pk)
-        self._close_postgres_merge(metadata, session)
+        source_pk = []
+        for data_point, identity in zip(expanded_source, identities):
+            cntrb_id = cache.get(**identity)
+            if cntrb_id is not None:
+                source_pk.append({**data_point, 'cntrb_id': cntrb_id})
 
         self.logger.info(
             "Contributor id enrichment successful, result has "
             f"{len(source_pk)} data points.\n"
         )
 
-        return source_pk.to_dict(orient='records')
+        return source_pk
 
     def enrich_data_primary_keys(
         self, source_data, table, gh_merge_fields, augur_merge_fields, in_memory=False
@@ -1324,69 +1667,44 @@ class Worker():
             self.logger.info("There is no source data to enrich.\n")
             return source_data
 
-        source_df = self._add_nested_columns(pd.DataFrame(source_data), gh_merge_fields)
+        source_data = flatten(source_data, gh_merge_fields)
 
         if not in_memory:
 
-            source_pk_columns = list(source_df.columns)
-            source_pk_columns.insert(0, list(table.primary_key)[0].name)
-
-            (source_table, ), metadata, session = self._setup_postgres_merge(
-                # [self._get_data_set_columns(source_data, gh_merge_fields)]
-                [source_df.to_dict(orient='records')]
-            )
-
-            source_pk = pd.DataFrame(
-
-                # eval(
-                #     "session.query("
-                #         + ", ".join(
-                #             [
-                #                 f"table.c['{column}']" for column in [list(table.primary_key)[0].name]
-                #                 + augur_merge_fields
-                #             ]
-                #         )
-                #     + ")"
-                # )
-                session.query(
-                    table.c[list(table.primary_key)[0].name],
-                    source_table
-                    # eval(
-                    #     f"table.c['{list(table.primary_key)[0].name}'], "
-                    #     + ", ".join(
-                    #         [
-                    #             f"source_table.c['{column}']" for column in source_pk_columns
-                    #         ]
-                    #     )
-                    # )
-                ).join(
-                    source_table,
-                    eval(
-                        ' and '.join(
-                            [
-                                f"table.c['{table_column}'] == source_table.c['{source_column}']"
-                                for table_column, source_column in zip(
-                                    augur_merge_fields, gh_merge_fields
-                                )
-                            ]
-                        )
-                    )
-                ).all(), columns=source_pk_columns  # gh_merge_fields
-            )
-
-            source_pk = self._eval_json_columns(source_pk)
+            # Only the merge fields of the data points go through the merge table, with their
+            #   position, so nested objects are never stored as strings and parsed back
+            pk_column = list(table.primary_key)[0].name
+            (source_table, ), metadata, session = self._setup_postgres_merge([
+                [
+                    {
+                        'source_position': position,
+                        **{field: data_point[field] for field in gh_merge_fields}
+                    } for position, data_point in enumerate(source_data)
+                ]
+            ])
 
-            # source_pk, source_df = self.sync_df_types(
-            #     source_pk, source_df, gh_merge_fields, gh_merge_fields
-            # )
-            # source_pk = source_pk.merge(source_df, how='inner', on=gh_merge_fields)
+            matches = session.query(
+                table.c[pk_column], source_table.c['source_position']
+            ).join(
+                source_table,
+                s.and_(*[
+                    table.c[table_column] == source_table.c[source_column]
+                    for table_column, source_column in zip(augur_merge_fields, gh_merge_fields)
+                ])
+            ).all()
+
+            source_pk = [
+                {pk_column: pk, **source_data[position]} for pk, position in matches
+            ]
 
             self.logger.info("source_pk calculated successfully")
 
             self._close_postgres_merge(metadata, session)
             self.logger.info("Done")
+            return source_pk
 
         else:
+            source_df = pd.DataFrame(source_data)
 
             # s_tuple = s.tuple_([table.c[field] for field in augur_merge_fields])
             # s_tuple.__dict__['clauses'] = s_tuple.__dict__['clauses'][0].effective_value
@@ -1473,224 +1791,308 @@ class Worker():
         # self.logger.info("Data enrichment successful.\n")
         # return result
 
-    def multi_thread_urls(self, all_urls, max_attempts=5, platform='github'):
+    def stream_urls(self, all_urls, max_attempts=5, platform='github'):
+        """ Fetches all urls concurrently with the asyncio fetch engine and yields the
+            data points of each page as soon as that page arrives
+
+        :param all_urls: List of tuples, (url, extra_data dict). The extra data is merged
+            into every data point returned from that url
+        :param max_attempts: Integer, attempts per url before it is given up on
+        :param platform: String, 'github' or 'gitlab'
         """
-        :param all_urls: list of tuples
+        engine = AsyncFetchEngine(
+            self.oauths, platform=platform,
+            max_connections=self.config.get('fetch_max_connections', 50),
+            max_per_host=self.config.get('fetch_max_per_host', 50),
+            max_per_token=self.config.get('fetch_max_per_token', 10),
+            max_attempts=max_attempts, logger=self.logger, cassette=self.cassette
+        )
+
+        try:
+            for result in engine.stream(all_urls):
+                if result.status != 200:
+                    continue
+                if type(result.data) != list:
+                    self.logger.info(f"Url: {result.url} did not return a list: {result.data}")
+                    continue
+                yield [{**data, **result.extra_data} for data in result.data]
+        finally:
+            # Keep the worker's own rate limit bookkeeping in sync with what the engine saw
+            budgets = engine.token_budgets()
+            resets = engine.token_resets()
+            for oauth in self.oauths:
+                if oauth.get('access_token') in budgets:
+                    oauth['rate_limit'] = budgets[oauth['access_token']]
+                    if self.oauth_budget is not None:
+                        self.oauth_budget.report(
+                            oauth, reset_at=resets.get(oauth['access_token']), force=True
+                        )
+            self.logger.info(f"Fetch engine made {engine.request_count} requests.")
+            self.metrics.count('request_count', engine.request_count)
+            self.metrics.count('bytes_downloaded', engine.bytes_downloaded)
+            self.metrics.add_seconds('fetch', engine.fetch_seconds)
+            self.metrics.add_seconds('decode', engine.decode_seconds)
+
+    def multi_thread_urls(self, all_urls, max_attempts=5, platform='github'):
+        """ Fetches all urls concurrently and returns every data point collected
+
+        :param all_urls: List of tuples, (url, extra_data dict)
+        :return: List of dicts, data points of every page of every url
         """
 
         if not len(all_urls):
             self.logger.info("No urls to multithread, returning blank list.\n")
             return []
 
-        def load_url(url, extra_data={}):
-            try:
-                html = requests.get(url, stream=True, headers=self.headers)
-                return html, extra_data
-            except requests.exceptions.RequestException as e:
-                self.logger.info(e, url)
-
-        self.logger.info("Beginning to multithread API endpoints.")
+        self.logger.info(f"Beginning to fetch {len(all_urls)} API endpoints concurrently.")
 
         start = time.time()
 
         all_data = []
-        valid_url_count = len(all_urls)
-
-        partitions = math.ceil(len(all_urls) / 600)
-        self.logger.info(f"{len(all_urls)} urls to process. Trying {partitions} partitions. " +
-            f"Using {max(multiprocessing.cpu_count()//8, 1)} threads.")
-        for urls in numpy.array_split(all_urls, partitions):
-            attempts = 0
-            self.logger.info(f"Total data points collected so far: {len(all_data)}")
-            while len(urls) > 0 and attempts < max_attempts:
-                with concurrent.futures.ThreadPoolExecutor(
-                    max_workers=max(multiprocessing.cpu_count()//8, 1)
-                ) as executor:
-                    # Start the load operations and mark each future with its URL
-                    future_to_url = {executor.submit(load_url, *url): url for url in urls}
-                    self.logger.info("Multithreaded urls and returned status codes:")
-                    count = 0
-                    for future in concurrent.futures.as_completed(future_to_url):
-
-                        if count % 100 == 0:
-                            self.logger.info(
-                                f"Processed {len(all_data)} / {valid_url_count} urls. "
-                                f"{len(urls)} remaining in this partition."
-                            )
-                        count += 1
-
-                        url = future_to_url[future]
-                        try:
-                            response, extra_data = future.result()
-
-                            if response.status_code != 200:
-                                self.logger.info(
-                                    f"Url: {url[0]} ; Status code: {response.status_code}"
-                                )
-
-                            if response.status_code == 403 or response.status_code == 401: # 403 is rate limit, 404 is not found, 401 is bad credentials
-                                self.update_rate_limit(response, platform=platform)
-                                continue
-
-                            elif response.status_code == 200:
-                                try:
-                                    page_data = response.json()
-                                except:
-                                    page_data = json.loads(json.dumps(response.text))
-
-                                page_data = [{**data, **extra_data} for data in page_data]
-                                all_data += page_data
-
-                                if 'last' in response.links and "&page=" not in url[0]:
-                                    urls += [
-                                        (url[0] + f"&page={page}", extra_data) for page in range(
-                                            2, int(response.links['last']['url'].split('=')[-1]) + 1
-                                        )
-                                    ]
-                                urls = numpy.delete(urls, numpy.where(urls == url), axis=0)
-
-                            elif response.status_code == 404:
-                                urls = numpy.delete(urls, numpy.where(urls == url), axis=0)
-                                self.logger.info(f"Not found url: {url}\n")
-                            else:
-                                self.logger.info(
-                                    f"Unhandled response code: {response.status_code} {url}\n"
-                                )
-
-                        except Exception as e:
-                            self.logger.info(
-                                f"{url} generated an exception: {traceback.format_exc()}\n"
-                            )
-
-                attempts += 1
+        for page_data in self.stream_urls(all_urls, max_attempts=max_attempts, platform=platform):
+            all_data += page_data
 
         self.logger.info(
-            f"Processed {valid_url_count} urls and got {len(all_data)} data points "
-            f"in {time.time() - start} seconds thanks to multithreading!\n"
+            f"Processed {len(all_urls)} urls and got {len(all_data)} data points "
+            f"in {time.time() - start} seconds.\n"
         )
         return all_data
 
-    def _eval_json_columns(self, df):
-        if not len(df):
-            return df
-        for column in df.columns:
-            first_valid_value = df.fillna(method='bfill').iloc[0][column]
-            if isinstance(first_valid_value, str):
-                if (
-                    first_valid_value[0] == '{' and first_valid_value[-1] == '}'
-                    or first_valid_value[0] == '[' and first_valid_value[-1] == ']'
-                ):
-                    df[column] = df[column].fillna("'null_placeholder'").apply(eval).replace(
-                        "null_placeholder", numpy.nan
-                    ).where(df[column].notna(), lambda x: [{}])
-        return df
-
+    @timed('organize')
     def new_organize_needed_data(
         self, new_data, augur_table=None, where_clause=True, action_map={}
     ):
-
+        """ Finds the data points that need inserting and the ones that need updates by
+            merging them with augur_table on the server. The key and update columns of the
+            data points are COPYed into a temp table typed like augur_table and indexed on the
+            keys, which is then compared with the rows of augur_table matching where_clause.
+
+        :param new_data: List of dicts, api data points
+        :param augur_table: SQLAlchemy table the data is stored in
+        :param where_clause: SQLAlchemy expression restricting the rows of augur_table that
+            are compared with, e.g. self.repo_scope(table). Defaults to the whole table.
+        :param action_map: Dict with 'insert' (and optionally 'update') source/augur columns
+        :return: Tuple of (list of data points needing insertion, list of data points needing
+            updates). The update data points also hold the new value of each update column
+            and the key of the row to update as b_<key column>, the format bulk_insert expects.
+        """
         self.logger.info(f"Beginning to organize needed data from {len(new_data)} data points...")
 
         if len(new_data) == 0:
             return [], []
 
-        new_data_columns = pd.DataFrame(new_data).columns
-
-        # # new_data_columns = copy.deepcopy(action_map['insert']['source'])
-        # table_value_columns = copy.deepcopy(action_map['insert']['augur'])
-        #
-        # if 'update' in action_map:
-        #     # new_data_columns += action_map['update']['source']
-        #     table_value_columns += action_map['update']['augur']
+        key_columns = action_map['insert']['augur']
+        key_sources = action_map['insert']['source']
+        update_columns = action_map['update']['augur'] if 'update' in action_map else []
+        update_sources = action_map['update']['source'] if 'update' in action_map else []
+        merge_columns = key_columns + [
+            column for column in update_columns if column not in key_columns
+        ]
 
-        (new_data_table, ), metadata, session = self._setup_postgres_merge(
-            [
-                new_data
-                # self._get_data_set_columns(new_data, new_data_columns)
-            ]
+        merge_rows = []
+        complete_rows = set()
+        for row_index, data_point in enumerate(new_data):
+            row = {'row_index': row_index}
+            for column, source in zip(key_columns, key_sources):
+                value = source_value(data_point, source)
+                row[column] = None if value is MISSING else value
+            if any(row[column] is None for column in key_columns):
+                continue
+            complete = True
+            for column, source in zip(update_columns, update_sources):
+                value = source_value(data_point, source)
+                complete = complete and value is not MISSING
+                row[column] = None if value is MISSING else value
+            if complete:
+                # The api returned every update column, so they can be compared
+                complete_rows.add(row_index)
+            merge_rows.append(row)
+
+        merge_table = s.Table(
+            f"merge_{augur_table.name}", s.MetaData(),
+            *[s.Column(column, augur_table.c[column].type) for column in merge_columns],
+            s.Column('row_index', s.Integer)
         )
-
-        need_insertion = pd.DataFrame(
-            session.query(new_data_table).join(
-                augur_table,
-                eval(
-                    ' and '.join(
-                        [
-                            f"augur_table.c['{table_column}'] == new_data_table.c['{source_column}']"
-                            for table_column, source_column in zip(
-                                action_map['insert']['augur'], action_map['insert']['source']
-                            )
-                        ]
-                    )
-                ), isouter=True
-            ).filter(
-                augur_table.c[action_map['insert']['augur'][0]] == None
-            ).all(), columns=new_data_columns  # table_value_columns
+        key_match = s.and_(
+            *[augur_table.c[column] == merge_table.c[column] for column in key_columns]
         )
+        scope = s.sql.expression.true() if where_clause is True else where_clause
 
-        need_insertion = self._eval_json_columns(need_insertion)
-
-        # new_data_df = pd.DataFrame(new_data)
-
-        # need_insertion, new_data_df = self.sync_df_types(
-        #     need_insertion, new_data_df, table_value_columns, new_data_columns
-        # )
-        # need_insertion = need_insertion.merge(
-        #     new_data_df, how='inner', left_on=table_value_columns, right_on=new_data_columns
-        # )
+        need_insertion = []
+        need_updates = []
+        with self.db.begin() as connection:
+            self._create_staging_table(
+                connection, augur_table, merge_columns, name=merge_table.name
+            )
+            connection.execute(s.sql.text(
+                f"ALTER TABLE {merge_table.name} ADD COLUMN row_index integer"
+            ))
+            self._copy_rows(
+                connection, merge_table.name, merge_columns + ['row_index'], merge_rows,
+                column_types=[column.type for column in merge_table.c]
+            )
+            # Unbounded text (e.g. msg_text) can exceed the btree row size, those keys are
+            # left out of the index, or hashed if every key is text
+            index_columns = [
+                column for column in key_columns if not (
+                    isinstance(merge_table.c[column].type, s.types.String)
+                    and merge_table.c[column].type.length is None
+                )
+            ]
+            index_method = 'btree' if index_columns else 'hash'
+            index_list = ', '.join(f'"{column}"' for column in index_columns or key_columns[:1])
+            connection.execute(s.sql.text(
+                f"CREATE INDEX ON {merge_table.name} USING {index_method} ({index_list})"
+            ))
+            connection.execute(s.sql.text(f"ANALYZE {merge_table.name}"))
+
+            # First data point of each key that is not in the scoped table
+            insertion_rows = connection.execute(
+                s.sql.select([s.func.min(merge_table.c.row_index).label('row_index')]).where(
+                    ~s.sql.exists().where(s.and_(key_match, scope))
+                ).group_by(
+                    *[merge_table.c[column] for column in key_columns]
+                ).order_by(s.func.min(merge_table.c.row_index))
+            ).fetchall()
+            need_insertion = [new_data[row['row_index']] for row in insertion_rows]
 
-        self.logger.info("need_insertion calculated successfully")
+            self.logger.info("need_insertion calculated successfully")
 
-        need_updates = pd.DataFrame(columns=new_data_columns)
-        if 'update' in action_map:
-            need_updates = pd.DataFrame(
-                session.query(new_data_table).join(
-                    augur_table,
-                    s.and_(
-                        eval(
-                            ' and '.join(
-                                [
-                                    (
-                                        f"augur_table.c.{table_column} "
-                                        f"== new_data_table.c.{source_column}"
-                                    ) for table_column, source_column in zip(
-                                        action_map['insert']['augur'],
-                                        action_map['insert']['source']
-                                    )
-                                ]
-                            )
-                        ),
-
-                        eval(
-                            ' and '.join(
-                                [
-                                    (
-                                        f"augur_table.c.{table_column} "
-                                        f"!= new_data_table.c.{source_column}"
-                                    ) for table_column, source_column in zip(
-                                        action_map['update']['augur'],
-                                        action_map['update']['source']
-                                    )
-                                ]
-                            )
-                        )
-                    )
-                ).all(), columns=new_data_columns
-            )
-            self.logger.info("need_updates calculated successfully")
+            if update_columns:
+                update_rows = connection.execute(
+                    s.sql.select(
+                        [merge_table.c.row_index] + [
+                            augur_table.c[column].label(f'b_{column}') for column in key_columns
+                        ]
+                    ).select_from(merge_table.join(augur_table, key_match)).where(
+                        s.and_(scope, s.or_(*[
+                            augur_table.c[column].is_distinct_from(merge_table.c[column])
+                            for column in update_columns
+                        ]))
+                    ).order_by(merge_table.c.row_index)
+                ).fetchall()
+
+                updated_keys = set()
+                for row in update_rows:
+                    key = tuple(row[f'b_{column}'] for column in key_columns)
+                    if row['row_index'] not in complete_rows or key in updated_keys:
+                        continue
+                    updated_keys.add(key)
+                    data_point = new_data[row['row_index']]
+                    need_updates.append({
+                        **data_point,
+                        **{
+                            column: source_value(data_point, source)
+                            for column, source in zip(update_columns, update_sources)
+                        },
+                        **{f'b_{column}': row[f'b_{column}'] for column in key_columns}
+                    })
 
-        self._close_postgres_merge(metadata, session)
+                self.logger.info("need_updates calculated successfully")
 
         self.logger.info(
             f"Table needs {len(need_insertion)} insertions and "
             f"{len(need_updates)} updates.\n"
         )
 
-        return need_insertion.to_dict('records'), need_updates.to_dict('records')
+        return need_insertion, need_updates
+
+    def repo_scope(self, table, *path):
+        """ Where clause restricting table to the rows of the current repo, so organizing
+            data only compares it with what was collected for this repo
+
+        :param table: SQLAlchemy table
+        :param path: (column, table) pairs leading from table to a table with a repo_id
+            column, e.g. ('msg_id', self.issue_message_ref_table), ('issue_id', self.issues_table)
+            for the message table. Without one, table needs a repo_id column itself.
+        """
+        if not path:
+            return table.c.repo_id == self.repo_id
+        (column, parent_table), path = path[0], path[1:]
+        return table.c[column].in_(
+            s.sql.select([parent_table.c[column]]).where(self.repo_scope(parent_table, *path))
+        )
+
+    @property
+    def session(self):
+        """ The http session of the calling thread, which keeps its api connections open
+            across requests. Sessions are not shared, as prefetching and GraphQL threads
+            request at the same time. """
+        if not hasattr(self._sessions, 'session'):
+            self._sessions.session = requests.Session()
+        return self._sessions.session
+
+    def api_request(self, method, url, headers=None, json=None):
+        """ Requests an api url. With a cassette the response is recorded, or in replay mode
+            the recorded response is returned without touching the network.
+
+        :param method: String, 'GET' or 'POST'
+        :param url: String, the url to request
+        :param headers: Dict of headers, defaults to the headers of the key in use
+        :param json: JSON body of the request, e.g. a GraphQL query
+        :return: requests response
+        :raises CassetteMiss: when replaying a request that was never recorded
+        """
+        if self.cassette is not None and self.cassette.replaying:
+            return self.cassette.response(method, url, body=json)
+        with self.metrics.phase('fetch'):
+            response = self.session.request(
+                method, url, headers=self.headers if headers is None else headers, json=json
+            )
+        self.metrics.count('request_count')
+        self.metrics.count('bytes_downloaded', len(response.content))
+        if self.cassette is not None:
+            self.cassette.record(method, url, response, body=json)
+        return response
+
+    def conditional_get(self, url):
+        """ GET request that sends the stored validators of the url, if there are any, so
+            the api answers 304 Not Modified when the page has not changed
+
+        :param url: String, the url of the page
+        :return: requests response
+        """
+        headers = self.headers
+        # Cassettes record whole pages, so they can be replayed into an empty database
+        if self.validator_cache is not None and self.cassette is None:
+            headers = {**self.headers, **self.validator_cache.conditional_headers(url)}
+        return self.api_request('GET', url, headers=headers)
+
+    def get_high_water_mark(self, model):
+        """ Returns the latest updated_at collected for the model in the current repo, in
+            the api's timestamp format, or None if collection has to start from scratch """
+        if self.high_water_marks is None:
+            return None
+        mark = self.high_water_marks.get(self.repo_id, model)
+        self.logger.info(f"High-water mark for {model}: {mark}")
+        return mark
+
+    def stage_high_water_mark(self, model, data, field='updated_at'):
+        """ Moves the model's mark forward to the data collected in this task, stored once
+            the task completes """
+        if self.high_water_marks is not None:
+            self.high_water_marks.stage(self.repo_id, model, data, field=field)
 
     def new_paginate_endpoint(
-        self, url, action_map={}, table=None, where_clause=True, platform='github'
+        self, url, action_map={}, table=None, where_clause=True, platform='github',
+        stop_condition=None, batch_callback=None
     ):
+        """ Paginates through an endpoint and organizes the data points that need insertion
+            or updates
+
+        :param where_clause: SQLAlchemy expression restricting the rows of table the data is
+            compared with, see new_organize_needed_data
+
+        :param stop_condition: Function taking a page's data, returning True if the pages
+            after it do not need to be collected
+        :param batch_callback: Function taking a dict with 'insert', 'update' and 'all' keys
+            like the one this method returns. When given, the endpoint is streamed: pages are
+            organized and handed to the callback in batches of about stream_batch_mb
+            (worker config) of api responses, on a background thread while the next batch
+            is fetched, so at most two batches are held in memory.
+        :return: Dict with 'insert', 'update' and 'all' lists, or when streaming, the number
+            of data points collected
+        """
 
         page_number = 1
         multiple_pages = False
@@ -1700,17 +2102,45 @@ class Worker():
         forward_pagination = True
         backwards_activation = False
         last_page_number = -1
-        while True:
 
+        # Streaming mode, one batch is organized and inserted while the next is fetched
+        stream_executor = None
+        pending_batch = None
+        batch_bytes = 0
+        streamed_count = 0
+        batch_limit = self.config.get('stream_batch_mb', 16) * 1024 * 1024
+        if batch_callback is not None:
+            stream_executor = futures.ThreadPoolExecutor(max_workers=1)
+
+        def organize_batch(batch):
+            batch_insertions, batch_updates = self.new_organize_needed_data(
+                batch, augur_table=table, where_clause=where_clause, action_map=action_map
+            )
+            batch_callback({'insert': batch_insertions, 'update': batch_updates, 'all': batch})
+
+        def submit_batch(batch):
+            nonlocal pending_batch
+            if pending_batch is not None:
+                # Raises any exception of the previous batch in this thread
+                pending_batch.result()
+            self.logger.info(f"Streaming a batch of {len(batch)} data points.\n")
+            # The batch is organized and inserted for this thread's task, with its repo,
+            #   high-water marks, metrics and contributor caches
+            pending_batch = stream_executor.submit(bind_context(organize_batch), batch)
+
+        def fetch_page(page_number):
             # Multiple attempts to hit endpoint
+            response = None
+            page_data = None
             num_attempts = 0
             success = False
+            page_unchanged = False
             while num_attempts < 10:
                 self.logger.info("hitting an endpiont")
                 #    f"Hitting endpoint: ...\n"
                 #    f"{url.format(page_number)} on page number. \n")
                 try:
-                    response = requests.get(url=url.format(page_number), headers=self.headers)
+                    response = self.conditional_get(url.format(page_number))
                 except TimeoutError as e:
                     self.logger.info("Request timed out. Sleeping 10 seconds and trying again...\n")
                     time.sleep(10)
@@ -1718,10 +2148,17 @@ class Worker():
 
                 self.update_rate_limit(response, platform=platform)
 
-                try:
-                    page_data = response.json()
-                except:
-                    page_data = json.loads(json.dumps(response.text))
+                if response.status_code == 304:
+                    page_unchanged = True
+                    page_data = []
+                    success = True
+                    break
+
+                with self.metrics.phase('decode'):
+                    try:
+                        page_data = response.json()
+                    except:
+                        page_data = json.loads(json.dumps(response.text))
 
                 if type(page_data) == list:
                     success = True
@@ -1753,6 +2190,39 @@ class Worker():
                         except:
                             pass
                 num_attempts += 1
+            return response, page_data, page_unchanged, success
+
+        # Once the last page is known, the next prefetch_pages (worker config) pages are
+        #   requested concurrently while the current one is organized, they are still
+        #   handled one at a time in pagination order
+        prefetch_depth = self.config.get('prefetch_pages', 4)
+        prefetch_executor = None
+        prefetched = {}
+
+        def prefetch(page_number):
+            nonlocal prefetch_executor
+            if prefetch_executor is None:
+                prefetch_executor = futures.ThreadPoolExecutor(max_workers=prefetch_depth)
+            step = 1 if forward_pagination else -1
+            for ahead in range(prefetch_depth):
+                number = page_number + step * ahead
+                if number < 1 or number > last_page_number:
+                    break
+                if number not in prefetched:
+                    prefetched[number] = prefetch_executor.submit(
+                        bind_context(fetch_page), number
+                    )
+
+        while True:
+
+            if prefetch_depth > 1 and last_page_number != -1:
+                prefetch(page_number)
+            if page_number in prefetched:
+                response, page_data, page_unchanged, success = \
+                    prefetched.pop(page_number).result()
+            else:
+                response, page_data, page_unchanged, success = fetch_page(page_number)
+
             if not success:
                 break
 
@@ -1760,17 +2230,25 @@ class Worker():
 
             # Determine if continued pagination is needed
 
-            if len(page_data) == 0:
+            if page_unchanged:
+                self.logger.info(
+                    f"Page {page_number} has not changed since it was last collected, "
+                    "skipping it.\n"
+                )
+            elif len(page_data) == 0:
                 self.logger.info("Response was empty, breaking from pagination.\n")
                 break
 
             all_data += page_data
+            if stream_executor is not None and not page_unchanged:
+                batch_bytes += len(response.content)
 
-            if not forward_pagination:
+            if not forward_pagination and not page_unchanged:
 
                 # Checking contents of requests with what we already have in the db
                 page_insertions, page_updates = self.new_organize_needed_data(
-                    page_data, augur_table=table, action_map=action_map
+                    page_data, augur_table=table, where_clause=where_clause,
+                    action_map=action_map
                 )
 
                 # Reached a page where we already have all tuples
@@ -1794,10 +2272,28 @@ class Worker():
                 if not forward_pagination and not backwards_activation:
                     page_number = last_page_number
                     backwards_activation = True
+            elif page_unchanged and last_page_number == -1:
+                # 304 responses do not always carry the Link header
+                cached_validators = self.validator_cache.get(url.format(page_number))
+                if cached_validators and cached_validators['last_page']:
+                    last_page_number = cached_validators['last_page']
+
+            if self.validator_cache is not None and not page_unchanged:
+                self.validator_cache.stage(url.format(page_number), response, last_page_number)
 
             self.logger.info("Analyzation of page {} of {} complete\n".format(page_number,
                 int(last_page_number) if last_page_number != -1 else "*last page not known*"))
 
+            if stream_executor is not None and batch_bytes >= batch_limit:
+                streamed_count += len(all_data)
+                submit_batch(all_data)
+                all_data = []
+                batch_bytes = 0
+
+            if stop_condition is not None and stop_condition(page_data):
+                self.logger.info("Remaining pages are already collected, breaking from pagination.\n")
+                break
+
             if (page_number <= 1 and not forward_pagination) or \
                     (page_number >= last_page_number and forward_pagination):
                 self.logger.info("No more pages to check, breaking from pagination.\n")
@@ -1805,9 +2301,27 @@ class Worker():
 
             page_number = page_number + 1 if forward_pagination else page_number - 1
 
+        # Pages prefetched past where pagination stopped are not needed
+        if prefetch_executor is not None:
+            for future in prefetched.values():
+                future.cancel()
+            prefetch_executor.shutdown(wait=False)
+
+        if stream_executor is not None:
+            if all_data:
+                streamed_count += len(all_data)
+                submit_batch(all_data)
+            try:
+                if pending_batch is not None:
+                    pending_batch.result()
+            finally:
+                stream_executor.shutdown(wait=True)
+            return streamed_count
+
         if forward_pagination:
             need_insertion, need_update = self.new_organize_needed_data(
-                all_data, augur_table=table, action_map=action_map
+                all_data, augur_table=table, where_clause=where_clause,
+                action_map=action_map
             )
 
         return {
@@ -1837,10 +2351,11 @@ class Worker():
             # Multiple attempts to hit endpoint
             num_attempts = 0
             success = False
+            page_unchanged = False
             while num_attempts < 10:
                 self.logger.info(f"Hitting endpoint: {url.format(page_number)}...\n")
                 try:
-                    response = requests.get(url=url.format(page_number), headers=self.headers)
+                    response = self.conditional_get(url.format(page_number))
                 except TimeoutError as e:
                     self.logger.info("Request timed out. Sleeping 10 seconds and trying again...\n")
                     time.sleep(10)
@@ -1848,10 +2363,17 @@ class Worker():
 
                 self.update_rate_limit(response, platform=platform)
 
-                try:
-                    page_data = response.json()
-                except:
-                    page_data = json.loads(json.dumps(response.text))
+                if response.status_code == 304:
+                    page_unchanged = True
+                    page_data = []
+                    success = True
+                    break
+
+                with self.metrics.phase('decode'):
+                    try:
+                        page_data = response.json()
+                    except:
+                        page_data = json.loads(json.dumps(response.text))
 
                 if type(page_data) == list:
                     success = True
@@ -1890,13 +2412,18 @@ class Worker():
 
             # Determine if continued pagination is needed
 
-            if len(page_data) == 0:
+            if page_unchanged:
+                self.logger.info(
+                    f"Page {page_number} has not changed since it was last collected, "
+                    "skipping it.\n"
+                )
+            elif len(page_data) == 0:
                 self.logger.info("Response was empty, breaking from pagination.\n")
                 break
 
             all_data += page_data
 
-            if not forward_pagination:
+            if not forward_pagination and not page_unchanged:
 
                 # Checking contents of requests with what we already have in the db
                 page_insertions, page_updates = self.organize_needed_data(
@@ -1925,6 +2452,14 @@ class Worker():
                 if not forward_pagination and not backwards_activation:
                     page_number = last_page_number
                     backwards_activation = True
+            elif page_unchanged and last_page_number == -1:
+                # 304 responses do not always carry the Link header
+                cached_validators = self.validator_cache.get(url.format(page_number))
+                if cached_validators and cached_validators['last_page']:
+                    last_page_number = cached_validators['last_page']
+
+            if self.validator_cache is not None and not page_unchanged:
+                self.validator_cache.stage(url.format(page_number), response, last_page_number)
 
             self.logger.info("Analyzation of page {} of {} complete\n".format(page_number,
                 int(last_page_number) if last_page_number != -1 else "*last page not known*"))
@@ -1999,7 +2534,7 @@ class Worker():
             success = False
             while num_attempts < 3:
                 self.logger.info(f'Hitting endpoint: {url.format(i)}...\n')
-                r = requests.get(url=url.format(i), headers=self.headers)
+                r = self.api_request('GET', url.format(i))
 
                 self.update_rate_limit(r, platform=platform)
                 if 'last' not in r.links:
@@ -2011,10 +2546,11 @@ class Worker():
                         last_page =  r.links['last']['url'].split('&')[2].split("=")[1]
                     self.logger.info("Analyzing page {} of {}\n".format(i, int(last_page) + 1 if last_page is not None else '*last page not known*'))
 
-                try:
-                    j = r.json()
-                except:
-                    j = json.loads(json.dumps(r.text))
+                with self.metrics.phase('decode'):
+                    try:
+                        j = r.json()
+                    except:
+                        j = json.loads(json.dumps(r.text))
 
                 if type(j) != dict and type(j) != str:
                     success = True
@@ -2139,7 +2675,7 @@ class Worker():
                 #   i think that's it
                 cntrb_url = ("https://api.github.com/users/" + repo_contributor['login'])
                 self.logger.info("Hitting endpoint: " + cntrb_url + " ...\n")
-                r = requests.get(url=cntrb_url, headers=self.headers)
+                r = self.api_request('GET', cntrb_url)
                 self.update_gh_rate_limit(r)
                 contributor = r.json()
 
@@ -2235,13 +2771,19 @@ class Worker():
         source_contributors = self.paginate_endpoint(contributors_url, action_map=action_map,
             table=self.contributors_table)
 
-        contributors_insert = []
+        # The extra data of the users is looked up 100 at a time
+        users = self.query_github_users(
+            [repo_contributor['login'] for repo_contributor in source_contributors['insert']]
+        )
+        contributors_insert = list(users.values())
 
         for repo_contributor in source_contributors['insert']:
+            if repo_contributor['login'] in users:
+                continue
             # Need to hit this single contributor endpoint to get extra data
             cntrb_url = (f"https://api.github.com/users/{repo_contributor['login']}")
             self.logger.info(f"Hitting endpoint: {cntrb_url} ...\n")
-            r = requests.get(url=cntrb_url, headers=self.headers)
+            r = self.api_request('GET', cntrb_url)
             self.update_gh_rate_limit(r)
             contributor = r.json()
 
@@ -2385,7 +2927,7 @@ class Worker():
             try:
                 cntrb_compressed_url = ("https://gitlab.com/api/v4/users?search=" + repo_contributor['email'])
                 self.logger.info("Hitting endpoint: " + cntrb_compressed_url + " ...\n")
-                r = requests.get(url=cntrb_compressed_url, headers=self.headers)
+                r = self.api_request('GET', cntrb_compressed_url)
                 contributor_compressed = r.json()
 
                 email = repo_contributor['email']
@@ -2397,7 +2939,7 @@ class Worker():
 
                 cntrb_url = ("https://gitlab.com/api/v4/users/" + str(contributor_compressed[0]["id"]))
                 self.logger.info("Hitting end point to get complete contributor info now: " + cntrb_url + "...\n")
-                r = requests.get(url=cntrb_url, headers=self.headers)
+                r = self.api_request('GET', cntrb_url)
                 contributor = r.json()
 
                 cntrb = {
@@ -2493,6 +3035,22 @@ class Worker():
             self.register_task_failure(task, repo_id, "INVALID_GIVEN: Not a github/gitlab/git url.")
             return
 
+        # The collection is done, so the broker is told first and sends the next task while
+        #   this one's bookkeeping is written, the collection process picks it up right after
+        if 'task_queue_id' in task:
+            self.task_queue.complete(self.config['id'], task['task_queue_id'])
+            with self._claimed_lock:
+                self._claimed_tasks.discard(task['task_queue_id'])
+        elif self.config['offline_mode'] is False:
+
+            # Notify broker of completion
+            self.logger.info(f"Telling broker we completed task: {task_completed}\n")
+            self.logger.info(f"This task inserted: {self.results_counter + self.insert_counter} tuples " +
+                f"and updated {self.update_counter} tuples.\n")
+
+            requests.post('http://{}:{}/api/unstable/completed_task'.format(
+                self.config['host_broker'],self.config['port_broker']), json=task_completed)
+
         # Add to history table
         task_history = {
             'repo_id': repo_id,
@@ -2519,15 +3077,15 @@ class Worker():
             self.worker_job_table.c.job_model==model).values(updated_job))
         self.logger.info(f"Updated job process for model: {model}\n")
 
-        if self.config['offline_mode'] is False:
-
-            # Notify broker of completion
-            self.logger.info(f"Telling broker we completed task: {task_completed}\n")
-            self.logger.info(f"This task inserted: {self.results_counter + self.insert_counter} tuples " +
-                f"and updated {self.update_counter} tuples.\n")
+        self.store_task_metrics(repo_id, model, 'Success')
+        self.record_collection_status(repo_id, model, 'Success')
 
-            requests.post('http://{}:{}/api/unstable/completed_task'.format(
-                self.config['host_broker'],self.config['port_broker']), json=task_completed)
+        # The task's data is stored, so its pages can be revalidated next time and
+        #   the next collection can start from where this one ended
+        if self.validator_cache is not None:
+            self.validator_cache.flush()
+        if self.high_water_marks is not None:
+            self.high_water_marks.flush()
 
         # Reset results counter for next task
         self.results_counter = 0
@@ -2547,6 +3105,13 @@ class Worker():
         self.logger.error(tb)
 
         self.logger.info(f"This task inserted {self.results_counter} tuples before failure.")
+
+        # Pages of a failed task have to be collected in full again
+        if self.validator_cache is not None:
+            self.validator_cache.discard()
+        if self.high_water_marks is not None:
+            self.high_water_marks.discard()
+
         self.logger.info("Notifying broker and logging task failure in database...")
         key = (
             'github_url' if 'github_url' in task['given'] else 'git_url'
@@ -2563,8 +3128,17 @@ class Worker():
 
         task['worker_id'] = self.config['id']
         try:
-            requests.post("http://{}:{}/api/unstable/task_error".format(
-                self.config['host_broker'],self.config['port_broker']), json=task)
+            if 'task_queue_id' in task:
+                # Retried later by any worker, until the task used up its max_attempts
+                self.task_queue.fail(
+                    self.config['id'], task['task_queue_id'], e,
+                    retry_delay=self.config.get('task_retry_delay', 60)
+                )
+                with self._claimed_lock:
+                    self._claimed_tasks.discard(task['task_queue_id'])
+            else:
+                requests.post("http://{}:{}/api/unstable/task_error".format(
+                    self.config['host_broker'],self.config['port_broker']), json=task)
         except requests.exceptions.ConnectionError:
             self.logger.error("Could not send task failure message to the broker:")
             self.logger.error(e)
@@ -2604,9 +3178,56 @@ class Worker():
         )
         self.logger.info(f"Updated job process for model: {task['models'][0]}\n")
 
+        self.store_task_metrics(repo_id, task['models'][0], 'Error')
+        self.record_collection_status(repo_id, task['models'][0], 'Error')
+
         # Reset results counter for next task
         self.results_counter = 0
 
+    def store_task_metrics(self, repo_id, model, status):
+        """ Stores the phase timings and counters of the current task in
+            augur_operations.worker_task_metrics and hands them to the server process for
+            /AUGWOP/metrics
+        """
+        task = {
+            'history_id': self.history_id,
+            'repo_id': repo_id,
+            'worker': self.config['id'],
+            'job_model': model,
+            'status': status
+        }
+        try:
+            if self.has_task_metrics_table:
+                row = self.metrics.store(self.helper_db, **task)
+            else:
+                row = {**task, **self.metrics.as_dict()}
+        except Exception as e:
+            # Metrics are not worth failing a finished task over
+            self.logger.error(f"Could not store the task metrics: {e}")
+            return
+
+        self.logger.info(f"Task metrics: {row}\n")
+        row['started_at'] = row['started_at'].isoformat()
+        self._metrics_queue.put(row)
+
+    def record_collection_status(self, repo_id, model, status):
+        """ Updates the repo's row of augur_operations.repo_collection_status """
+        if self.collection_status is None:
+            return
+        try:
+            self.collection_status.record(repo_id, model, status)
+        except Exception as e:
+            self.logger.error(f"Could not record the collection status: {e}")
+
+    def task_metrics(self):
+        """ Returns the metrics of the most recently finished tasks, oldest first """
+        while True:
+            try:
+                self.recent_task_metrics.append(self._metrics_queue.get_nowait())
+            except Empty:
+                break
+        return list(self.recent_task_metrics)
+
     def get_relevant_columns(self, table, action_map={}):
         columns = copy.deepcopy(action_map['update']['augur']) if 'update' in action_map else []
         columns += action_map['value_update']['augur'] if 'value_update' in action_map else []
@@ -2636,172 +3257,295 @@ class Worker():
         )
         return values
 
-    def update_gitlab_rate_limit(self, response, bad_credentials=False, temporarily_disable=False):
-        # Try to get rate limit from request headers, sometimes it does not work (GH's issue)
-        #   In that case we just decrement from last recieved header count
-        if bad_credentials and len(self.oauths) > 1:
-            self.logger.info(
-                f"Removing oauth with bad credentials from consideration: {self.oauths[0]}"
-            )
-            del self.oauths[0]
+    def update_shared_rate_limit(
+        self, response, bad_credentials=False, temporarily_disable=False, platform='github'
+    ):
+        """ Records the rate limit of the key in use from the response headers in the shared
+            worker_oauth_budget table, and once the key is out of requests leases the key
+            with the best budget across all workers. No requests are made to find it.
+        """
+        remaining_header_key, reset_header_key = RATE_LIMIT_HEADERS[platform]
+        oauth = self.oauths[0]
 
-        if temporarily_disable:
-            self.logger.info("Gitlab rate limit reached. Temp. disabling...")
-            self.oauths[0]['rate_limit'] = 0
-        else:
+        try:
+            reset_at = int(response.headers[reset_header_key])
+        except Exception:
+            reset_at = None
+
+        if bad_credentials:
+            self.logger.warning(f"Oauth has bad credentials: {oauth}")
+        elif temporarily_disable:
+            self.logger.debug(
+                "Rate limit reached or the api thinks we are abusing it. Preventing use "
+                "of this key until its rate limit resets..."
+            )
+            oauth['rate_limit'] = 0
             try:
-                self.oauths[0]['rate_limit'] = int(response.headers['RateLimit-Remaining'])
-            except:
-                self.oauths[0]['rate_limit'] -= 1
-        self.logger.info("Updated rate limit, you have: " +
-            str(self.oauths[0]['rate_limit']) + " requests remaining.")
-        if self.oauths[0]['rate_limit'] <= 0:
+                reset_at = reset_at or int(time.time()) + int(response.headers['Retry-After'])
+            except Exception:
+                pass
+        else:
             try:
-                reset_time = response.headers['RateLimit-Reset']
-            except Exception as e:
-                self.logger.info(f"Could not get reset time from headers because of error: {e}")
-                reset_time = 3600
-            time_diff = datetime.datetime.fromtimestamp(int(reset_time)) - datetime.datetime.now()
-            self.logger.info("Rate limit exceeded, checking for other available keys to use.")
+                oauth['rate_limit'] = int(response.headers[remaining_header_key])
+            except Exception:
+                oauth['rate_limit'] = (oauth['rate_limit'] or 1) - 1
+                self.logger.info("Headers did not work, had to decrement")
+        self.logger.debug(
+            f"Updated rate limit, you have: {oauth['rate_limit']} requests remaining."
+        )
+
+        if not bad_credentials and oauth['rate_limit'] > 0:
+            self.oauth_budget.report(oauth, reset_at=reset_at)
+            return
+
+        if not bad_credentials and reset_at is None:
+            self.logger.error("Could not get reset time from headers, assuming an hour.")
+            reset_at = int(time.time()) + 3600
+        self.oauth_budget.report(
+            oauth, reset_at=reset_at, bad_credentials=bad_credentials, force=True
+        )
+        if bad_credentials and len(self.oauths) > 1:
+            self.logger.warning(f"Removing oauth with bad credentials from consideration: {oauth}")
+            del self.oauths[0]
 
-            # We will be finding oauth with the highest rate limit left out of our list of oauths
+        self.logger.info("Rate limit exceeded, leasing the key with the best shared budget.")
+        new_oauth = self.oauth_budget.lease(self.oauths)
+        if new_oauth is None:
+            self.logger.warning("Every oauth has bad credentials, keeping the current one.")
             new_oauth = self.oauths[0]
-            # Endpoint to hit solely to retrieve rate limit information from headers of the response
-            url = "https://gitlab.com/api/v4/version"
+        elif new_oauth['rate_limit'] <= 0 and new_oauth['seconds_to_reset'] > 0:
+            self.logger.info(
+                "No oauths with >0 rate limit were found, waiting for oauth with "
+                f"smallest wait time: {new_oauth}\n"
+            )
+            time.sleep(new_oauth['seconds_to_reset'])
+            new_oauth['rate_limit'] = self.oauth_budget.fresh_budget
+            new_oauth['seconds_to_reset'] = 0
 
-            other_oauths = self.oauths[0:] if len(self.oauths) > 1 else []
-            for oauth in other_oauths:
-                # self.logger.info("Inspecting rate limit info for oauth: {}\n".format(oauth))
-                self.headers = {"PRIVATE-TOKEN" : oauth['access_token']}
-                response = requests.get(url=url, headers=self.headers)
-                oauth['rate_limit'] = int(response.headers['RateLimit-Remaining'])
-                oauth['seconds_to_reset'] = (
-                    datetime.datetime.fromtimestamp(
-                        int(response.headers['RateLimit-Reset'])
-                    ) - datetime.datetime.now()
-                ).total_seconds()
-
-                # Update oauth to switch to if a higher limit is found
-                if oauth['rate_limit'] > new_oauth['rate_limit']:
-                    self.logger.info(f"Higher rate limit found in oauth: {oauth}")
-                    new_oauth = oauth
-                elif (
-                    oauth['rate_limit'] == new_oauth['rate_limit']
-                    and oauth['seconds_to_reset'] < new_oauth['seconds_to_reset']
-                ):
-                    self.logger.info(
-                        f"Lower wait time found in oauth with same rate limit: {oauth}"
-                    )
-                    new_oauth = oauth
+        # Make new oauth the 0th element in self.oauths so we know which one is in use
+        index = self.oauths.index(new_oauth)
+        self.oauths[0], self.oauths[index] = self.oauths[index], self.oauths[0]
+        self.logger.info("Using oauth: {}\n".format(self.oauths[0]))
 
-            if new_oauth['rate_limit'] <= 0 and new_oauth['seconds_to_reset'] > 0:
+        # Change headers to be using the new oauth's key
+        if platform == 'github':
+            self.headers = {'Authorization': 'token %s' % self.oauths[0]['access_token']}
+        elif platform == 'gitlab':
+            self.headers = {"PRIVATE-TOKEN" : self.oauths[0]['access_token']}
+
+    def answered_with_previous_key(self, response, platform='github'):
+        """ Whether the request of the response was made with a key other threads already
+            switched away from. Its rate limit and errors are about that key, so they are not
+            applied to the key in use, which would otherwise be disabled, deleted or
+            switched for a second time. Call with the oauth_lock held. """
+        request = getattr(response, 'request', None)
+        if request is None or not self.oauths:
+            return False
+        if platform == 'github':
+            used_headers = {'Authorization': request.headers.get('Authorization')}
+            current_headers = {'Authorization': 'token %s' % self.oauths[0]['access_token']}
+        else:
+            used_headers = {'PRIVATE-TOKEN': request.headers.get('PRIVATE-TOKEN')}
+            current_headers = {'PRIVATE-TOKEN': self.oauths[0]['access_token']}
+        if None in used_headers.values() or used_headers == current_headers:
+            return False
+        self.logger.debug("Response came from a key that is no longer in use, ignoring its limit")
+        return True
+
+    def update_gitlab_rate_limit(self, response, bad_credentials=False, temporarily_disable=False):
+        if self.cassette is not None and self.cassette.replaying:
+            # Replayed responses carry the rate limit of when they were recorded
+            return
+        # Key switching is shared by every collection thread
+        with self.oauth_lock:
+            if self.answered_with_previous_key(response, platform='gitlab'):
+                return
+            if self.oauth_budget is not None:
+                return self.update_shared_rate_limit(
+                    response, bad_credentials=bad_credentials,
+                    temporarily_disable=temporarily_disable, platform='gitlab'
+                )
+
+            # Try to get rate limit from request headers, sometimes it does not work (GH's issue)
+            #   In that case we just decrement from last recieved header count
+            if bad_credentials and len(self.oauths) > 1:
                 self.logger.info(
-                    "No oauths with >0 rate limit were found, waiting for oauth with "
-                    f"smallest wait time: {new_oauth}\n"
+                    f"Removing oauth with bad credentials from consideration: {self.oauths[0]}"
                 )
-                time.sleep(new_oauth['seconds_to_reset'])
+                del self.oauths[0]
+
+            if temporarily_disable:
+                self.logger.info("Gitlab rate limit reached. Temp. disabling...")
+                self.oauths[0]['rate_limit'] = 0
+            else:
+                try:
+                    self.oauths[0]['rate_limit'] = int(response.headers['RateLimit-Remaining'])
+                except:
+                    self.oauths[0]['rate_limit'] -= 1
+            self.logger.info("Updated rate limit, you have: " +
+                str(self.oauths[0]['rate_limit']) + " requests remaining.")
+            if self.oauths[0]['rate_limit'] <= 0:
+                try:
+                    reset_time = response.headers['RateLimit-Reset']
+                except Exception as e:
+                    self.logger.info(f"Could not get reset time from headers because of error: {e}")
+                    reset_time = 3600
+                time_diff = datetime.datetime.fromtimestamp(int(reset_time)) - datetime.datetime.now()
+                self.logger.info("Rate limit exceeded, checking for other available keys to use.")
+
+                # We will be finding oauth with the highest rate limit left out of our list of oauths
+                new_oauth = self.oauths[0]
+                # Endpoint to hit solely to retrieve rate limit information from headers of the response
+                url = "https://gitlab.com/api/v4/version"
+
+                other_oauths = self.oauths[0:] if len(self.oauths) > 1 else []
+                for oauth in other_oauths:
+                    # self.logger.info("Inspecting rate limit info for oauth: {}\n".format(oauth))
+                    # Other threads keep requesting with the headers of the key in use
+                    oauth_headers = {"PRIVATE-TOKEN" : oauth['access_token']}
+                    response = requests.get(url=url, headers=oauth_headers)
+                    oauth['rate_limit'] = int(response.headers['RateLimit-Remaining'])
+                    oauth['seconds_to_reset'] = (
+                        datetime.datetime.fromtimestamp(
+                            int(response.headers['RateLimit-Reset'])
+                        ) - datetime.datetime.now()
+                    ).total_seconds()
 
-            # Make new oauth the 0th element in self.oauths so we know which one is in use
-            index = self.oauths.index(new_oauth)
-            self.oauths[0], self.oauths[index] = self.oauths[index], self.oauths[0]
-            self.logger.info("Using oauth: {}\n".format(self.oauths[0]))
+                    # Update oauth to switch to if a higher limit is found
+                    if oauth['rate_limit'] > new_oauth['rate_limit']:
+                        self.logger.info(f"Higher rate limit found in oauth: {oauth}")
+                        new_oauth = oauth
+                    elif (
+                        oauth['rate_limit'] == new_oauth['rate_limit']
+                        and oauth['seconds_to_reset'] < new_oauth['seconds_to_reset']
+                    ):
+                        self.logger.info(
+                            f"Lower wait time found in oauth with same rate limit: {oauth}"
+                        )
+                        new_oauth = oauth
 
-            # Change headers to be using the new oauth's key
-            self.headers = {"PRIVATE-TOKEN" : self.oauths[0]['access_token']}
+                if new_oauth['rate_limit'] <= 0 and new_oauth['seconds_to_reset'] > 0:
+                    self.logger.info(
+                        "No oauths with >0 rate limit were found, waiting for oauth with "
+                        f"smallest wait time: {new_oauth}\n"
+                    )
+                    time.sleep(new_oauth['seconds_to_reset'])
 
+                # Make new oauth the 0th element in self.oauths so we know which one is in use
+                index = self.oauths.index(new_oauth)
+                self.oauths[0], self.oauths[index] = self.oauths[index], self.oauths[0]
+                self.logger.info("Using oauth: {}\n".format(self.oauths[0]))
 
-    def update_gh_rate_limit(self, response, bad_credentials=False, temporarily_disable=False):
-        # Try to get rate limit from request headers, sometimes it does not work (GH's issue)
-        #   In that case we just decrement from last recieved header count
-        if bad_credentials and len(self.oauths) > 1:
-            self.logger.warning(
-                f"Removing oauth with bad credentials from consideration: {self.oauths[0]}"
-            )
-            del self.oauths[0]
+                # Change headers to be using the new oauth's key
+                self.headers = {"PRIVATE-TOKEN" : self.oauths[0]['access_token']}
 
-        if temporarily_disable:
-            self.logger.debug(
-                "Github thinks we are abusing their api. Preventing use "
-                "of this key until its rate limit resets..."
-            )
-            self.oauths[0]['rate_limit'] = 0
-        else:
-            try:
-                self.oauths[0]['rate_limit'] = int(response.headers['X-RateLimit-Remaining'])
-                # self.logger.info("Recieved rate limit from headers\n")
-            except:
-                self.oauths[0]['rate_limit'] -= 1
-                self.logger.info("Headers did not work, had to decrement")
-        self.logger.info(
-            f"Updated rate limit, you have: {self.oauths[0]['rate_limit']} requests remaining."
-        )
-        if self.oauths[0]['rate_limit'] <= 0:
-            try:
-                reset_time = response.headers['X-RateLimit-Reset']
-            except Exception as e:
-                self.logger.error(f"Could not get reset time from headers because of error: {e}")
-                reset_time = 3600
-            time_diff = datetime.datetime.fromtimestamp(int(reset_time)) - datetime.datetime.now()
-            self.logger.info("Rate limit exceeded, checking for other available keys to use.")
 
-            # We will be finding oauth with the highest rate limit left out of our list of oauths
-            new_oauth = self.oauths[0]
-            # Endpoint to hit solely to retrieve rate limit information from headers of the response
-            url = "https://api.github.com/users/gabe-heim"
+    def update_gh_rate_limit(self, response, bad_credentials=False, temporarily_disable=False):
+        if self.cassette is not None and self.cassette.replaying:
+            # Replayed responses carry the rate limit of when they were recorded
+            return
+        # Key switching is shared by every collection thread
+        with self.oauth_lock:
+            if self.answered_with_previous_key(response, platform='github'):
+                return
+            if self.oauth_budget is not None:
+                return self.update_shared_rate_limit(
+                    response, bad_credentials=bad_credentials,
+                    temporarily_disable=temporarily_disable, platform='github'
+                )
 
-            other_oauths = self.oauths[0:] if len(self.oauths) > 1 else []
-            for oauth in other_oauths:
-                # self.logger.info("Inspecting rate limit info for oauth: {}\n".format(oauth))
-                self.headers = {'Authorization': 'token %s' % oauth['access_token']}
+            # Try to get rate limit from request headers, sometimes it does not work (GH's issue)
+            #   In that case we just decrement from last recieved header count
+            if bad_credentials and len(self.oauths) > 1:
+                self.logger.warning(
+                    f"Removing oauth with bad credentials from consideration: {self.oauths[0]}"
+                )
+                del self.oauths[0]
 
-                attempts = 3
-                success = False
-                while attempts > 0 and not success:
-                    response = requests.get(url=url, headers=self.headers)
-                    try:
-                        oauth['rate_limit'] = int(response.headers['X-RateLimit-Remaining'])
-                        oauth['seconds_to_reset'] = (
-                            datetime.datetime.fromtimestamp(
-                                int(response.headers['X-RateLimit-Reset'])
-                            ) - datetime.datetime.now()
-                        ).total_seconds()
-                        success = True
-                    except Exception as e:
+            if temporarily_disable:
+                self.logger.debug(
+                    "Github thinks we are abusing their api. Preventing use "
+                    "of this key until its rate limit resets..."
+                )
+                self.oauths[0]['rate_limit'] = 0
+            else:
+                try:
+                    self.oauths[0]['rate_limit'] = int(response.headers['X-RateLimit-Remaining'])
+                    # self.logger.info("Recieved rate limit from headers\n")
+                except:
+                    self.oauths[0]['rate_limit'] -= 1
+                    self.logger.info("Headers did not work, had to decrement")
+            self.logger.info(
+                f"Updated rate limit, you have: {self.oauths[0]['rate_limit']} requests remaining."
+            )
+            if self.oauths[0]['rate_limit'] <= 0:
+                try:
+                    reset_time = response.headers['X-RateLimit-Reset']
+                except Exception as e:
+                    self.logger.error(f"Could not get reset time from headers because of error: {e}")
+                    reset_time = 3600
+                time_diff = datetime.datetime.fromtimestamp(int(reset_time)) - datetime.datetime.now()
+                self.logger.info("Rate limit exceeded, checking for other available keys to use.")
+
+                # We will be finding oauth with the highest rate limit left out of our list of oauths
+                new_oauth = self.oauths[0]
+                # Endpoint to hit solely to retrieve rate limit information from headers of the response
+                url = "https://api.github.com/users/gabe-heim"
+
+                other_oauths = self.oauths[0:] if len(self.oauths) > 1 else []
+                for oauth in other_oauths:
+                    # self.logger.info("Inspecting rate limit info for oauth: {}\n".format(oauth))
+                    # Other threads keep requesting with the headers of the key in use
+                    oauth_headers = {'Authorization': 'token %s' % oauth['access_token']}
+
+                    attempts = 3
+                    success = False
+                    while attempts > 0 and not success:
+                        response = requests.get(url=url, headers=oauth_headers)
+                        try:
+                            oauth['rate_limit'] = int(response.headers['X-RateLimit-Remaining'])
+                            oauth['seconds_to_reset'] = (
+                                datetime.datetime.fromtimestamp(
+                                    int(response.headers['X-RateLimit-Reset'])
+                                ) - datetime.datetime.now()
+                            ).total_seconds()
+                            success = True
+                        except Exception as e:
+                            self.logger.info(
+                                f"oath method ran into error getting info from headers: {e}\n"
+                            )
+                            self.logger.info(f"{oauth_headers}\n{url}\n")
+                        attempts -= 1
+                    if not success:
+                        continue
+
+                    # Update oauth to switch to if a higher limit is found
+                    if oauth['rate_limit'] > new_oauth['rate_limit']:
+                        self.logger.info("Higher rate limit found in oauth: {}\n".format(oauth))
+                        new_oauth = oauth
+                    elif (
+                        oauth['rate_limit'] == new_oauth['rate_limit']
+                        and oauth['seconds_to_reset'] < new_oauth['seconds_to_reset']
+                    ):
                         self.logger.info(
-                            f"oath method ran into error getting info from headers: {e}\n"
+                            f"Lower wait time found in oauth with same rate limit: {oauth}\n"
                         )
-                        self.logger.info(f"{self.headers}\n{url}\n")
-                    attempts -= 1
-                if not success:
-                    continue
+                        new_oauth = oauth
 
-                # Update oauth to switch to if a higher limit is found
-                if oauth['rate_limit'] > new_oauth['rate_limit']:
-                    self.logger.info("Higher rate limit found in oauth: {}\n".format(oauth))
-                    new_oauth = oauth
-                elif (
-                    oauth['rate_limit'] == new_oauth['rate_limit']
-                    and oauth['seconds_to_reset'] < new_oauth['seconds_to_reset']
-                ):
+                if new_oauth['rate_limit'] <= 0 and new_oauth['seconds_to_reset'] > 0:
                     self.logger.info(
-                        f"Lower wait time found in oauth with same rate limit: {oauth}\n"
+                        "No oauths with >0 rate limit were found, waiting for oauth with "
+                        f"smallest wait time: {new_oauth}\n"
                     )
-                    new_oauth = oauth
+                    time.sleep(new_oauth['seconds_to_reset'])
 
-            if new_oauth['rate_limit'] <= 0 and new_oauth['seconds_to_reset'] > 0:
-                self.logger.info(
-                    "No oauths with >0 rate limit were found, waiting for oauth with "
-                    f"smallest wait time: {new_oauth}\n"
-                )
-                time.sleep(new_oauth['seconds_to_reset'])
-
-            # Make new oauth the 0th element in self.oauths so we know which one is in use
-            index = self.oauths.index(new_oauth)
-            self.oauths[0], self.oauths[index] = self.oauths[index], self.oauths[0]
-            self.logger.info("Using oauth: {}\n".format(self.oauths[0]))
+                # Make new oauth the 0th element in self.oauths so we know which one is in use
+                index = self.oauths.index(new_oauth)
+                self.oauths[0], self.oauths[index] = self.oauths[index], self.oauths[0]
+                self.logger.info("Using oauth: {}\n".format(self.oauths[0]))
 
-            # Change headers to be using the new oauth's key
-            self.headers = {'Authorization': 'token %s' % self.oauths[0]['access_token']}
+                # Change headers to be using the new oauth's key
+                self.headers = {'Authorization': 'token %s' % self.oauths[0]['access_token']}
 
     def update_rate_limit(
         self, response, bad_credentials=False, temporarily_disable=False, platform="gitlab"